@@ -0,0 +1,182 @@
+"""This file contains an admission control of database sessions. The amount
+of sessions holding connections at the same time is limited by the capacity
+of the database pool, other requests wait in queues ordered by priority:
+writes go first, then reads. A request is rejected with 503 and the
+Retry-After header if it would wait longer than ADMISSION_MAX_DELAY_MS"""
+from asyncio import (
+    get_running_loop, wait_for, Future, TimeoutError, CancelledError)
+from collections import deque
+from time import monotonic
+from typing import Any
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+from sqlalchemy.util import await_only
+from constants import (
+    ADMISSION_CONTROL, ADMISSION_CAPACITY, ADMISSION_MAX_DELAY_MS,
+    ADMISSION_RETRY_AFTER, ADMISSION_PRIORITIES)
+# --------------------------------------------------------------------------
+
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def get_priority(method: str) -> int:
+    """This function classifies a request
+    :param method: the HTTP method of the request
+    :return: an index in ADMISSION_PRIORITIES, the lower is the more
+    important
+    """
+    if method in WRITE_METHODS:
+        return ADMISSION_PRIORITIES.index('write')
+    return ADMISSION_PRIORITIES.index('read')
+
+
+def get_pool_capacity(engine: Any) -> int:
+    """This function counts connections the pool of the engine can open
+    :param engine: an instance of AsyncEngine
+    :return: the size of the pool plus the allowed overflow
+    """
+    pool = engine.pool
+    return pool.size() + max(getattr(pool, '_max_overflow', 0), 0)
+
+
+class AdmissionController:
+    """The AdmissionController class counts sessions in progress and keeps a
+    queue of waiting requests for every priority. A released slot is given to
+    the oldest request of the most important non-empty queue"""
+    def __init__(
+            self, capacity: int = ADMISSION_CAPACITY,
+            max_delay_ms: int = ADMISSION_MAX_DELAY_MS
+    ) -> None:
+        """Initialize the AdmissionController class
+        :param capacity: an amount of requests processed at the same time,
+        it is set on startup from the database pool if it is 0
+        :param max_delay_ms: the maximum time a request can wait in a queue
+        """
+        self.capacity = capacity
+        self.max_delay = max_delay_ms / 1000
+        self.in_flight = 0
+        self.queues: list[deque[tuple[float, Future]]] = [
+            deque() for _ in ADMISSION_PRIORITIES]
+        self.admitted = [0] * len(ADMISSION_PRIORITIES)
+        self.shed = [0] * len(ADMISSION_PRIORITIES)
+        self.max_queue_depth = 0
+
+    def _oldest_ahead(self, priority: int) -> float | None:
+        """This method finds the enqueue time of the oldest request which
+        would be admitted before a new request of the priority
+        :param priority: the priority of the new request
+        :return: the monotonic time or None if nobody is waiting
+        """
+        oldest = None
+        for queue in self.queues[:priority + 1]:
+            while queue and queue[0][1].done():
+                queue.popleft()
+            if queue and (oldest is None or queue[0][0] < oldest):
+                oldest = queue[0][0]
+        return oldest
+
+    async def acquire(self, priority: int) -> bool:
+        """This method waits for a free slot
+        :param priority: the priority of the request
+        :return: True if the request is admitted or False if it is shed
+        """
+        if not self.capacity or (
+                self.in_flight < self.capacity
+                and self._oldest_ahead(priority) is None):
+            self.in_flight += 1
+            self.admitted[priority] += 1
+            return True
+
+        started = monotonic()
+        oldest = self._oldest_ahead(priority)
+        if oldest is not None and started - oldest > self.max_delay:
+            self.shed[priority] += 1
+            return False
+
+        future = get_running_loop().create_future()
+        self.queues[priority].append((started, future))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        try:
+            await wait_for(future, self.max_delay)
+        except TimeoutError:
+            self.shed[priority] += 1
+            return False
+        except CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        self.admitted[priority] += 1
+        return True
+
+    def release(self) -> None:
+        """This method gives the slot of a finished request to the next
+        waiting request or frees it"""
+        for queue in self.queues:
+            while queue:
+                _, future = queue.popleft()
+                if not future.done():
+                    future.set_result(None)
+                    return
+        self.in_flight -= 1
+
+    @property
+    def queue_depth(self) -> int:
+        """This property counts waiting requests
+        :return: the amount of requests in all queues
+        """
+        return sum(
+            not future.done() for queue in self.queues for _, future in queue)
+
+    def stats(self) -> dict[str, Any]:
+        """This method returns counters of the admission control
+        :return: a dictionary with the capacity, requests in progress, the
+        current and the maximum queue depth, admitted and shed requests by
+        priority
+        """
+        return {
+            'capacity': self.capacity,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'admitted': dict(zip(ADMISSION_PRIORITIES, self.admitted)),
+            'shed': dict(zip(ADMISSION_PRIORITIES, self.shed)),
+        }
+
+
+admission = AdmissionController()
+
+
+async def take_slot(priority: int) -> bool:
+    """This function waits for a slot of the admission control if it is
+    enabled by ADMISSION_CONTROL or raise 503-exception with the Retry-After
+    header if the request is shed
+    :param priority: the priority of the request
+    :return: True if the slot is taken and must be released or False if the
+    admission control is disabled
+    """
+    if not ADMISSION_CONTROL:
+        return False
+    if not await admission.acquire(priority):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='The server is overloaded, please retry later',
+            headers={'Retry-After': str(ADMISSION_RETRY_AFTER)})
+
+    return True
+
+
+class AdmittedSession(Session):
+    """The AdmittedSession class takes a slot of the admission control
+    before it procures its first connection, so a request which is served
+    without the database takes no slot. The owner of the session releases
+    the slot after closing it if info['admitted'] is set"""
+    def get_bind(self, *args: Any, **kwargs: Any) -> Any:
+        """This method waits for a slot if the session hasn't taken it yet.
+        SQLAlchemy calls it before a connection is procured inside the
+        greenlet of an asynchronous call, so the slot can be awaited
+        :return: the bind of the session
+        """
+        priority = self.info.pop('admission_priority', None)
+        if priority is not None:
+            self.info['admitted'] = await_only(take_slot(priority))
+        return super().get_bind(*args, **kwargs)
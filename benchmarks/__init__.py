@@ -0,0 +1,3 @@
+"""This package contains a synthetic data generator, load scenarios driving
+the application routes and micro-benchmarks of data access objects, services
+and schemas"""
@@ -0,0 +1,164 @@
+"""This file contains functions to fill up a disposable database or the
+memory storage with synthetic tables, users and bookings. All existing data
+is dropped. Every user has the BENCHMARK_PASSWORD password and the user with
+id 1 is an administrator"""
+import random
+from argparse import ArgumentParser
+from asyncio import run
+from datetime import time
+from typing import Iterator
+import bcrypt
+from constants import (
+    BENCHMARK_PASSWORD, BENCHMARK_BCRYPT_ROUNDS, OCCUPANCY_COUNTERS,
+    STORAGE_BACKEND)
+from container import storage
+from dao import Base, get_engine
+from dao.memory_storage import (
+    TableRecord, UserRecord, OccupancyRecord, StorageLockedError)
+from dao.models import Table, User, Occupancy
+# --------------------------------------------------------------------------
+
+TABLE_COLUMNS = (
+    'id', 'max_persons', 'booking_time', 'persons', 'is_booked', 'version',
+    'client_id')
+USER_COLUMNS = (
+    'id', 'email', 'password', 'name', 'phone', 'is_active', 'is_admin')
+OCCUPANCY_COLUMNS = ('hour',) + OCCUPANCY_COUNTERS
+
+
+def get_email(user_id: int) -> str:
+    """This function returns an email of the generated user
+    :param user_id: the id of the user
+    :return: the email address
+    """
+    return f'user{user_id}@example.com'
+
+
+def generate_users(users: int) -> Iterator[tuple]:
+    """This function generates users. The password is hashed once with
+    BENCHMARK_BCRYPT_ROUNDS rounds to keep the generation fast
+    :param users: an amount of users
+    :return: an iterator of tuples with USER_COLUMNS values
+    """
+    password = bcrypt.hashpw(
+        BENCHMARK_PASSWORD.encode(),
+        bcrypt.gensalt(rounds=BENCHMARK_BCRYPT_ROUNDS)).decode()
+    for user_id in range(1, users + 1):
+        yield (user_id, get_email(user_id), password, f'User {user_id}',
+               f'+7{user_id:010d}', True, user_id == 1)
+
+
+def generate_tables(
+        tables: int, users: int, bookings: int,
+        occupancy: dict[int, dict[str, int]]
+) -> Iterator[tuple]:
+    """This function generates tables, the first tables are booked by random
+    users at random times between 12:00 and 22:00
+    :param tables: an amount of tables
+    :param users: an amount of users to book tables
+    :param bookings: an amount of booked tables
+    :param occupancy: a dictionary to count hourly aggregates of the
+    generated bookings to
+    :return: an iterator of tuples with TABLE_COLUMNS values
+    """
+    for table_id in range(1, tables + 1):
+        max_persons = random.choice((2, 2, 3, 4, 6, 8))
+        if table_id > bookings or not users:
+            yield table_id, max_persons, None, 0, False, 0, None
+            continue
+
+        booking_time = time(random.randint(12, 21), random.choice(
+            (0, 15, 30, 45)))
+        persons = random.randint(1, max_persons)
+        counters = occupancy.setdefault(
+            booking_time.hour, dict.fromkeys(OCCUPANCY_COUNTERS, 0))
+        counters['booked'] += 1
+        counters['covers'] += persons
+        counters['bookings'] += 1
+        yield (table_id, max_persons, booking_time, persons, True, 1,
+               random.randint(1, users))
+
+
+async def seed_database(tables: int, users: int, bookings: int) -> None:
+    """This function recreates the database spreadsheets and loads generated
+    rows by the COPY command
+    :param tables: an amount of tables
+    :param users: an amount of users
+    :param bookings: an amount of booked tables
+    """
+    occupancy = {}
+    async with get_engine().begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+        raw_connection = await connection.get_raw_connection()
+        driver = raw_connection.driver_connection
+        await driver.copy_records_to_table(
+            User.__tablename__, records=generate_users(users),
+            columns=USER_COLUMNS)
+        await driver.copy_records_to_table(
+            Table.__tablename__, columns=TABLE_COLUMNS,
+            records=generate_tables(tables, users, bookings, occupancy))
+        await driver.copy_records_to_table(
+            Occupancy.__tablename__, columns=OCCUPANCY_COLUMNS,
+            records=[
+                (hour, *(counters[c] for c in OCCUPANCY_COUNTERS))
+                for hour, counters in occupancy.items()])
+        for model in (User, Table):
+            name = model.__tablename__
+            await driver.execute(
+                f"SELECT setval(pg_get_serial_sequence('\"{name}\"', 'id'), "
+                f"(SELECT coalesce(max(id), 1) FROM \"{name}\"))")
+
+
+def seed_storage(tables: int, users: int, bookings: int) -> None:
+    """This function replaces the content of the memory storage with
+    generated records and writes a snapshot. The data directory is locked
+    while the records are written
+    :param tables: an amount of tables
+    :param users: an amount of users
+    :param bookings: an amount of booked tables
+    """
+    occupancy = {}
+    storage.lock()
+    storage.clear()
+    storage.save('user', (
+        UserRecord(**dict(zip(USER_COLUMNS, user)))
+        for user in generate_users(users)))
+    storage.save('table', (
+        TableRecord(**dict(zip(TABLE_COLUMNS, table)))
+        for table in generate_tables(tables, users, bookings, occupancy)))
+    storage.save('occupancy', (
+        OccupancyRecord(hour, **counters)
+        for hour, counters in occupancy.items()))
+    storage.close()
+
+
+def seed(tables: int, users: int, bookings: int) -> None:
+    """This function fills up the configured storage backend
+    :param tables: an amount of tables
+    :param users: an amount of users
+    :param bookings: an amount of booked tables
+    """
+    if STORAGE_BACKEND == 'memory':
+        try:
+            seed_storage(tables, users, bookings)
+        except StorageLockedError as e:
+            print(f'{e}, stop the server first')
+            return
+    else:
+        run(seed_database(tables, users, bookings))
+    print(f'Generated {tables} tables, {users} users and '
+          f'{min(tables, bookings) if users else 0} bookings')
+
+
+parser = ArgumentParser(
+    description='Replace all data with generated tables, users and bookings')
+parser.add_argument('--tables', type=int, default=10000)
+parser.add_argument('--users', type=int, default=1000)
+parser.add_argument('--bookings', type=int, default=2000)
+parser.add_argument('--seed', type=int, default=1)
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+    random.seed(arguments.seed)
+    seed(arguments.tables, arguments.users, arguments.bookings)
@@ -0,0 +1,306 @@
+"""This file contains load scenarios driving every route of the application
+in process through httpx and the ASGI transport. The data should be
+generated by benchmarks.generator first"""
+import random
+import sys
+import time as timer
+from argparse import ArgumentParser
+from asyncio import run, gather
+from contextvars import ContextVar
+from datetime import datetime, timedelta, time
+from typing import Awaitable, Callable
+import httpx
+from sqlalchemy import event
+from constants import (
+    TZ, BENCHMARK_PASSWORD, BENCHMARK_REGRESSION, STORAGE_BACKEND)
+from benchmarks.generator import get_email
+from benchmarks.report import (
+    summarize, print_results, save_baseline, compare_baseline)
+from dao import get_engine, get_replica_engine
+from main import app
+# --------------------------------------------------------------------------
+
+MIXES = {
+    'poll-heavy': {
+        'vacant': 60, 'calendar': 10, 'me': 25, 'book': 3, 'cancel': 2},
+    'booking-rush': {
+        'book': 45, 'change': 20, 'cancel': 10, 'vacant': 20, 'me': 5},
+    'login-storm': {'login': 85, 'me': 15},
+    'full': {
+        'index': 2, 'signup': 2, 'login': 6, 'logout': 2, 'vacant': 25,
+        'calendar': 5, 'me': 20, 'book': 15, 'change': 8, 'cancel': 5,
+        'analytics': 4, 'admission': 2, 'export': 3, 'import': 3},
+}
+
+current_queries: ContextVar[list[int] | None] = ContextVar(
+    'current_queries', default=None)
+
+
+def count_query(*args) -> None:
+    """This function counts SQL statements executed by the current
+    operation"""
+    queries = current_queries.get()
+    if queries is not None:
+        queries[0] += 1
+
+
+def listen_queries() -> None:
+    """This function starts counting SQL statements of the primary and the
+    replica engines. Engines are created by this call, so it does nothing
+    for the memory backend"""
+    if STORAGE_BACKEND == 'memory':
+        return
+    for counted_engine in {get_engine(), get_replica_engine()}:
+        if not event.contains(
+                counted_engine.sync_engine, 'before_cursor_execute',
+                count_query):
+            event.listen(
+                counted_engine.sync_engine, 'before_cursor_execute',
+                count_query)
+
+
+def get_booking_time() -> str:
+    """This function returns the nearest booking time which can be booked,
+    changed and cancelled now
+    :return: a string with the booking time
+    """
+    earliest = datetime.now(tz=TZ) + timedelta(hours=2)
+    if earliest.date() > datetime.now(tz=TZ).date():
+        return '21:45'
+    booking_time = max(time(12, 0), time(earliest.hour, 15 * (
+        earliest.minute // 15)))
+
+    return min(booking_time, time(21, 45)).strftime('%H:%M')
+
+
+class VirtualUser:
+    """The VirtualUser class keeps a state of the one simulated client"""
+    def __init__(self, user_id: int, tables: int) -> None:
+        """Initialize the VirtualUser class
+        :param user_id: the id of the generated user
+        :param tables: an amount of generated tables
+        """
+        self.email = get_email(user_id)
+        self.tables = tables
+        self.headers = {}
+        self.bookings: dict[int, str] = {}
+        self.etags: dict[str, str] = {}
+
+    async def login(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method logs the user in and keeps the token
+        :param client: an instance of the AsyncClient
+        :return: the response
+        """
+        response = await client.post('/user/login', json={
+            'email': self.email, 'password': BENCHMARK_PASSWORD})
+        if response.status_code == 200:
+            self.headers = {
+                'Authorization': f'Bearer {response.json()["access_token"]}'}
+        return response
+
+    async def index(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method opens the start page"""
+        return await client.get('/')
+
+    async def signup(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method registers a new user with a random email"""
+        email = f'signup-{random.getrandbits(64):x}@example.com'
+        return await client.post('/user/signup', json={
+            'email': email, 'password': BENCHMARK_PASSWORD,
+            'password_repeat': BENCHMARK_PASSWORD})
+
+    async def logout(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method logs the user out and logs in again to keep the
+        token valid for the next requests"""
+        response = await client.post('/user/logout', headers=self.headers)
+        await self.login(client)
+        return response
+
+    async def poll(
+            self, client: httpx.AsyncClient, url: str
+    ) -> httpx.Response:
+        """This method polls the list sending the ETag of the previous
+        response as a client keeping it would do
+        :param client: an instance of the AsyncClient
+        :param url: the url of the list
+        :return: the response
+        """
+        headers = self.headers
+        if url in self.etags:
+            headers = headers | {'If-None-Match': self.etags[url]}
+        response = await client.get(url, headers=headers)
+        if 'etag' in response.headers:
+            self.etags[url] = response.headers['etag']
+        return response
+
+    async def vacant(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method polls vacant tables"""
+        return await self.poll(client, '/table/vacant')
+
+    async def calendar(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method reads free booking slots for a random amount of
+        persons"""
+        return await client.get(
+            '/table/calendar', params={'persons': random.randint(1, 6)})
+
+    async def me(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method polls tables booked by the user"""
+        return await self.poll(client, '/table/me')
+
+    async def book(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method books a random table, the table can be booked
+        already"""
+        table_id = random.randint(1, self.tables)
+        response = await client.post(
+            f'/table/book/{table_id}', headers=self.headers,
+            json={'booking_time': get_booking_time(), 'persons': 1})
+        if 'etag' in response.headers:
+            self.bookings[table_id] = response.headers['etag']
+        return response
+
+    async def change(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method changes one of the bookings made by the user"""
+        if not self.bookings:
+            return await self.book(client)
+        table_id = random.choice(list(self.bookings))
+        response = await client.put(
+            f'/table/change/{table_id}', json={'persons': 2},
+            headers=self.headers | {'If-Match': self.bookings[table_id]})
+        if 'etag' in response.headers:
+            self.bookings[table_id] = response.headers['etag']
+        return response
+
+    async def cancel(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method cancels one of the bookings made by the user"""
+        if not self.bookings:
+            return await self.book(client)
+        table_id = random.choice(list(self.bookings))
+        return await client.delete(
+            f'/table/cancel/{table_id}',
+            headers=self.headers | {
+                'If-Match': self.bookings.pop(table_id)})
+
+    async def analytics(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method reads the hourly occupancy"""
+        return await client.get('/analytics/occupancy', headers=self.headers)
+
+    async def admission(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method reads the admission control counters"""
+        return await client.get('/admin/admission', headers=self.headers)
+
+    async def export(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method exports bookings of a quarter of an hour"""
+        return await client.get(
+            '/admin/bookings/export', headers=self.headers,
+            params={'time_from': '20:00', 'time_to': '20:15'})
+
+    async def import_(self, client: httpx.AsyncClient) -> httpx.Response:
+        """This method updates ten random tables by the import"""
+        rows = ''.join(
+            f'{random.randint(1, self.tables)},{random.randint(2, 8)}\n'
+            for _ in range(10))
+        return await client.post(
+            '/admin/tables/import', headers=self.headers,
+            content=f'id,max_persons\n{rows}')
+
+
+ADMIN_OPERATIONS = {'analytics', 'admission', 'export', 'import'}
+
+
+async def worker(
+        client: httpx.AsyncClient, user: VirtualUser, admin: VirtualUser,
+        mix: dict[str, int], requests: int,
+        results: dict[str, dict[str, list]]
+) -> None:
+    """This function sends the requests chosen by weights of the mix
+    :param client: an instance of the AsyncClient
+    :param user: a VirtualUser sending the requests
+    :param admin: a VirtualUser sending administrative requests
+    :param mix: a dictionary of weights by operation names
+    :param requests: an amount of requests to send
+    :param results: a dictionary to collect latencies, queries and statuses
+    """
+    operations, weights = list(mix), list(mix.values())
+    for _ in range(requests):
+        name = random.choices(operations, weights)[0]
+        sender = admin if name in ADMIN_OPERATIONS else user
+        operation: Callable[[httpx.AsyncClient], Awaitable[httpx.Response]] = (
+            getattr(sender, 'import_' if name == 'import' else name))
+        queries = [0]
+        current_queries.set(queries)
+        started = timer.perf_counter()
+        try:
+            status = (await operation(client)).status_code
+        except Exception:
+            status = 599
+        result = results.setdefault(
+            name, {'latencies': [], 'queries': [0], 'statuses': []})
+        result['latencies'].append(timer.perf_counter() - started)
+        result['queries'][0] += queries[0]
+        result['statuses'].append(status)
+
+
+async def run_mix(
+        mix_name: str, concurrency: int, requests: int, tables: int
+) -> dict[str, dict[str, float]]:
+    """This function runs the mix by concurrent virtual users
+    :param mix_name: the name of the mix from MIXES
+    :param concurrency: an amount of concurrent virtual users
+    :param requests: an amount of requests sent by all users
+    :param tables: an amount of generated tables
+    :return: a dictionary of summaries by operation names
+    """
+    listen_queries()
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app), httpx.AsyncClient(
+            transport=transport, base_url='http://benchmark') as client:
+        admin = VirtualUser(1, tables)
+        users = [VirtualUser(i + 2, tables) for i in range(concurrency)]
+        for user in [admin, *users]:
+            await user.login(client)
+
+        results = {}
+        started = timer.perf_counter()
+        await gather(*(
+            worker(client, user, admin, MIXES[mix_name],
+                   requests // concurrency, results)
+            for user in users))
+        elapsed = timer.perf_counter() - started
+
+    summaries = {}
+    for name, result in results.items():
+        summaries[name] = summarize(
+            result['latencies'], elapsed, result['queries'][0],
+            sum(status >= 500 for status in result['statuses']),
+            sum(400 <= status < 500 for status in result['statuses']))
+    summaries['total'] = summarize(
+        [x for result in results.values() for x in result['latencies']],
+        elapsed, sum(result['queries'][0] for result in results.values()),
+        sum(s['errors'] for s in summaries.values()),
+        sum(s['rejected'] for s in summaries.values()))
+
+    return summaries
+
+
+parser = ArgumentParser(description='Run a load scenario against the app')
+parser.add_argument('--mix', choices=list(MIXES), default='full')
+parser.add_argument('--concurrency', type=int, default=20)
+parser.add_argument('--requests', type=int, default=2000)
+parser.add_argument(
+    '--tables', type=int, default=10000,
+    help='an amount of tables created by the generator')
+parser.add_argument('--save', metavar='BASELINE')
+parser.add_argument('--compare', metavar='BASELINE')
+parser.add_argument('--threshold', type=float, default=BENCHMARK_REGRESSION)
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+    load_results = run(run_mix(
+        arguments.mix, arguments.concurrency, arguments.requests,
+        arguments.tables))
+    print_results(load_results)
+    if arguments.save:
+        save_baseline(arguments.save, load_results)
+    if arguments.compare and not compare_baseline(
+            arguments.compare, load_results, arguments.threshold):
+        sys.exit(1)
@@ -0,0 +1,149 @@
+"""This file contains micro-benchmarks of schemas, token utilities, services
+and data access objects. The data should be generated by
+benchmarks.generator first"""
+import random
+import sys
+import time as timer
+from argparse import ArgumentParser
+from asyncio import run
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable
+from sqlalchemy.ext.asyncio import AsyncSession
+from constants import (
+    BENCHMARK_PASSWORD, BENCHMARK_REGRESSION, STORAGE_BACKEND)
+from benchmarks.generator import get_email
+from benchmarks.load import current_queries, listen_queries
+from benchmarks.report import (
+    summarize, print_results, save_baseline, compare_baseline)
+from container import table_service, user_service
+from dao import get_session_maker
+from main import app
+from services.schemas import TableSchema, TableBookSchema, UserSchema
+from services.user_service import UserService
+from utils import create_token, decode_token, TokenCache
+# --------------------------------------------------------------------------
+
+
+def get_cases(
+        db: AsyncSession | None, tables: int
+) -> dict[str, tuple[Callable[[], Awaitable[Any]], int]]:
+    """This function returns benchmarked cases
+    :param db: an instance of the AsyncSession to be used by the cases or
+    None for the memory backend
+    :param tables: an amount of generated tables
+    :return: a dictionary of tuples with a case and a divisor of iterations
+    by case names
+    """
+    email = get_email(2)
+    token = f'Bearer {create_token(email)["access_token"]}'
+    table = TableSchema(id=1, max_persons=4, persons=2, is_booked=True)
+    uncached_service = UserService(user_service.dao)
+    uncached_service.token_cache = TokenCache(0)
+
+    async def schema_table_from_orm() -> Any:
+        return TableSchema.from_orm(table)
+
+    async def schema_book_validation() -> Any:
+        return TableBookSchema(booking_time='21:45', persons=2)
+
+    async def schema_user_email() -> Any:
+        return UserSchema(email=email, password=BENCHMARK_PASSWORD)
+
+    async def token_create() -> Any:
+        return create_token(email)
+
+    async def token_decode() -> Any:
+        return decode_token(token)
+
+    async def token_email_uncached() -> Any:
+        return uncached_service.get_email(token)
+
+    async def token_email_cached() -> Any:
+        return user_service.get_email(token)
+
+    async def service_get_by_token() -> Any:
+        return await user_service.get_by_token(db, token)
+
+    async def dao_get_by_id() -> Any:
+        return await table_service.dao.get_by_id(
+            db, random.randint(1, tables))
+
+    async def dao_get_by_email() -> Any:
+        return await user_service.dao.get_by_email(db, email)
+
+    async def dao_get_by_client_email() -> Any:
+        return await table_service.dao.get_by_client_email(db, email)
+
+    async def dao_get_all() -> Any:
+        return await table_service.dao.get_all(db)
+
+    return {
+        'schema_table_from_orm': (schema_table_from_orm, 1),
+        'schema_book_validation': (schema_book_validation, 1),
+        'schema_user_email': (schema_user_email, 1),
+        'token_create': (token_create, 1),
+        'token_decode': (token_decode, 1),
+        'token_email_uncached': (token_email_uncached, 1),
+        'token_email_cached': (token_email_cached, 1),
+        'service_get_by_token': (service_get_by_token, 10),
+        'dao_get_by_id': (dao_get_by_id, 10),
+        'dao_get_by_email': (dao_get_by_email, 10),
+        'dao_get_by_client_email': (dao_get_by_client_email, 10),
+        'dao_get_all': (dao_get_all, 100),
+    }
+
+
+async def run_cases(
+        iterations: int, tables: int, only: list[str] | None = None
+) -> dict[str, dict[str, float]]:
+    """This function runs every case sequentially counting SQL statements
+    of every case. A session is opened only for the SQL backend, so no
+    engine is created for the memory one
+    :param iterations: an amount of iterations of the fastest cases, slow
+    cases run fewer iterations
+    :param tables: an amount of generated tables
+    :param only: names of the cases to run or None to run all of them
+    :return: a dictionary of summaries by case names
+    """
+    results = {}
+    session = nullcontext() if STORAGE_BACKEND == 'memory' else (
+        get_session_maker()())
+    async with app.router.lifespan_context(app), session as db:
+        listen_queries()
+        for name, (case, divisor) in get_cases(db, tables).items():
+            if only and name not in only:
+                continue
+            queries = [0]
+            current_queries.set(queries)
+            latencies = []
+            started = timer.perf_counter()
+            for _ in range(max(1, iterations // divisor)):
+                case_started = timer.perf_counter()
+                await case()
+                latencies.append(timer.perf_counter() - case_started)
+            results[name] = summarize(
+                latencies, timer.perf_counter() - started, queries[0])
+
+    return results
+
+
+parser = ArgumentParser(description='Run micro-benchmarks')
+parser.add_argument('--iterations', type=int, default=10000)
+parser.add_argument(
+    '--tables', type=int, default=10000,
+    help='an amount of tables created by the generator')
+parser.add_argument('--only', nargs='*', metavar='CASE')
+parser.add_argument('--save', metavar='BASELINE')
+parser.add_argument('--compare', metavar='BASELINE')
+parser.add_argument('--threshold', type=float, default=BENCHMARK_REGRESSION)
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+    micro_results = run(run_cases(
+        arguments.iterations, arguments.tables, arguments.only))
+    print_results(micro_results)
+    if arguments.save:
+        save_baseline(arguments.save, micro_results)
+    if arguments.compare and not compare_baseline(
+            arguments.compare, micro_results, arguments.threshold):
+        sys.exit(1)
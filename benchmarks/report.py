@@ -0,0 +1,109 @@
+"""This file contains functions to summarize measurements, store them as
+baselines and compare new results with stored baselines"""
+import json
+import os
+from constants import BENCHMARK_BASELINES_DIR, BENCHMARK_REGRESSION
+# --------------------------------------------------------------------------
+
+
+def percentile(values: list[float], share: float) -> float:
+    """This function returns a percentile of the values using the nearest
+    rank method
+    :param values: a sorted list of values
+    :param share: a share of values which are less or equal to the result
+    :return: the percentile or 0 if there are no values
+    """
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(share * len(values)) - 1))
+    return values[rank]
+
+
+def summarize(
+        latencies: list[float], elapsed: float, queries: int = 0,
+        errors: int = 0, rejected: int = 0
+) -> dict[str, float]:
+    """This function summarizes latencies of the one kind of operations
+    :param latencies: a list of latencies in seconds
+    :param elapsed: a time spent on all operations in seconds
+    :param queries: an amount of SQL statements executed by the operations
+    :param errors: an amount of operations failed by server errors
+    :param rejected: an amount of operations rejected by client errors such
+    as an already booked table
+    :return: a dictionary with throughput, latency percentiles in
+    milliseconds and queries per operation
+    """
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'count': count,
+        'errors': errors,
+        'rejected': rejected,
+        'throughput': round(count / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'queries': round(queries / count, 2) if count else 0.0,
+    }
+
+
+def print_results(results: dict[str, dict[str, float]]) -> None:
+    """This function prints the results as a table
+    :param results: a dictionary of summaries by operation names
+    """
+    columns = ('count', 'errors', 'rejected', 'throughput', 'p50_ms',
+               'p95_ms', 'p99_ms', 'queries')
+    print(f'{"operation":<24}' + ''.join(f'{c:>12}' for c in columns))
+    for name, summary in results.items():
+        print(f'{name:<24}' + ''.join(
+            f'{summary.get(c, 0):>12}' for c in columns))
+
+
+def _baseline_path(name: str) -> str:
+    """This function returns a path of the baseline file
+    :param name: the name of the baseline
+    :return: the path to the file
+    """
+    return os.path.join(BENCHMARK_BASELINES_DIR, f'{name}.json')
+
+
+def save_baseline(name: str, results: dict[str, dict[str, float]]) -> None:
+    """This function stores the results as a baseline
+    :param name: the name of the baseline
+    :param results: a dictionary of summaries by operation names
+    """
+    os.makedirs(BENCHMARK_BASELINES_DIR, exist_ok=True)
+    with open(_baseline_path(name), 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f'Baseline is saved to {_baseline_path(name)}')
+
+
+def compare_baseline(
+        name: str, results: dict[str, dict[str, float]],
+        threshold: float = BENCHMARK_REGRESSION
+) -> bool:
+    """This function compares the results with the stored baseline and
+    prints the changes. Latencies or queries per operation grown more than
+    the threshold are reported as regressions
+    :param name: the name of the baseline
+    :param results: a dictionary of summaries by operation names
+    :param threshold: an allowed relative growth
+    :return: True if there are no regressions or False otherwise
+    """
+    with open(_baseline_path(name), encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    passed = True
+    for operation, summary in results.items():
+        previous = baseline.get(operation)
+        if not previous:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'queries'):
+            old, new = previous.get(metric, 0), summary.get(metric, 0)
+            change = (new - old) / old if old else 0.0
+            regression = change > threshold
+            passed = passed and not regression
+            print(f'{operation:<24}{metric:>10}{old:>12}{new:>12}'
+                  f'{change:>+10.1%}{"  REGRESSION" if regression else ""}')
+
+    return passed
@@ -1,5 +1,5 @@
 """This file contains constants to configure the application"""
-from datetime import timedelta, timezone
+from datetime import time, timedelta, timezone
 from pydantic import BaseSettings
 # --------------------------------------------------------------------------
 
@@ -13,13 +13,41 @@ class Settings(BaseSettings):
     POSTGRES_USER: str
     POSTGRES_HOST: str
     POSTGRES_PORT: int
+    POSTGRES_REPLICA_HOST: str | None = None
     JWT_SECRET: str
     JWT_ALGO: str
     JWT_EXP_HOURS: int
+    TOKEN_CACHE_SIZE: int = 10000
     TZ_SHIFT: float
     API_TITLE: str
     API_DESCRIPTION: str
     API_VERSION: str
+    STORAGE_BACKEND: str = 'sql'
+    MEMORY_DATA_DIR: str = 'data'
+    MEMORY_SNAPSHOT_RECORDS: int = 10000
+    MEMORY_FSYNC: bool = False
+    DB_PREWARM_CONNECTIONS: int = 0
+    STARTUP_BUDGET_MS: int = 1000
+    VACANT_MAX_AGE: int = 0
+    EXPIRY_INTERVAL: float = 30
+    TRACE_SAMPLE_RATE: float = 0.0
+    TRACE_FILE: str = 'traces.json'
+    TRACE_FORMAT: str = 'chrome'
+    SHARED_SNAPSHOT: bool = False
+    SHARED_SNAPSHOT_FILE: str = '/dev/shm/booking-tables'
+    SHARED_SNAPSHOT_CAPACITY: int = 65536
+    SHARED_SNAPSHOT_INTERVAL: float = 0.5
+    ADMISSION_CONTROL: bool = False
+    ADMISSION_CAPACITY: int = 0
+    ADMISSION_MAX_DELAY_MS: int = 500
+    ADMISSION_RETRY_AFTER: int = 1
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_MAX_CONNECTIONS: int = 0
+    SERVER_HOST: str = '0.0.0.0'
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: int = 0
+    SERVER_GRACEFUL_TIMEOUT: int = 30
 
     class Config:
         env_file = ENV_FILE
@@ -32,15 +60,93 @@ README_FILE = 'README.md'
 DB_URI = (f'postgresql+asyncpg://{sets.POSTGRES_USER}:{sets.POSTGRES_PASSWORD}'
           f'@{sets.POSTGRES_HOST}:{sets.POSTGRES_PORT}/{sets.POSTGRES_DB}')
 
+REPLICA_DB_URI = (
+    f'postgresql+asyncpg://{sets.POSTGRES_USER}:{sets.POSTGRES_PASSWORD}'
+    f'@{sets.POSTGRES_REPLICA_HOST}:{sets.POSTGRES_PORT}/{sets.POSTGRES_DB}'
+) if sets.POSTGRES_REPLICA_HOST else None
+
 JWT_SECRET = sets.JWT_SECRET
 JWT_ALGO = sets.JWT_ALGO
 JWT_EXP_HOURS = sets.JWT_EXP_HOURS
+TOKEN_CACHE_SIZE = sets.TOKEN_CACHE_SIZE
 
 TOKEN_URL = '/login'
 
 DEADLINE_HOURS = 1
+BOOKING_HOURS = 2
 TZ = timezone(timedelta(hours=sets.TZ_SHIFT))
 
 API_TITLE = sets.API_TITLE
 API_DESCRIPTION = sets.API_DESCRIPTION
 API_VERSION = sets.API_VERSION
+
+OCCUPANCY_COUNTERS = (
+    'booked', 'covers', 'bookings', 'cancellations', 'expirations')
+
+IMPORT_STAGING_TABLE = 'table_import'
+IMPORT_PROGRESS_ROWS = 10000
+IMPORT_MAX_ERRORS = 100
+IMPORT_CHUNK_BYTES = 64 * 1024
+IMPORT_BATCH_ROWS = 1000
+
+EXPORT_CHUNK_ROWS = 1000
+EXPORT_COLUMNS = (
+    'id', 'booking_time', 'persons', 'client_name', 'client_phone',
+    'client_email')
+EXPORT_MEDIA_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+# bookings have no date and are made for today, so the calendar is one day
+CALENDAR_DAYS = 1
+CALENDAR_OPENS = time(12, 0)
+CALENDAR_CLOSES = time(22, 0)
+CALENDAR_SLOT_MINUTES = 15
+
+VACANT_CACHE_CONTROL = (
+    f'public, max-age={sets.VACANT_MAX_AGE}, must-revalidate')
+CLIENT_CACHE_CONTROL = 'private, no-cache'
+EXPIRY_INTERVAL = sets.EXPIRY_INTERVAL
+
+STORAGE_BACKEND = sets.STORAGE_BACKEND
+MEMORY_DATA_DIR = sets.MEMORY_DATA_DIR
+MEMORY_SNAPSHOT_RECORDS = sets.MEMORY_SNAPSHOT_RECORDS
+MEMORY_FSYNC = sets.MEMORY_FSYNC
+MEMORY_WAL_FILE = 'wal.ndjson'
+MEMORY_OLD_WAL_FILE = 'wal.old.ndjson'
+MEMORY_SNAPSHOT_FILE = 'snapshot.json'
+MEMORY_LOCK_FILE = 'lock'
+
+DB_PREWARM_CONNECTIONS = sets.DB_PREWARM_CONNECTIONS
+DB_POOL_SIZE = sets.DB_POOL_SIZE
+DB_MAX_OVERFLOW = sets.DB_MAX_OVERFLOW
+DB_MAX_CONNECTIONS = sets.DB_MAX_CONNECTIONS
+STARTUP_BUDGET_MS = sets.STARTUP_BUDGET_MS
+
+TRACE_SAMPLE_RATE = sets.TRACE_SAMPLE_RATE
+TRACE_FILE = sets.TRACE_FILE
+TRACE_FORMAT = sets.TRACE_FORMAT
+TRACE_BUFFER_TRACES = 100
+TRACE_STATEMENT_CHARS = 1000
+
+SHARED_SNAPSHOT = sets.SHARED_SNAPSHOT and STORAGE_BACKEND != 'memory'
+SHARED_SNAPSHOT_FILE = sets.SHARED_SNAPSHOT_FILE
+SHARED_SNAPSHOT_CAPACITY = sets.SHARED_SNAPSHOT_CAPACITY
+SHARED_SNAPSHOT_INTERVAL = sets.SHARED_SNAPSHOT_INTERVAL
+SHARED_SNAPSHOT_MAX_AGE = SHARED_SNAPSHOT_INTERVAL * 10
+SHARED_SNAPSHOT_RETRIES = 100
+
+ADMISSION_CONTROL = sets.ADMISSION_CONTROL
+ADMISSION_CAPACITY = sets.ADMISSION_CAPACITY
+ADMISSION_MAX_DELAY_MS = sets.ADMISSION_MAX_DELAY_MS
+ADMISSION_RETRY_AFTER = sets.ADMISSION_RETRY_AFTER
+ADMISSION_PRIORITIES = ('write', 'read')
+
+SERVER_HOST = sets.SERVER_HOST
+SERVER_PORT = sets.SERVER_PORT
+SERVER_WORKERS = sets.SERVER_WORKERS
+SERVER_GRACEFUL_TIMEOUT = sets.SERVER_GRACEFUL_TIMEOUT
+SERVER_READY_TIMEOUT = 60
+
+BENCHMARK_BASELINES_DIR = 'benchmarks/baselines'
+BENCHMARK_PASSWORD = 'benchmark-password'
+BENCHMARK_BCRYPT_ROUNDS = 4
+BENCHMARK_REGRESSION = 0.1
@@ -1,7 +1,29 @@
 """This file contains prepared instances to be used in the another units"""
+from constants import STORAGE_BACKEND, SHARED_SNAPSHOT
+from dao.analytics_dao import AnalyticsDao
+from dao.memory_dao import MemoryTableDao, MemoryUserDao, MemoryAnalyticsDao
+from dao.memory_storage import MemoryStorage
+from dao.shared_snapshot import SharedSnapshot
+from dao.table_dao import TableDao
+from dao.user_dao import UserDao
+from services.analytics_service import AnalyticsService
 from services.table_service import TableService
 from services.user_service import UserService
 # -------------------------------------------------------------------------
 
-user_service = UserService()
-table_service = TableService()
+if STORAGE_BACKEND == 'memory':
+    storage = MemoryStorage()
+    table_dao = MemoryTableDao(storage)
+    user_dao = MemoryUserDao(storage)
+    analytics_dao = MemoryAnalyticsDao(storage)
+else:
+    storage = None
+    table_dao = TableDao()
+    user_dao = UserDao()
+    analytics_dao = AnalyticsDao()
+
+snapshot = SharedSnapshot() if SHARED_SNAPSHOT else None
+
+user_service = UserService(user_dao)
+analytics_service = AnalyticsService(analytics_dao)
+table_service = TableService(table_dao, analytics_service, snapshot)
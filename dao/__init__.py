@@ -1,14 +1,66 @@
 """This file contains a different database objects to create db models and
-provides connection to the database"""
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+provides connection to the database. Engines and session makers are created
+on first use, so importing the application doesn't load the database driver
+and the memory backend never creates them"""
+from functools import cache
+from typing import Any
+from sqlalchemy.ext.asyncio import (
+    create_async_engine, AsyncSession, AsyncEngine)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from constants import DB_URI
+from constants import DB_URI, REPLICA_DB_URI, DB_POOL_SIZE, DB_MAX_OVERFLOW
 # --------------------------------------------------------------------------
 
-engine = create_async_engine(DB_URI)
+Base = declarative_base()
 
-SessionLocal = sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False)
 
-Base = declarative_base()
+@cache
+def get_engine() -> AsyncEngine:
+    """This function returns the engine of the primary database
+    :return: AsyncEngine instance
+    """
+    return create_async_engine(
+        DB_URI, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+
+@cache
+def get_replica_engine() -> AsyncEngine:
+    """This function returns the engine of the read replica or the primary
+    engine if the replica is not configured
+    :return: AsyncEngine instance
+    """
+    if not REPLICA_DB_URI:
+        return get_engine()
+    return create_async_engine(
+        REPLICA_DB_URI, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+
+
+@cache
+def get_session_maker(replica: bool = False) -> sessionmaker:
+    """This function returns a session maker bound to the primary database or
+    to the read replica
+    :param replica: a boolean indicating whether to use the read replica
+    :return: sessionmaker instance
+    """
+    return sessionmaker(
+        get_replica_engine() if replica else get_engine(),
+        class_=AsyncSession, expire_on_commit=False)
+
+
+LAZY_ATTRIBUTES = {
+    'engine': get_engine,
+    'replica_engine': get_replica_engine,
+    'SessionLocal': get_session_maker,
+    'ReplicaSessionLocal': lambda: get_session_maker(True),
+}
+
+
+def __getattr__(name: str) -> Any:
+    """This function creates engines and session makers when they are
+    imported as module attributes for the first time
+    :param name: the name of the attribute
+    :return: the engine or the session maker
+    """
+    if name in LAZY_ATTRIBUTES:
+        return LAZY_ATTRIBUTES[name]()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
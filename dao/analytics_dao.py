@@ -0,0 +1,57 @@
+"""This file contains an AnalyticsDao class serves as a data access object"""
+from typing import Any, Sequence
+from sqlalchemy import select, Row, RowMapping
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from constants import OCCUPANCY_COUNTERS
+from dao.models import Occupancy
+from tracing import trace_methods
+# --------------------------------------------------------------------------
+
+
+@trace_methods('dao')
+class AnalyticsDao:
+    """The AnalyticsDao class provides access to the occupancy spreadsheet"""
+    def __init__(self) -> None:
+        """Initialize the AnalyticsDao class"""
+        self.model = Occupancy
+
+    async def get_all(
+            self, db: AsyncSession
+    ) -> Sequence[Row | RowMapping | Any]:
+        """This method returns the hourly aggregates. The spreadsheet holds a
+        single row per hour so the reading doesn't depend on booking history
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :return: a list of Occupancy models ordered by hour
+        """
+        occupancy = await db.execute(
+            select(self.model).order_by(self.model.hour))
+
+        return occupancy.scalars().all()
+
+    async def apply(
+            self, db: AsyncSession, deltas: dict[int, dict[str, int]]
+    ) -> None:
+        """This method adds the provided deltas to the hourly aggregates by
+        a single upsert statement. It doesn't commit, the aggregates are
+        changed in the transaction of the booking change and errors are
+        raised to roll it back
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param deltas: a dictionary where keys are hours and values are
+        dictionaries with counter deltas
+        """
+        rows = [
+            {'hour': hour} | {
+                counter: counters.get(counter, 0)
+                for counter in OCCUPANCY_COUNTERS}
+            for hour, counters in deltas.items()]
+        statement = insert(self.model).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[self.model.hour],
+            set_={
+                counter: getattr(self.model, counter) + getattr(
+                    statement.excluded, counter)
+                for counter in OCCUPANCY_COUNTERS})
+        await db.execute(statement)
@@ -0,0 +1,389 @@
+"""This file contains data access objects working with the MemoryStorage
+instead of the database. They have the same interface as the SQL ones so the
+services don't depend on the chosen storage backend"""
+from collections import namedtuple
+from datetime import time
+from typing import Any, AsyncIterable, AsyncIterator, Sequence
+from sqlalchemy.ext.asyncio import AsyncSession
+from constants import EXPORT_CHUNK_ROWS, IMPORT_BATCH_ROWS, OCCUPANCY_COUNTERS
+from dao.analytics_dao import AnalyticsDao
+from dao.memory_storage import (
+    MemoryStorage, TableRecord, UserRecord, OccupancyRecord, copy_record,
+    to_dict)
+from dao.table_dao import TableDao, Recorder
+from dao.user_dao import UserDao
+from services.schemas import TableBookSchema, UserRegisterSchema
+from tracing import trace_methods
+# --------------------------------------------------------------------------
+
+BookingRow = namedtuple(
+    'BookingRow',
+    TableRecord.__slots__ + ('previous_time', 'previous_persons'))
+
+
+@trace_methods('dao')
+class MemoryTableDao(TableDao):
+    """The MemoryTableDao class provides access to the tables kept in the
+    MemoryStorage"""
+    def __init__(self, storage: MemoryStorage) -> None:
+        """Initialize the MemoryTableDao class
+        :param storage: a MemoryStorage instance keeping the tables
+        """
+        super().__init__()
+        self.storage = storage
+
+    async def get_all(self, db: AsyncSession) -> list[TableRecord]:
+        """This method returns a list of all vacant tables
+        :param db: an instance of the AsyncSession, it is not used
+        :return: a list of TableRecords
+        """
+        tables = self.storage.tables
+
+        return [copy_record(tables[i]) for i in sorted(self.storage.vacant)]
+
+    async def get_snapshot_rows(self, db: AsyncSession) -> list[TableRecord]:
+        """This method returns all tables without copying them, the caller
+        must not change them
+        :param db: an instance of the AsyncSession, it is not used
+        :return: a list of TableRecords sorted by id
+        """
+        tables = self.storage.tables
+
+        return [tables[i] for i in sorted(tables)]
+
+    async def get_version(self, db: AsyncSession) -> int:
+        """This method returns the current availability version
+        :param db: an instance of the AsyncSession, it is not used
+        :return: the availability version of the storage
+        """
+        return self.storage.availability_version
+
+    def get_bumped_version(self, db: AsyncSession) -> int:
+        """This method returns the availability version made by the last
+        change. The storage is changed only by the event loop thread, so the
+        version is the one of the change if it is called before the caller
+        awaits anything else
+        :param db: an instance of the AsyncSession, it is not used
+        :return: the availability version of the storage
+        """
+        return self.storage.availability_version
+
+    async def get_client_version(
+            self, db: AsyncSession, user: UserRecord
+    ) -> int:
+        """This method returns the version of tables booked by the user
+        :param db: an instance of the AsyncSession, it is not used
+        :param user: the UserRecord
+        :return: the version of the user's tables
+        """
+        return self.storage.client_versions.get(
+            user.id, self.storage.initial_version)
+
+    async def get_by_id(
+            self, db: AsyncSession, table_id: int
+    ) -> TableRecord | None:
+        """This method returns a table by its id
+        :param db: an instance of the AsyncSession, it is not used
+        :param table_id: the id of the searching table
+        :return: the TableRecord or None if table was not found
+        """
+        table = self.storage.tables.get(table_id)
+
+        return copy_record(table) if table else None
+
+    async def book_one(
+            self, db: AsyncSession, table: TableBookSchema,
+            record: Recorder | None = None
+    ) -> TableRecord | None:
+        """This method serves to book a new table
+        :param db: an instance of the AsyncSession, it is not used
+        :param table: an instance of the TableBookSchema class
+        :param record: a coroutine function called with the booked table in
+        the same transaction
+        :return: The TableRecord or None if booking the table was failed or
+        the table is booked or doesn't fit the persons
+        """
+        current = self.storage.tables.get(table.id)
+        if (
+                not current or current.is_booked
+                or table.persons > current.max_persons
+        ):
+            return None
+
+        new_table = copy_record(current)
+        for field, value in table.dict(
+                exclude_none=True, exclude={'max_persons'}).items():
+            setattr(new_table, field, value)
+        new_table.version += 1
+        try:
+            with self.storage.transaction():
+                self.storage.save('table', [new_table])
+                if record:
+                    await record(db, new_table)
+            return copy_record(new_table)
+        except Exception as e:
+            print(f'There was an error during booking: {e}')
+            return None
+
+    async def get_by_client_email(
+            self, db: AsyncSession, email: str
+    ) -> list[TableRecord]:
+        """This method returns tables booked by the client with the email
+        :param db: an instance of the AsyncSession, it is not used
+        :param email: the email address of the client of the searching table
+        :return: a list of TableRecords
+        """
+        user_id = self.storage.users_by_email.get(email)
+        table_ids = self.storage.client_tables.get(user_id, ())
+        tables = self.storage.tables
+
+        return [copy_record(tables[i]) for i in sorted(table_ids)]
+
+    async def _update_own_booking(
+            self, db: AsyncSession, table_id: int, user_id: int,
+            deadline: time, version: int | None,
+            record: Recorder | None = None, **values: Any
+    ) -> BookingRow | None:
+        """This method updates a booked table if it belongs to the client,
+        the deadline is not passed, the version is the same and the table
+        fits the new persons
+        :param db: an instance of the AsyncSession, it is not used
+        :param table_id: the id of the table to update
+        :param user_id: the id of the table's client
+        :param deadline: the earliest booking time allowed to be updated
+        :param version: the expected version of the booking or None to skip
+        the version check
+        :param record: a coroutine function called with the updated row in
+        the same transaction
+        :param values: the values to update
+        :return: a BookingRow with the updated table, the previous booking
+        time and persons or None if conditions were not met
+        """
+        current = self.storage.tables.get(table_id)
+        if (
+                not current or current.client_id != user_id
+                or not current.is_booked or current.booking_time is None
+                or current.booking_time < deadline
+                or version is not None and current.version != version
+                or values.get('persons') is not None
+                and values['persons'] > current.max_persons
+        ):
+            return None
+
+        updated_table = copy_record(current)
+        for field, value in values.items():
+            setattr(updated_table, field, value)
+        updated_table.version += 1
+        updated_row = BookingRow(
+            **to_dict(updated_table), previous_time=current.booking_time,
+            previous_persons=current.persons)
+        try:
+            with self.storage.transaction():
+                self.storage.save('table', [updated_table])
+                if record:
+                    await record(db, updated_row)
+            return updated_row
+        except Exception as e:
+            print(f'There was an error updating booking: {e}')
+            return None
+
+    async def update_availability(
+            self, db: AsyncSession, record: Recorder | None = None
+    ) -> list[TableRecord]:
+        """This method releases booked tables whose time has passed
+        :param db: an instance of the AsyncSession, it is not used
+        :param record: a coroutine function called with a list of tuples
+        containing booking time and persons of the released tables in the
+        same transaction
+        :return: a list of TableRecords of the released tables
+        """
+        expired = []
+        for table in self.storage.get_expired(self._get_expiry_cutoff()):
+            released_table = copy_record(table)
+            released_table.is_booked = False
+            released_table.version += 1
+            expired.append(released_table)
+        released = [(table.booking_time, table.persons) for table in expired]
+        try:
+            with self.storage.transaction():
+                self.storage.save('table', expired)
+                if record and released:
+                    await record(db, released)
+        except Exception as e:
+            print(f'There was an error updating availability: {e}')
+            return []
+
+        return [copy_record(table) for table in expired]
+
+    async def import_tables(
+            self, db: AsyncSession,
+            records: AsyncIterable[tuple[int, int, int]]
+    ) -> tuple[int, int] | None:
+        """This method creates or updates tables saving them by batches of
+        IMPORT_BATCH_ROWS so only one batch is kept in memory. If the same id
+        occurs several times the last row wins. Batches saved before an error
+        stay imported
+        :param db: an instance of the AsyncSession, it is not used
+        :param records: an asynchronous iterable of tuples containing line
+        number, id and max persons of the tables
+        :return: a tuple with amounts of inserted and updated tables or None
+        if import was failed
+        """
+        inserted_ids = set()
+        updated_ids = set()
+
+        def save_batch(batch: dict[int, int]) -> None:
+            imported_tables = []
+            for table_id, max_persons in batch.items():
+                current = self.storage.tables.get(table_id)
+                if current:
+                    table = copy_record(current)
+                    table.max_persons = max_persons
+                    table.version += 1
+                    if table_id not in inserted_ids:
+                        updated_ids.add(table_id)
+                else:
+                    table = TableRecord(id=table_id, max_persons=max_persons)
+                    inserted_ids.add(table_id)
+                imported_tables.append(table)
+            self.storage.save('table', imported_tables)
+
+        max_persons_by_id = {}
+        try:
+            async for _, table_id, max_persons in records:
+                max_persons_by_id[table_id] = max_persons
+                if len(max_persons_by_id) >= IMPORT_BATCH_ROWS:
+                    save_batch(max_persons_by_id)
+                    max_persons_by_id = {}
+            save_batch(max_persons_by_id)
+            return len(inserted_ids), len(updated_ids)
+        except Exception as e:
+            print(f'There was an error importing tables: {e}')
+            return None
+
+    async def stream_bookings(
+            self, db: AsyncSession, time_from: time | None = None,
+            time_to: time | None = None
+    ) -> AsyncIterator[Sequence[dict[str, Any]]]:
+        """This method returns booked tables joined with their clients
+        :param db: an instance of the AsyncSession, it is not used
+        :param time_from: the earliest booking time to export
+        :param time_to: the latest booking time to export
+        :return: an asynchronous iterator of lists with EXPORT_CHUNK_ROWS
+        rows at most
+        """
+        users = self.storage.users
+        partition = []
+        for table_id in sorted(self.storage.tables):
+            table = self.storage.tables[table_id]
+            user = users.get(table.client_id)
+            if (
+                    not table.is_booked or not user
+                    or time_from and table.booking_time < time_from
+                    or time_to and table.booking_time > time_to
+            ):
+                continue
+            partition.append({
+                'id': table.id, 'booking_time': table.booking_time,
+                'persons': table.persons, 'client_name': user.name,
+                'client_phone': user.phone, 'client_email': user.email})
+            if len(partition) == EXPORT_CHUNK_ROWS:
+                yield partition
+                partition = []
+        if partition:
+            yield partition
+
+
+@trace_methods('dao')
+class MemoryUserDao(UserDao):
+    """The MemoryUserDao class provides access to the users kept in the
+    MemoryStorage"""
+    def __init__(self, storage: MemoryStorage) -> None:
+        """Initialize the MemoryUserDao class
+        :param storage: a MemoryStorage instance keeping the users
+        """
+        super().__init__()
+        self.storage = storage
+
+    async def add_new(
+            self, db: AsyncSession, user_schema: UserRegisterSchema
+    ) -> UserRecord | None:
+        """This method adds a new user
+        :param db: an instance of the AsyncSession, it is not used
+        :param user_schema: an instance of the UserRegisterSchema with the
+        user data
+        :return: a UserRecord if user was added successfully or None instead
+        """
+        new_user = UserRecord(
+            id=self.storage.last_user_id + 1, **user_schema.dict())
+        try:
+            self.storage.save('user', [new_user])
+            return copy_record(new_user)
+        except Exception as e:
+            print(f'There was an error registering user: {e}')
+            return None
+
+    async def get_by_email(
+            self, db: AsyncSession, email: str
+    ) -> UserRecord | None:
+        """This method returns a user by provided email
+        :param db: an instance of the AsyncSession, it is not used
+        :param email: the email address of the searching user
+        :return: a UserRecord if user was found or None instead
+        """
+        user_id = self.storage.users_by_email.get(email)
+
+        return copy_record(self.storage.users[user_id]) if user_id else None
+
+    async def update(
+            self, db: AsyncSession, user: UserRecord
+    ) -> UserRecord | None:
+        """This method updates user data
+        :param db: an instance of the AsyncSession, it is not used
+        :param user: a UserRecord with data to update
+        :return: a UserRecord if user was updates successfully or None instead
+        """
+        try:
+            self.storage.save('user', [copy_record(user)])
+            return user
+        except Exception as e:
+            print(f'There was an error updating user data: {e}')
+            return None
+
+
+@trace_methods('dao')
+class MemoryAnalyticsDao(AnalyticsDao):
+    """The MemoryAnalyticsDao class provides access to the hourly aggregates
+    kept in the MemoryStorage"""
+    def __init__(self, storage: MemoryStorage) -> None:
+        """Initialize the MemoryAnalyticsDao class
+        :param storage: a MemoryStorage instance keeping the aggregates
+        """
+        super().__init__()
+        self.storage = storage
+
+    async def get_all(self, db: AsyncSession) -> list[OccupancyRecord]:
+        """This method returns the hourly aggregates
+        :param db: an instance of the AsyncSession, it is not used
+        :return: a list of OccupancyRecords ordered by hour
+        """
+        occupancy = self.storage.occupancy
+
+        return [copy_record(occupancy[hour]) for hour in sorted(occupancy)]
+
+    async def apply(
+            self, db: AsyncSession, deltas: dict[int, dict[str, int]]
+    ) -> None:
+        """This method adds the provided deltas to the hourly aggregates in
+        the transaction of the booking change, errors are raised to cancel it
+        :param db: an instance of the AsyncSession, it is not used
+        :param deltas: a dictionary where keys are hours and values are
+        dictionaries with counter deltas
+        """
+        updated_hours = []
+        for hour, counters in deltas.items():
+            current = self.storage.occupancy.get(hour) or OccupancyRecord(hour)
+            updated_hours.append(OccupancyRecord(hour, **{
+                counter: getattr(current, counter) + counters.get(counter, 0)
+                for counter in OCCUPANCY_COUNTERS}))
+        self.storage.save('occupancy', updated_hours)
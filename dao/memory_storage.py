@@ -0,0 +1,446 @@
+"""This file contains a MemoryStorage class keeping tables and users in the
+process memory. Durability is provided by an append-only write-ahead log and
+periodic snapshots"""
+import fcntl
+import heapq
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import time
+from threading import Thread
+from time import time_ns
+from typing import Any, Iterable, Iterator
+from constants import (
+    MEMORY_DATA_DIR, MEMORY_SNAPSHOT_RECORDS, MEMORY_FSYNC, MEMORY_WAL_FILE,
+    MEMORY_OLD_WAL_FILE, MEMORY_SNAPSHOT_FILE, MEMORY_LOCK_FILE,
+    OCCUPANCY_COUNTERS)
+# --------------------------------------------------------------------------
+
+
+class StorageLockedError(Exception):
+    """The StorageLockedError is raised when the data directory is used by
+    another process"""
+
+
+class TableRecord:
+    """The TableRecord class represents a table kept in memory"""
+    __slots__ = (
+        'id', 'max_persons', 'booking_time', 'persons', 'is_booked',
+        'version', 'client_id')
+
+    def __init__(
+            self, id: int, max_persons: int, booking_time: time | None = None,
+            persons: int = 0, is_booked: bool = False, version: int = 0,
+            client_id: int | None = None
+    ) -> None:
+        """Initialize the TableRecord class"""
+        self.id = id
+        self.max_persons = max_persons
+        self.booking_time = booking_time
+        self.persons = persons
+        self.is_booked = is_booked
+        self.version = version
+        self.client_id = client_id
+
+
+class UserRecord:
+    """The UserRecord class represents a user kept in memory"""
+    __slots__ = (
+        'id', 'email', 'password', 'name', 'phone', 'is_active', 'is_admin')
+
+    def __init__(
+            self, id: int, email: str, password: str, name: str | None = None,
+            phone: str | None = None, is_active: bool = False,
+            is_admin: bool = False
+    ) -> None:
+        """Initialize the UserRecord class"""
+        self.id = id
+        self.email = email
+        self.password = password
+        self.name = name
+        self.phone = phone
+        self.is_active = is_active
+        self.is_admin = is_admin
+
+
+class OccupancyRecord:
+    """The OccupancyRecord class represents hourly aggregates kept in
+    memory"""
+    __slots__ = ('hour',) + OCCUPANCY_COUNTERS
+
+    def __init__(self, hour: int, **counters: int) -> None:
+        """Initialize the OccupancyRecord class"""
+        self.hour = hour
+        for counter in OCCUPANCY_COUNTERS:
+            setattr(self, counter, counters.get(counter, 0))
+
+
+def to_dict(record: Any) -> dict[str, Any]:
+    """This function converts a record to a dictionary
+    :param record: a record with __slots__
+    :return: a dictionary with record fields
+    """
+    return {field: getattr(record, field) for field in record.__slots__}
+
+
+def copy_record(record: Any) -> Any:
+    """This function returns a copy of the record so changes made by callers
+    don't touch the storage until they are saved
+    :param record: a record to copy
+    :return: a new record with the same fields
+    """
+    return type(record)(**to_dict(record))
+
+
+def dump_record(record: Any) -> dict[str, Any]:
+    """This function converts a record to a JSON-compatible dictionary
+    :param record: a record to convert
+    :return: a dictionary with record fields
+    """
+    data = to_dict(record)
+    if data.get('booking_time') is not None:
+        data['booking_time'] = data['booking_time'].isoformat()
+    return data
+
+
+def load_record(kind: str, data: dict[str, Any]) -> Any:
+    """This function creates a record from the dictionary made by
+    dump_record
+    :param kind: a kind of the record ('table', 'user' or 'occupancy')
+    :param data: a dictionary with record fields
+    :return: a new record
+    """
+    if data.get('booking_time') is not None:
+        data['booking_time'] = time.fromisoformat(data['booking_time'])
+    return RECORD_TYPES[kind](**data)
+
+
+RECORD_TYPES = {
+    'table': TableRecord, 'user': UserRecord, 'occupancy': OccupancyRecord}
+
+
+class MemoryStorage:
+    """The MemoryStorage class keeps records indexed by id, users indexed by
+    email, a set of vacant tables, booked tables of every client and a heap
+    of booking times to release expired bookings. The availability version
+    is incremented on every change of tables, versions of the clients'
+    tables are taken from it. It starts from the current time in
+    microseconds so versions are not reused after a restart. Every change is
+    appended to the write-ahead log before it is visible, changes saved in a
+    transaction are written as one line so they are recovered together or
+    not at all. Every MEMORY_SNAPSHOT_RECORDS records the log is moved aside
+    and a snapshot is written by a background thread, so requests are not
+    blocked by writing and syncing the whole state. The moved log is removed
+    when the snapshot is written and replayed before the current one by the
+    recovery otherwise. Only one process may use the data
+    directory, the lock method must be called before the recover method and
+    the lock is held until the storage is closed. The recover method must be
+    called before the storage is used"""
+    def __init__(self, data_dir: str = MEMORY_DATA_DIR) -> None:
+        """Initialize the MemoryStorage class
+        :param data_dir: a directory to keep the log and snapshots in
+        """
+        self.data_dir = data_dir
+        self.wal_path = os.path.join(data_dir, MEMORY_WAL_FILE)
+        self.old_wal_path = os.path.join(data_dir, MEMORY_OLD_WAL_FILE)
+        self.snapshot_path = os.path.join(data_dir, MEMORY_SNAPSHOT_FILE)
+        self.lock_path = os.path.join(data_dir, MEMORY_LOCK_FILE)
+        self.lock_file = None
+        self.wal = None
+        self.snapshot_thread: Thread | None = None
+        self.pending: ContextVar[list[tuple[str, Any]] | None] = ContextVar(
+            f'pending_{id(self)}', default=None)
+        self._reset()
+
+    def _reset(self) -> None:
+        """This method removes all records and indexes"""
+        self.wal_records = 0
+        self.tables: dict[int, TableRecord] = {}
+        self.users: dict[int, UserRecord] = {}
+        self.occupancy: dict[int, OccupancyRecord] = {}
+        self.users_by_email: dict[str, int] = {}
+        self.last_user_id = 0
+        self.vacant: set[int] = set()
+        self.client_tables: dict[int, set[int]] = {}
+        self.booking_times: list[tuple[time, int, int]] = []
+        self.initial_version = time_ns() // 1000
+        self.availability_version = self.initial_version
+        self.client_versions: dict[int, int] = {}
+
+    def _index_table(self, table: TableRecord, add: bool = True) -> None:
+        """This method adds the table to the indexes or removes it from them
+        :param table: a TableRecord to index
+        :param add: a boolean indicating whether to add or to remove
+        """
+        if add and not table.is_booked and table.persons == 0:
+            self.vacant.add(table.id)
+        else:
+            self.vacant.discard(table.id)
+
+        if table.is_booked and table.client_id is not None:
+            client_tables = self.client_tables.setdefault(
+                table.client_id, set())
+            if add:
+                client_tables.add(table.id)
+            else:
+                client_tables.discard(table.id)
+
+        if add and table.is_booked and table.booking_time is not None:
+            heapq.heappush(
+                self.booking_times,
+                (table.booking_time, table.id, table.version))
+
+    def _apply(self, kind: str, record: Any) -> None:
+        """This method puts the record into the storage and updates indexes
+        :param kind: a kind of the record ('table', 'user' or 'occupancy')
+        :param record: a record to put
+        """
+        if kind == 'table':
+            previous = self.tables.get(record.id)
+            if previous:
+                self._index_table(previous, add=False)
+            self.tables[record.id] = record
+            self._index_table(record)
+            self.availability_version += 1
+            for client_id in {previous and previous.client_id,
+                              record.client_id} - {None}:
+                self.client_versions[client_id] = self.availability_version
+        elif kind == 'user':
+            previous = self.users.get(record.id)
+            if previous and previous.email != record.email:
+                self.users_by_email.pop(previous.email, None)
+            self.users[record.id] = record
+            self.users_by_email[record.email] = record.id
+            self.last_user_id = max(self.last_user_id, record.id)
+        else:
+            self.occupancy[record.hour] = record
+
+    def _write(self, entries: list[tuple[str, Any]], batch: bool) -> None:
+        """This method writes the records to the log and then puts them into
+        the storage
+        :param entries: a list of tuples with a kind and a record
+        :param batch: a boolean indicating whether to write the records as
+        one line
+        """
+        lines = [
+            {'kind': kind, 'data': dump_record(record)}
+            for kind, record in entries]
+        if batch:
+            lines = [{'kind': 'batch', 'entries': lines}]
+        self.wal.write(''.join(json.dumps(line) + '\n' for line in lines))
+        self.wal.flush()
+        if MEMORY_FSYNC:
+            os.fsync(self.wal.fileno())
+        for kind, record in entries:
+            self._apply(kind, record)
+
+        self.wal_records += len(entries)
+        if self.wal_records >= MEMORY_SNAPSHOT_RECORDS:
+            self._start_snapshot()
+
+    def save(self, kind: str, records: Iterable[Any]) -> None:
+        """This method writes the records to the log and then puts them into
+        the storage. Inside a transaction the records are kept until the
+        transaction of the current task ends. Records are written in full so
+        replaying the log is idempotent
+        :param kind: a kind of the records ('table', 'user' or 'occupancy')
+        :param records: records to save
+        """
+        entries = [(kind, record) for record in records]
+        if not entries:
+            return
+        pending = self.pending.get()
+        if pending is not None:
+            pending.extend(entries)
+            return
+        self._write(entries, batch=False)
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """This method collects records saved inside the with block and
+        writes them as one log line when the block ends. Nothing is written
+        if the block raises an exception. Records are collected in a context
+        variable, so every task has its own transaction and records saved by
+        other tasks while the block awaits are not mixed into it. Conditions
+        checked before the block are not locked, the memory recorders don't
+        await anything, so a block using them is not interleaved"""
+        token = self.pending.set([])
+        try:
+            yield
+            entries = self.pending.get()
+        finally:
+            self.pending.reset(token)
+        if entries:
+            self._write(entries, batch=True)
+
+    def _rotate(self) -> dict[str, list[Any]]:
+        """This method takes references to all records and starts a new log,
+        the current log is moved aside until the snapshot of these records is
+        written. Records are replaced and never changed in place, so the
+        references stay valid. If the previous snapshot was failed the log
+        is appended to the moved one
+        :return: a dictionary with lists of records by kind
+        """
+        records = {
+            'table': list(self.tables.values()),
+            'user': list(self.users.values()),
+            'occupancy': list(self.occupancy.values())}
+        if self.wal is not None:
+            self.wal.close()
+            if os.path.exists(self.old_wal_path):
+                with open(self.wal_path, encoding='utf-8') as source:
+                    with open(
+                            self.old_wal_path, 'a', encoding='utf-8'
+                    ) as target:
+                        shutil.copyfileobj(source, target)
+            else:
+                os.replace(self.wal_path, self.old_wal_path)
+        self.wal = open(self.wal_path, 'w', encoding='utf-8')
+        self.wal_records = 0
+
+        return records
+
+    def _write_snapshot(self, records: dict[str, list[Any]]) -> None:
+        """This method writes the records to a new snapshot which replaces
+        the previous one atomically and then removes the moved log
+        :param records: a dictionary with lists of records by kind
+        """
+        temporary_path = f'{self.snapshot_path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                kind: [dump_record(record) for record in kind_records]
+                for kind, kind_records in records.items()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.snapshot_path)
+        if os.path.exists(self.old_wal_path):
+            os.remove(self.old_wal_path)
+
+    def _run_snapshot(self, records: dict[str, list[Any]]) -> None:
+        """This method writes the snapshot in the background thread, an error
+        is only reported because the moved log keeps the records
+        :param records: a dictionary with lists of records by kind
+        """
+        try:
+            self._write_snapshot(records)
+        except Exception as e:
+            print(f'Cannot write a snapshot, error: {e}')
+
+    def _start_snapshot(self) -> None:
+        """This method starts writing a snapshot by a background thread
+        unless the previous one is still being written. Only references to
+        the records are taken by the event loop, encoding and syncing the
+        file don't block requests except for switches of the interpreter
+        lock"""
+        thread = self.snapshot_thread
+        if thread is not None and thread.is_alive():
+            return
+        self.snapshot_thread = Thread(
+            target=self._run_snapshot, args=(self._rotate(),), daemon=True)
+        self.snapshot_thread.start()
+
+    def _wait_snapshot(self) -> None:
+        """This method waits for the background snapshot to be written"""
+        if self.snapshot_thread is not None:
+            self.snapshot_thread.join()
+            self.snapshot_thread = None
+
+    def snapshot(self) -> None:
+        """This method writes all records to a new snapshot and truncates the
+        log at once, it waits for the background snapshot first"""
+        self._wait_snapshot()
+        self._write_snapshot(self._rotate())
+
+    def lock(self) -> None:
+        """This method takes an exclusive lock of the data directory, so
+        another process can't rewrite the log and the snapshot while the
+        storage is used. The lock is released by the close method or when the
+        process exits
+        :raises StorageLockedError: if another process holds the lock
+        """
+        os.makedirs(self.data_dir, exist_ok=True)
+        lock_file = open(self.lock_path, 'w', encoding='utf-8')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise StorageLockedError(
+                f'The data directory {self.data_dir} is used by another '
+                f'process')
+        self.lock_file = lock_file
+
+    def clear(self) -> None:
+        """This method removes all records and writes an empty snapshot"""
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._reset()
+        self.snapshot()
+
+    def recover(self) -> None:
+        """This method loads the last snapshot and replays the moved log and
+        the log written after it. A line torn by a crash at the end of the
+        log is skipped"""
+        os.makedirs(self.data_dir, exist_ok=True)
+        if self.wal is not None:
+            self.wal.close()
+        self._reset()
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                for kind, records in json.load(f).items():
+                    for data in records:
+                        self._apply(kind, load_record(kind, data))
+        except FileNotFoundError:
+            pass
+
+        for wal_path in (self.old_wal_path, self.wal_path):
+            try:
+                with open(wal_path, encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            print(f'Skipped a broken log record: {line!r}')
+                            continue
+                        for item in entry.get('entries', [entry]):
+                            self._apply(
+                                item['kind'], load_record(
+                                    item['kind'], item['data']))
+                            self.wal_records += 1
+            except FileNotFoundError:
+                pass
+
+        self.wal = open(self.wal_path, 'a', encoding='utf-8')
+
+    def close(self) -> None:
+        """This method folds the log into a snapshot, closes it and releases
+        the lock of the data directory"""
+        if self.wal is not None:
+            self.snapshot()
+            self.wal.close()
+            self.wal = None
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+    def get_expired(self, cutoff: time) -> list[TableRecord]:
+        """This method returns booked tables whose booking time is earlier
+        than the cutoff. Heap entries left by changed or cancelled bookings
+        are dropped on the way. Entries of the returned tables are kept, they
+        become stale only when the released tables are saved, so a failed
+        save doesn't lose them
+        :param cutoff: the booking time to compare with
+        :return: a list of expired TableRecords
+        """
+        expired = []
+        entries = []
+        while self.booking_times and self.booking_times[0][0] < cutoff:
+            entry = heapq.heappop(self.booking_times)
+            table = self.tables.get(entry[1])
+            if table and table.is_booked and table.version == entry[2]:
+                expired.append(table)
+                entries.append(entry)
+        for entry in entries:
+            heapq.heappush(self.booking_times, entry)
+
+        return expired
@@ -4,6 +4,9 @@ from sqlalchemy.orm import relationship
 from dao import Base
 # ---------------------------------------------------------------------------
 
+availability_version = sqa.Sequence(
+    'availability_version', metadata=Base.metadata)
+
 
 class User(Base):
     """The User model to get data from the user spreadsheet"""
@@ -14,6 +17,9 @@ class User(Base):
     name = sqa.Column(sqa.String)
     phone = sqa.Column(sqa.String)
     is_active = sqa.Column(sqa.Boolean, default=False)
+    is_admin = sqa.Column(sqa.Boolean, default=False)
+    tables_version = sqa.Column(
+        sqa.Integer, default=0, server_default='0', nullable=False)
     tables = relationship('Table', back_populates='client')
 
 
@@ -25,6 +31,20 @@ class Table(Base):
     booking_time = sqa.Column(sqa.Time, nullable=True)
     persons = sqa.Column(sqa.Integer, default=0)
     is_booked = sqa.Column(sqa.Boolean, default=False)
+    version = sqa.Column(
+        sqa.Integer, default=0, server_default='0', nullable=False)
     client_id = sqa.Column(
         sqa.Integer, sqa.ForeignKey('user.id'), nullable=True)
     client = relationship('User', back_populates='tables')
+
+
+class Occupancy(Base):
+    """The Occupancy model to get hourly booking aggregates from the occupancy
+    spreadsheet"""
+    __tablename__ = 'occupancy'
+    hour = sqa.Column(sqa.Integer, primary_key=True)
+    booked = sqa.Column(sqa.Integer, default=0)
+    covers = sqa.Column(sqa.Integer, default=0)
+    bookings = sqa.Column(sqa.Integer, default=0)
+    cancellations = sqa.Column(sqa.Integer, default=0)
+    expirations = sqa.Column(sqa.Integer, default=0)
@@ -0,0 +1,334 @@
+"""This file contains a SharedSnapshot class keeping a compact copy of the
+table spreadsheet in a memory-mapped file shared by all worker processes.
+One process rewrites the snapshot periodically, every process applies the
+tables it changes, the others read it without querying the database"""
+import fcntl
+import mmap
+import os
+import struct
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import time
+from time import time as now
+from typing import Any, Callable, Iterable, Iterator, TypeVar
+from constants import (
+    SHARED_SNAPSHOT_FILE, SHARED_SNAPSHOT_CAPACITY, SHARED_SNAPSHOT_MAX_AGE,
+    SHARED_SNAPSHOT_RETRIES)
+# --------------------------------------------------------------------------
+
+MAGIC = b'TBL2'
+# magic, padding, sequence, availability version, update time, count and
+# capacity of records
+HEADER = struct.Struct('<4s4xQqdII')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+# id, max persons, persons, is booked, padding, booking time in seconds
+# from midnight or -1 and version, the integers have the width of the
+# Integer columns, so every value of the spreadsheet fits
+RECORD = struct.Struct('<iii?3xii')
+RECORD_VERSION = 5
+
+SnapshotRecord = namedtuple(
+    'SnapshotRecord',
+    ('id', 'max_persons', 'persons', 'is_booked', 'booking_time', 'version'))
+
+T = TypeVar('T')
+
+
+def pack_time(booking_time: time | None) -> int:
+    """This function converts a booking time to seconds from midnight
+    :param booking_time: the booking time or None
+    :return: the amount of seconds or -1 if the time is None
+    """
+    if booking_time is None:
+        return -1
+    return (booking_time.hour * 3600 + booking_time.minute * 60
+            + booking_time.second)
+
+
+def unpack_record(fields: tuple) -> SnapshotRecord:
+    """This function creates a SnapshotRecord from unpacked RECORD fields
+    :param fields: a tuple of the unpacked fields
+    :return: the SnapshotRecord
+    """
+    table_id, max_persons, persons, is_booked, seconds, version = fields
+    booking_time = None
+    if seconds >= 0:
+        booking_time = time(seconds // 3600, seconds // 60 % 60, seconds % 60)
+    return SnapshotRecord(
+        table_id, max_persons, persons, is_booked, booking_time, version)
+
+
+class SharedSnapshot:
+    """The SharedSnapshot class keeps records of tables sorted by id in a
+    memory-mapped file. The writer rewriting the snapshot is chosen by an
+    exclusive lock of a file next to the snapshot, the lock is released when
+    the writer process exits, so another process can take over. Every
+    process applies the tables it has changed, changes of the mapping are
+    serialized by a lock of another file. Records are protected by a
+    sequence lock: a process makes the sequence odd before changing records
+    and even after that, readers retry if the sequence was odd or changed
+    while they were reading. The snapshot is considered unavailable if it
+    was not updated for SHARED_SNAPSHOT_MAX_AGE seconds"""
+    def __init__(
+            self, path: str = SHARED_SNAPSHOT_FILE,
+            capacity: int = SHARED_SNAPSHOT_CAPACITY
+    ) -> None:
+        """Initialize the SharedSnapshot class
+        :param path: a path of the file to map
+        :param capacity: the maximum amount of tables
+        """
+        self.path = path
+        self.capacity = capacity
+        self.size = HEADER.size + capacity * RECORD.size
+        self.memory = None
+        self.lock_fd = None
+        self.change_fd = None
+        self.version = None
+
+    def open(self) -> None:
+        """This method maps the file creating it if it doesn't exist"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < self.size:
+                os.ftruncate(fd, self.size)
+            self.memory = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.change_fd = os.open(
+            f'{self.path}.change', os.O_RDWR | os.O_CREAT, 0o600)
+
+    def close(self) -> None:
+        """This method unmaps the file and releases the locks"""
+        for fd in (self.lock_fd, self.change_fd):
+            if fd is not None:
+                os.close(fd)
+        self.lock_fd = self.change_fd = None
+        if self.memory is not None:
+            self.memory.close()
+            self.memory = None
+
+    def acquire_writer(self) -> bool:
+        """This method tries to make the current process the writer
+        :return: True if the process is the writer or False otherwise
+        """
+        if self.lock_fd is not None:
+            return True
+        fd = os.open(f'{self.path}.lock', os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self.lock_fd = fd
+        self.version = None
+        return True
+
+    def _set_sequence(self, sequence: int) -> int:
+        """This method writes the sequence of the sequence lock
+        :param sequence: the new sequence
+        :return: the new sequence
+        """
+        SEQUENCE.pack_into(self.memory, SEQUENCE_OFFSET, sequence)
+        return sequence
+
+    @contextmanager
+    def _change(self) -> Iterator[int]:
+        """This method locks the mapping against changes of other processes
+        and makes the sequence odd inside the with block
+        :return: the odd sequence
+        """
+        fcntl.flock(self.change_fd, fcntl.LOCK_EX)
+        try:
+            sequence = SEQUENCE.unpack_from(self.memory, SEQUENCE_OFFSET)[0]
+            sequence = self._set_sequence(sequence + 1 + sequence % 2)
+            try:
+                yield sequence
+            finally:
+                self._set_sequence(sequence + 1)
+        finally:
+            fcntl.flock(self.change_fd, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _find(records: memoryview | mmap.mmap, count: int, table_id: int,
+              offset: int = 0) -> int | None:
+        """This method finds a record by the binary search
+        :param records: a buffer with records sorted by id
+        :param count: the amount of records
+        :param table_id: the id of the table
+        :param offset: the position of the first record in the buffer
+        :return: the index of the record or None if it is not found
+        """
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            record_id = RECORD.unpack_from(
+                records, offset + middle * RECORD.size)[0]
+            if record_id == table_id:
+                return middle
+            if record_id < table_id:
+                low = middle + 1
+            else:
+                high = middle
+
+        return None
+
+    def write(self, version: int, tables: Iterable[Any]) -> bool:
+        """This method replaces all records, it must be called only by the
+        writer. Records are packed before the sequence lock is taken to keep
+        readers waiting as short as possible
+        :param version: the availability version of the tables
+        :param tables: objects with id, max_persons, persons, is_booked,
+        booking_time and version attributes sorted by id
+        :return: True if the snapshot was written or False if there are more
+        tables than the capacity, in that case the snapshot becomes
+        unavailable
+        """
+        records = b''.join(RECORD.pack(
+            table.id, table.max_persons, table.persons or 0,
+            bool(table.is_booked), pack_time(table.booking_time),
+            table.version) for table in tables)
+        count = len(records) // RECORD.size
+        if count > self.capacity:
+            print(f'Cannot write {count} tables to the snapshot, the capacity '
+                  f'is {self.capacity}')
+            with self._change():
+                self.memory[:len(MAGIC)] = bytes(len(MAGIC))
+            self.version = None
+            return False
+
+        with self._change() as sequence:
+            self.memory[HEADER.size:HEADER.size + len(records)] = records
+            HEADER.pack_into(
+                self.memory, 0, MAGIC, sequence, version, now(), count,
+                self.capacity)
+        self.version = version
+        return True
+
+    def touch(self) -> None:
+        """This method updates the time of the snapshot to show that the
+        writer is alive, it must be called only by the writer"""
+        with self._change() as sequence:
+            magic, _, version, _, count, capacity = HEADER.unpack_from(
+                self.memory)
+            if magic == MAGIC:
+                HEADER.pack_into(
+                    self.memory, 0, magic, sequence, version, now(), count,
+                    capacity)
+
+    def apply(self, version: int | None, *tables: Any) -> None:
+        """This method replaces the records of tables changed by the current
+        process, so readers see the change before the next rewrite. A
+        record is kept if the snapshot has a newer version of the table.
+        The availability version of the snapshot is advanced only if the
+        change directly follows it and all tables are found, otherwise a
+        change of another process could be missed and the writer advances
+        the version by the next rewrite
+        :param version: the availability version made by the change or None
+        if it is unknown
+        :param tables: objects with id, max_persons, persons, is_booked,
+        booking_time and version attributes
+        """
+        if self.memory is None:
+            return
+        with self._change() as sequence:
+            magic, _, current, updated, count, capacity = HEADER.unpack_from(
+                self.memory)
+            if magic != MAGIC:
+                return
+            for table in tables:
+                index = self._find(self.memory, count, table.id, HEADER.size)
+                if index is None:
+                    version = None
+                    continue
+                offset = HEADER.size + index * RECORD.size
+                if RECORD.unpack_from(
+                        self.memory, offset)[RECORD_VERSION] < table.version:
+                    RECORD.pack_into(
+                        self.memory, offset, table.id, table.max_persons,
+                        table.persons or 0, bool(table.is_booked),
+                        pack_time(table.booking_time), table.version)
+            if version is not None and version == current + 1:
+                current = version
+            HEADER.pack_into(
+                self.memory, 0, magic, sequence, current, updated, count,
+                capacity)
+
+    def _read(self, reader: Callable[[memoryview, int, int], T]) -> T | None:
+        """This method calls the reader until it reads records which were
+        not changed by the writer at the same time
+        :param reader: a function receiving a view of the records, their
+        count and the availability version
+        :return: the result of the reader or None if the snapshot is not
+        available
+        """
+        if self.memory is None:
+            return None
+        for _ in range(SHARED_SNAPSHOT_RETRIES):
+            magic, sequence, version, updated, count, _ = HEADER.unpack_from(
+                self.memory)
+            if magic != MAGIC or now() - updated > SHARED_SNAPSHOT_MAX_AGE:
+                return None
+            if sequence % 2:
+                continue
+            try:
+                with memoryview(self.memory) as view:
+                    result = reader(
+                        view[HEADER.size:HEADER.size + count * RECORD.size],
+                        count, version)
+            except (ValueError, struct.error):
+                continue
+            if SEQUENCE.unpack_from(
+                    self.memory, SEQUENCE_OFFSET)[0] == sequence:
+                return result
+
+        return None
+
+    def get_version(self) -> int | None:
+        """This method returns the availability version of the snapshot
+        :return: the version or None if the snapshot is not available
+        """
+        return self._read(lambda records, count, version: version)
+
+    def get_vacant(self) -> tuple[int, list[SnapshotRecord]] | None:
+        """This method returns vacant tables with the availability version
+        read by the same pass
+        :return: a tuple with the version and a list of SnapshotRecords or
+        None if the snapshot is not available
+        """
+        def reader(
+                records: memoryview, count: int, version: int
+        ) -> tuple[int, list[SnapshotRecord]]:
+            return version, [
+                unpack_record(fields)
+                for fields in RECORD.iter_unpack(records)
+                if not fields[3] and not fields[2]]
+
+        return self._read(reader)
+
+    def get_all(self) -> tuple[int, list[SnapshotRecord]] | None:
+        """This method returns all tables with the availability version read
+        by the same pass
+        :return: a tuple with the version and a list of SnapshotRecords or
+        None if the snapshot is not available
+        """
+        return self._read(lambda records, count, version: (version, [
+            unpack_record(fields) for fields in RECORD.iter_unpack(records)]))
+
+    def get(self, table_id: int) -> tuple[int, SnapshotRecord | None] | None:
+        """This method finds a table by the binary search
+        :param table_id: the id of the table
+        :return: a tuple with the availability version and a SnapshotRecord
+        or None if the table is not found, None is returned instead of the
+        tuple if the snapshot is not available
+        """
+        def reader(
+                records: memoryview, count: int, version: int
+        ) -> tuple[int, SnapshotRecord | None]:
+            index = self._find(records, count, table_id)
+            if index is None:
+                return version, None
+            return version, unpack_record(
+                RECORD.unpack_from(records, index * RECORD.size))
+
+        return self._read(reader)
@@ -1,14 +1,34 @@
 """This file contains a TableDao class serves as a data access object"""
-from datetime import datetime, timedelta
-from typing import Any, Sequence
-from sqlalchemy import select, update, Row, RowMapping
+from datetime import datetime, timedelta, time
+from typing import (
+    Any, AsyncIterable, AsyncIterator, Awaitable, Callable, Sequence)
+import sqlalchemy as sqa
+from sqlalchemy import select, update, func, literal, Row, RowMapping
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from constants import TZ
-from dao.models import Table, User
+from constants import (
+    TZ, BOOKING_HOURS, IMPORT_STAGING_TABLE, EXPORT_CHUNK_ROWS)
+from dao.models import Table, User, availability_version
 from services.schemas import TableBookSchema, TableBookChangeSchema
+from tracing import trace_methods
 # --------------------------------------------------------------------------
 
+staging_table = sqa.Table(
+    IMPORT_STAGING_TABLE, sqa.MetaData(),
+    sqa.Column('line', sqa.Integer),
+    sqa.Column('id', sqa.Integer),
+    sqa.Column('max_persons', sqa.Integer),
+    prefixes=['TEMPORARY'], postgresql_on_commit='DROP')
 
+# a coroutine function recording a changed row in the same transaction
+Recorder = Callable[[AsyncSession, Any], Awaitable[None]]
+
+availability_table = sqa.table(
+    availability_version.name, sqa.column('last_value'),
+    sqa.column('is_called'))
+
+
+@trace_methods('dao')
 class TableDao:
     """The TableDao class provides access to the table spreadsheet"""
     def __init__(self) -> None:
@@ -24,14 +44,88 @@ class TableDao:
         to the database
         :return: a list of Table models
         """
-        await self.update_availability(db)
-
         tables = await db.execute(
             select(self.model).where(
                 self.model.is_booked == False, self.model.persons == 0))
 
         return tables.scalars().all()
 
+    async def get_snapshot_rows(self, db: AsyncSession) -> Sequence[Row]:
+        """This method returns columns of all tables kept by the shared
+        snapshot
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :return: a list of rows sorted by id
+        """
+        table = self.model.__table__
+        rows = await db.execute(select(
+            table.c.id, table.c.max_persons, table.c.persons,
+            table.c.is_booked, table.c.booking_time, table.c.version
+        ).order_by(table.c.id))
+
+        return rows.all()
+
+    async def get_version(self, db: AsyncSession) -> int:
+        """This method returns the current availability version
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :return: the last value of the availability version sequence
+        """
+        version = await db.execute(select(
+            availability_table.c.last_value, availability_table.c.is_called))
+        last_value, is_called = version.one()
+
+        return last_value if is_called else last_value - 1
+
+    async def get_client_version(self, db: AsyncSession, user: User) -> int:
+        """This method returns the version of tables booked by the user
+        :param db: an instance of the AsyncSession, it is not used because
+        the version is loaded with the user
+        :param user: the User model
+        :return: the version of the user's tables
+        """
+        return user.tables_version
+
+    async def _bump_version(self, db: AsyncSession) -> None:
+        """This method increments the availability version. Sequences are not
+        transactional so it is called after the commit, otherwise a request
+        could read the new version together with the old tables. The changes
+        are already committed at this point, so an error is only reported
+        and the version is bumped by the next change. The new version is
+        kept in the session info to be returned by the get_bumped_version
+        method
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        """
+        try:
+            db.info['bumped_version'] = await db.scalar(
+                select(availability_version.next_value()))
+        except Exception as e:
+            await db.rollback()
+            print(f'There was an error bumping the availability version: {e}')
+
+    @staticmethod
+    def get_bumped_version(db: AsyncSession) -> int | None:
+        """This method returns the availability version made by the last
+        change in the session
+        :param db: an instance of the AsyncSession the change was made by
+        :return: the version or None if it is unknown
+        """
+        return db.info.get('bumped_version')
+
+    async def _bump_client_versions(
+            self, db: AsyncSession, client_ids: Any
+    ) -> None:
+        """This method increments versions of tables booked by the clients
+        in the current transaction
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param client_ids: a collection or a subquery of the clients' ids
+        """
+        await db.execute(update(self.user).where(
+            self.user.id.in_(client_ids)).values(
+            tables_version=self.user.tables_version + 1))
+
     async def get_by_id(
             self, db: AsyncSession, table_id: int
     ) -> Table | None:
@@ -47,25 +141,44 @@ class TableDao:
         return table.scalar()
 
     async def book_one(
-            self, db: AsyncSession, table: TableBookSchema
-    ) -> Table | None:
-        """This method serves to book a new table
+            self, db: AsyncSession, table: TableBookSchema,
+            record: Recorder | None = None
+    ) -> Row | None:
+        """This method serves to book a new table by one conditional
+        statement checking that the table is vacant and fits the persons, so
+        only one of concurrent requests books it
         :param db: an instance of the AsyncSession provides a connection
         to the database
         :param table: an instance of the TableBookSchema class
-        :return: The Table model or None if booking the table was failed
+        :param record: a coroutine function called with the booked row
+        before the commit
+        :return: a row with the booked table or None if booking the table
+        was failed or conditions were not met
         """
+        columns = self.model.__table__.c
         try:
-            await db.execute(update(self.model).where(
-            self.model.id == table.id).values(**table.dict(exclude_none=True)))
+            booked = await db.execute(update(self.model.__table__).where(
+                columns.id == table.id,
+                columns.is_booked.is_(False),
+                columns.max_persons >= table.persons).values(
+                **table.dict(exclude_none=True, exclude={'max_persons'}),
+                version=columns.version + 1).returning(*columns))
+            new_table = booked.first()
+            if not new_table:
+                await db.rollback()
+                return None
+            await self._bump_client_versions(db, [table.client_id])
+            if record:
+                await record(db, new_table)
             await db.commit()
-            new_table = await self.get_by_id(db, table.id)
-            return new_table
         except Exception as e:
             await db.rollback()
             print(f'There was an error during booking: {e}')
             return None
 
+        await self._bump_version(db)
+        return new_table
+
     async def get_by_client_email(
             self, db: AsyncSession, email: str
     ) -> Sequence[Row | RowMapping | Any] | None:
@@ -81,49 +194,248 @@ class TableDao:
 
         return tables.scalars().all()
 
+    async def _update_own_booking(
+            self, db: AsyncSession, table_id: int, user_id: int,
+            deadline: time, version: int | None,
+            record: Recorder | None = None, **values: Any
+    ) -> Row | None:
+        """This method updates a booked table by one conditional statement
+        checking the client, the deadline, the version of the booking and
+        that the table fits the new persons.
+        The previous booking time and persons are locked and returned as
+        previous_time and previous_persons
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param table_id: the id of the table to update
+        :param user_id: the id of the table's client
+        :param deadline: the earliest booking time allowed to be updated
+        :param version: the expected version of the booking or None to skip
+        the version check
+        :param record: a coroutine function called with the updated row
+        before the commit
+        :param values: the values to update
+        :return: a row containing the updated table columns, the previous
+        booking time and persons or None if conditions were not met
+        """
+        table = self.model.__table__
+        previous = select(
+            table.c.id, table.c.booking_time, table.c.persons
+        ).where(table.c.id == table_id).with_for_update().subquery()
+        query = update(table).where(
+            table.c.id == previous.c.id,
+            table.c.client_id == user_id,
+            table.c.is_booked == True,
+            table.c.booking_time >= deadline)
+        if version is not None:
+            query = query.where(table.c.version == version)
+        if values.get('persons') is not None:
+            query = query.where(table.c.max_persons >= values['persons'])
+        query = query.values(
+            **values, version=table.c.version + 1).returning(
+            *table.c, previous.c.booking_time.label('previous_time'),
+            previous.c.persons.label('previous_persons'))
+        try:
+            updated = await db.execute(query)
+            updated_row = updated.first()
+            if not updated_row:
+                await db.rollback()
+                return None
+            await self._bump_client_versions(db, [user_id])
+            if record:
+                await record(db, updated_row)
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            print(f'There was an error updating booking: {e}')
+            return None
+
+        await self._bump_version(db)
+        return updated_row
+
     async def update_booking(
-            self, db: AsyncSession, table: TableBookChangeSchema
-    ) -> Table | None:
+            self, db: AsyncSession, table: TableBookChangeSchema,
+            user_id: int, deadline: time, version: int | None = None,
+            record: Recorder | None = None
+    ) -> Row | None:
         """This method serves to update booking details
         :param db: an instance of the AsyncSession provides a connection
         to the database
         :param table: an instance of the TableBookChangeSchema class
-        :return: the Table model if booking details were updated successfully
-        or None otherwise
+        :param user_id: the id of the table's client
+        :param deadline: the earliest booking time allowed to be changed
+        :param version: the expected version of the booking or None to skip
+        the version check
+        :param record: a coroutine function called with the updated row
+        before the commit
+        :return: a row containing the updated table columns, the previous
+        booking time and persons or None if conditions were not met
         """
+        updated_row = await self._update_own_booking(
+            db, table.id, user_id, deadline, version, record,
+            **table.dict(
+                exclude_none=True,
+                exclude={'id', 'max_persons', 'client_id', 'is_booked'}))
 
-        updated_table = await self.book_one(db, table)
-
-        return updated_table
+        return updated_row
 
     async def cancel_booking(
-            self, db: AsyncSession, table_id: int
-    ) -> Table | None:
+            self, db: AsyncSession, table_id: int, user_id: int,
+            deadline: time, version: int | None = None,
+            record: Recorder | None = None
+    ) -> Row | None:
         """This method allows to cancel booking
         :param db: an instance of the AsyncSession provides a connection
         to the database
         :param table_id: the id of the table to cancel
-        :return: a Table model if booking was canceled successfully or
-        None otherwise
+        :param user_id: the id of the table's client
+        :param deadline: the earliest booking time allowed to be cancelled
+        :param version: the expected version of the booking or None to skip
+        the version check
+        :param record: a coroutine function called with the cancelled row
+        before the commit
+        :return: a row containing the cancelled table columns, the previous
+        booking time and persons or None if conditions were not met
+        """
+        cancelled_row = await self._update_own_booking(
+            db, table_id, user_id, deadline, version, record,
+            is_booked=False)
+
+        return cancelled_row
+
+    @staticmethod
+    def _get_expiry_cutoff() -> time:
+        """This method returns the booking time before which bookings are
+        considered as expired
+        :return: the cutoff time
+        """
+        return (datetime.now(tz=TZ) - timedelta(hours=BOOKING_HOURS)).time()
+
+    async def update_availability(
+            self, db: AsyncSession, record: Recorder | None = None
+    ) -> Sequence[Row]:
+        """This method updates an availability of the early booked tables
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param record: a coroutine function called with a list of tuples
+        containing booking time and persons of the released tables before
+        the commit
+        :return: a list of rows with the columns of the released tables kept
+        by the shared snapshot
         """
-        cancelled_table = await self.get_by_id(db, table_id)
-        cancelled_table.is_booked = False
         try:
-            db.add(cancelled_table)
+            expired = await db.execute(update(self.model).where(
+                self.model.is_booked == True,
+                self.model.booking_time < self._get_expiry_cutoff()).values(
+                is_booked=False, version=self.model.version + 1).returning(
+                self.model.id, self.model.max_persons, self.model.persons,
+                self.model.is_booked, self.model.booking_time,
+                self.model.version, self.model.client_id))
+            expired_rows = expired.all()
+            if not expired_rows:
+                await db.rollback()
+                return []
+            await self._bump_client_versions(
+                db, {row.client_id for row in expired_rows})
+            if record:
+                await record(db, [
+                    (row.booking_time, row.persons) for row in expired_rows])
             await db.commit()
-            return cancelled_table
         except Exception as e:
             await db.rollback()
-            print(f'There was an error during canceling your booking: {e}')
-            return None
+            print(f'There was an error updating availability: {e}')
+            return []
 
-    async def update_availability(
+        await self._bump_version(db)
+        return expired_rows
+
+    async def import_tables(
             self, db: AsyncSession,
-    ) -> None:
-        """This method updates an availability of the early booked tables
+            records: AsyncIterable[tuple[int, int, int]]
+    ) -> tuple[int, int] | None:
+        """This method loads tables into a temporary staging spreadsheet by
+        the COPY command and then upserts them into the table spreadsheet by
+        one statement. If the same id occurs several times the last row wins
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param records: an asynchronous iterable of tuples containing line
+        number, id and max persons of the tables
+        :return: a tuple with amounts of inserted and updated tables or None
+        if import was failed
+        """
+        staging = staging_table.c
+        upsert = insert(self.model).from_select(
+            ['id', 'max_persons', 'persons', 'is_booked'],
+            select(
+                staging.id, staging.max_persons, literal(0), literal(False)
+            ).distinct(staging.id).order_by(staging.id, staging.line.desc()))
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[self.model.id],
+            set_={
+                'max_persons': upsert.excluded.max_persons,
+                'version': self.model.version + 1}
+        ).returning((sqa.literal_column('xmax') == 0).label('inserted'))
+        upserted = upsert.cte('upserted')
+        try:
+            connection = await db.connection()
+            await connection.run_sync(staging_table.create)
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                IMPORT_STAGING_TABLE, records=records,
+                columns=['line', 'id', 'max_persons'])
+            counts = await db.execute(select(
+                func.count().filter(upserted.c.inserted),
+                func.count().filter(~upserted.c.inserted)))
+            inserted, updated = counts.one()
+            if updated:
+                await self._bump_client_versions(db, select(
+                    self.model.client_id).where(
+                    self.model.is_booked == True,
+                    self.model.id.in_(select(staging.id))))
+            await db.execute(select(func.setval(
+                func.pg_get_serial_sequence(
+                    f'"{self.model.__tablename__}"', 'id'),
+                select(func.max(self.model.id)).scalar_subquery())))
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            print(f'There was an error importing tables: {e}')
+            return None
+
+        await self._bump_version(db)
+        return inserted, updated
+
+    async def stream_bookings(
+            self, db: AsyncSession, time_from: time | None = None,
+            time_to: time | None = None
+    ) -> AsyncIterator[Sequence[RowMapping]]:
+        """This method streams booked tables joined with their clients by a
+        server-side cursor. The cursor keeps the connection and the
+        transaction open during the whole download, so exports should read a
+        replica. The session is closed when the stream is over to release the
+        connection as soon as possible
         :param db: an instance of the AsyncSession provides a connection
         to the database
+        :param time_from: the earliest booking time to export
+        :param time_to: the latest booking time to export
+        :return: an asynchronous iterator of lists with EXPORT_CHUNK_ROWS
+        rows at most
         """
-        await db.execute(update(self.model).where(
-            self.model.booking_time < (datetime.now(tz=TZ) - timedelta(
-                hours=2)).time()).values(is_booked=False))
+        query = select(
+            self.model.id, self.model.booking_time, self.model.persons,
+            self.user.name.label('client_name'),
+            self.user.phone.label('client_phone'),
+            self.user.email.label('client_email')
+        ).join(self.user).where(self.model.is_booked == True)
+        if time_from:
+            query = query.where(self.model.booking_time >= time_from)
+        if time_to:
+            query = query.where(self.model.booking_time <= time_to)
+
+        try:
+            bookings = await db.stream(
+                query.order_by(self.model.id).execution_options(
+                    yield_per=EXPORT_CHUNK_ROWS))
+            async for partition in bookings.mappings().partitions():
+                yield partition
+        finally:
+            await db.close()
@@ -3,9 +3,11 @@ from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from dao.models import User
 from services.schemas import UserRegisterSchema
+from tracing import trace_methods
 # -------------------------------------------------------------------------
 
 
+@trace_methods('dao')
 class UserDao:
     """The UserDao class provides access to the user table"""
     def __init__(self) -> None:
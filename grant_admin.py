@@ -0,0 +1,51 @@
+"""This file contains functions to grant or revoke the administrator rights
+of a registered user"""
+from argparse import ArgumentParser
+from asyncio import run
+from contextlib import nullcontext
+from container import storage, user_service
+from dao import get_session_maker
+from dao.memory_storage import StorageLockedError
+# ------------------------------------------------------------------------
+
+
+async def grant_admin(email: str, is_admin: bool = True) -> None:
+    """This function changes the administrator rights of the user and prints
+    the result
+    :param email: the email address of the user
+    :param is_admin: a boolean indicating whether to grant or to revoke the
+    rights
+    """
+    if storage:
+        try:
+            storage.lock()
+        except StorageLockedError as e:
+            print(f'{e}, stop the server to change the rights')
+            return
+        storage.recover()
+    try:
+        async with nullcontext() if storage else (
+                get_session_maker()()) as db:
+            user = await user_service.dao.get_by_email(db, email)
+            if not user:
+                print(f'User {email} is not found')
+                return
+            user.is_admin = is_admin
+            if not await user_service.dao.update(db, user):
+                print(f'Failed to change the rights of {email}')
+                return
+    finally:
+        if storage:
+            storage.close()
+    print(f'User {email} is {"" if is_admin else "not "}an administrator')
+
+
+parser = ArgumentParser(
+    description='Grant or revoke the administrator rights of a user')
+parser.add_argument('email', help='the email address of the user')
+parser.add_argument(
+    '--revoke', action='store_true', help='revoke the rights instead')
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+    run(grant_admin(arguments.email, not arguments.revoke))
@@ -0,0 +1,70 @@
+"""This file contains functions to create or update the tables of the floor
+plan from a CSV or NDJSON file without dropping existing data"""
+from argparse import ArgumentParser
+from asyncio import run
+from contextlib import nullcontext
+from typing import AsyncIterator
+from fastapi import HTTPException
+from constants import IMPORT_CHUNK_BYTES
+from container import storage, table_service
+from dao import get_session_maker
+from dao.memory_storage import StorageLockedError
+from services.schemas import FileFormat, ImportReportSchema
+# ------------------------------------------------------------------------
+
+
+async def read_chunks(filename: str) -> AsyncIterator[bytes]:
+    """This function reads the file by chunks of IMPORT_CHUNK_BYTES size
+    :param filename: the name of the file to read
+    :return: an asynchronous iterator of byte chunks
+    """
+    with open(filename, 'rb') as f:
+        while chunk := f.read(IMPORT_CHUNK_BYTES):
+            yield chunk
+
+
+def print_progress(report: ImportReportSchema) -> None:
+    """This function prints the current progress of the import
+    :param report: an ImportReportSchema with the current result
+    """
+    print(f'Processed rows: {report.processed}, failed: {report.failed}')
+
+
+async def import_tables(filename: str, file_format: FileFormat) -> None:
+    """This function imports the tables from the file and prints the report
+    :param filename: the name of the file to import
+    :param file_format: a format of the file
+    """
+    if storage:
+        try:
+            storage.lock()
+        except StorageLockedError as e:
+            print(f'{e}, post the tables to the /admin/tables/import route '
+                  f'of the running server instead')
+            return
+        storage.recover()
+    async with nullcontext() if storage else (
+            get_session_maker()()) as db:
+        try:
+            report = await table_service.import_tables(
+                db, read_chunks(filename), file_format, print_progress)
+        except HTTPException as e:
+            print(e.detail)
+            return
+        finally:
+            if storage:
+                storage.close()
+    print(report.json(indent=2))
+
+
+parser = ArgumentParser(description='Import tables from a CSV or NDJSON file')
+parser.add_argument('filename', help='a file to import the tables from')
+parser.add_argument(
+    '--format', dest='file_format',
+    choices=[item.value for item in FileFormat], default=FileFormat.csv.value,
+    help='a format of the file')
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+    run(import_tables(
+        arguments.filename, FileFormat(arguments.file_format)))
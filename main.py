@@ -1,19 +1,47 @@
 """This is a main file to start the app, it also contains FastApi views"""
-from fastapi import FastAPI, Depends
-from fastapi.responses import RedirectResponse
+from datetime import date, time
+from typing import Any
+from fastapi import FastAPI, Depends, Request, Response, Header, Query
+from fastapi.responses import RedirectResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from dao.models import User
 from services import schemas
-from container import user_service, table_service
-from utils import get_db, get_description
-from constants import API_VERSION, API_TITLE
+from services.user_service import oauth_schema
+from container import user_service, table_service, analytics_service
+from tracing import TracingMiddleware, instrument_sqlalchemy
+from admission import admission
+from startup import lifespan
+from utils import (
+    get_db, get_replica_db, get_lazy_db, get_description, make_etag,
+    parse_etag, is_not_modified)
+from constants import (
+    API_VERSION, API_TITLE, API_DESCRIPTION, EXPORT_MEDIA_TYPES,
+    VACANT_CACHE_CONTROL, CLIENT_CACHE_CONTROL, TRACE_SAMPLE_RATE)
 # ------------------------------------------------------------------------
 
 app = FastAPI(
-    version=API_VERSION, description=get_description(), title=API_TITLE
+    version=API_VERSION, description=API_DESCRIPTION, title=API_TITLE,
+    lifespan=lifespan
 )
 
 
+def openapi() -> dict[str, Any]:
+    """This function builds the OpenAPI schema on the first request to the
+    documentation, the description is read from README.md only then
+    :return: a dictionary containing the OpenAPI schema
+    """
+    if not app.openapi_schema:
+        app.description = get_description()
+    return FastAPI.openapi(app)
+
+
+app.openapi = openapi
+
+if TRACE_SAMPLE_RATE:
+    app.add_middleware(TracingMiddleware)
+    instrument_sqlalchemy()
+
+
 @app.get(
     '/', response_class=RedirectResponse,
     description='The start page of the application')
@@ -75,31 +103,77 @@ async def logout(
 @app.get(
     '/table/vacant', response_model=list[schemas.TableSchema],
     summary='Get a list of all available tables',
-    description='This route returns all vacant tables')
+    description='This route returns all vacant tables. The ETag header '
+                'contains the availability version, if it is the same as '
+                'the If-None-Match header 304 is returned without tables')
 async def all_tables(
-        session: AsyncSession = Depends(get_db)
-) -> list[schemas.TableSchema]:
+        response: Response, if_none_match: str | None = Header(None),
+        session: AsyncSession = Depends(get_lazy_db)
+) -> list[schemas.TableSchema] | Response:
     """This view serves to receive all vacant tables
-    :param session: an instance of AsyncSession providing by get_db function
-    :return: a list of TableSchema instances
+    :param response: an instance of Response to set caching headers to
+    :param if_none_match: ETags of the tables the client already has
+    :param session: an instance of AsyncSession providing by get_lazy_db
+    function
+    :return: a list of TableSchema instances or an empty 304 response
     """
-    tables = await table_service.get_all(session)
+    version = await table_service.get_version(session)
+    headers = {
+        'ETag': make_etag(version), 'Cache-Control': VACANT_CACHE_CONTROL}
+    if is_not_modified(if_none_match, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    version, tables = await table_service.get_vacant(session)
+    headers['ETag'] = make_etag(version)
+    response.headers.update(headers)
     return tables
 
 
+@app.get(
+    '/table/calendar', response_model=schemas.CalendarDaySchema,
+    summary='Get free booking slots',
+    description='This route returns 15-minute slots of today in which at '
+                'least one table for the given amount of persons can be '
+                'booked. Bookings are made for today only')
+async def calendar(
+        persons: int = Query(1, gt=0),
+        session: AsyncSession = Depends(get_lazy_db)
+) -> schemas.CalendarDaySchema:
+    """This view serves to receive free booking slots
+    :param persons: the amount of persons
+    :param session: an instance of AsyncSession providing by get_lazy_db
+    function
+    :return: a CalendarDaySchema instance
+    """
+    free_day = await table_service.get_calendar(session, persons)
+    return free_day
+
+
 @app.get(
     '/table/me', response_model=list[schemas.TableSchema],
     summary='Get all tables of a current user',
-    description='This route returns all tables of booked by the current user')
+    description='This route returns all tables of booked by the current user. '
+                'The ETag header contains the version of the user\'s tables, '
+                'if it is the same as the If-None-Match header 304 is '
+                'returned without tables')
 async def client_tables(
+        response: Response, if_none_match: str | None = Header(None),
         session: AsyncSession = Depends(get_db),
         user: User = Depends(user_service.get_by_token)
-) -> list[schemas.TableSchema]:
+) -> list[schemas.TableSchema] | Response:
     """This view serves to receive all tables booked by the current user
+    :param response: an instance of Response to set caching headers to
+    :param if_none_match: ETags of the tables the client already has
     :param session: an instance of AsyncSession providing by get_db function
     :param user: a model representing current user
-    :return: a list of TableSchema instances
+    :return: a list of TableSchema instances or an empty 304 response
     """
+    version = await table_service.get_client_version(session, user)
+    headers = {
+        'ETag': make_etag(version), 'Cache-Control': CLIENT_CACHE_CONTROL,
+        'Vary': 'Authorization'}
+    if is_not_modified(if_none_match, headers['ETag']):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
     tables = await table_service.get_by_client(session, user.email)
     return tables
 
@@ -108,13 +182,14 @@ async def client_tables(
     '/table/book/{table_id}', summary='Booking a new table',
     description='This route serves to book a new table')
 async def book_table(
-        table_id: int, table: schemas.TableBookSchema,
+        table_id: int, table: schemas.TableBookSchema, response: Response,
         session: AsyncSession = Depends(get_db),
         user: User = Depends(user_service.get_by_token)
 ) -> dict[str, str]:
     """This view serves to book a table by its id
     :param table_id: the id of the table to book
     :param table: an instance of TableBookSchema class
+    :param response: an instance of Response to set the ETag header to
     :param session: an instance of AsyncSession providing by get_db function
     :param user: a model representing current user
     :return: a dictionary representing a result of the booking
@@ -124,6 +199,7 @@ async def book_table(
     table = await table_service.book_new(session, table)
     if not table:
         return {'message': 'Failed to book table'}
+    response.headers['ETag'] = make_etag(table.version)
     return {'message': 'The table is booked successfully'}
 
 
@@ -131,24 +207,31 @@ async def book_table(
     '/table/change/{table_id}', summary='Change a booking parameters',
     description='This route serves to allow the current user to change the '
                 'parameters of his booking such as persons amount and booking '
-                'time')
+                'time. If the If-Match header is provided the booking is '
+                'changed only if its version is the same, otherwise 409 is '
+                'returned with the current state of the booking')
 async def change_table_booking(
         table_id: int, table: schemas.TableBookChangeSchema,
+        response: Response, if_match: str | None = Header(None),
         session: AsyncSession = Depends(get_db),
         user: User = Depends(user_service.get_by_token)
 ) -> dict[str, str]:
     """This view serves to change booking options of a chosen table
     :param table_id: the id of the table to book
     :param table: an instance of TableBookSchema class
+    :param response: an instance of Response to set the ETag header to
+    :param if_match: the expected version of the booking
     :param session: an instance of AsyncSession providing by get_db function
     :param user: a model representing current user
     :return: a dictionary representing a result of the booking
     """
     table.id = table_id
     table.client_id = user.id
-    table = await table_service.change_booking(session, table, user.id)
+    table = await table_service.change_booking(
+        session, table, user.id, parse_etag(if_match))
     if not table:
         return {'message': 'Failed to change bookings'}
+    response.headers['ETag'] = make_etag(table.version)
     return {'message': 'The booking was changed successfully'}
 
 
@@ -156,19 +239,127 @@ async def change_table_booking(
     '/table/cancel/{table_id}', summary='Cancel booking',
     description='This route serves to cancel chosen booking of a table. You '
                 'cannot cancel booking less than an hour before early chosen '
-                'booking time')
+                'booking time. If the If-Match header is provided the booking '
+                'is cancelled only if its version is the same')
 async def cancel_booking(
-        table_id: int, session: AsyncSession = Depends(get_db),
+        table_id: int, response: Response,
+        if_match: str | None = Header(None),
+        session: AsyncSession = Depends(get_db),
         user: User = Depends(user_service.get_by_token)
 ) -> dict[str, str]:
     """This view serves to cancel booking of a chosen table
     :param table_id: the id of the table to book
+    :param response: an instance of Response to set the ETag header to
+    :param if_match: the expected version of the booking
     :param session: an instance of AsyncSession providing by get_db function
     :param user: a model representing current user
     :return: a dictionary representing a result of the booking
     """
 
-    canceled = await table_service.cancel_booking(session, table_id, user.id)
+    canceled = await table_service.cancel_booking(
+        session, table_id, user.id, parse_etag(if_match))
     if canceled:
+        response.headers['ETag'] = make_etag(canceled.version)
         return {'message': 'Booking is cancelled successfully'}
     return {'message': 'Failed to cancel booking'}
+
+
+@app.get(
+    '/analytics/occupancy', response_model=list[schemas.OccupancySchema],
+    summary='Get hourly occupancy',
+    description='This route returns booked tables, covers, bookings, '
+                'cancellations, expirations and the cancellation rate '
+                'aggregated by booking hour. Arrivals are not registered, '
+                'so expirations include both visits and no-shows')
+async def occupancy(
+        session: AsyncSession = Depends(get_db),
+        user: User = Depends(user_service.get_admin_by_token)
+) -> list[schemas.OccupancySchema]:
+    """This view serves to receive hourly occupancy aggregates
+    :param session: an instance of AsyncSession providing by get_db function
+    :param user: a model representing current administrator
+    :return: a list of OccupancySchema instances
+    """
+    hours = await analytics_service.get_occupancy(session)
+    return hours
+
+
+@app.get(
+    '/admin/admission', response_model=schemas.AdmissionSchema,
+    summary='Get admission control counters',
+    description='This route returns the capacity of the admission control, '
+                'sessions in progress, the queue depth and amounts of '
+                'admitted and shed sessions by priority of the current '
+                'worker process')
+async def admission_stats(
+        user: User = Depends(user_service.get_admin_by_token)
+) -> schemas.AdmissionSchema:
+    """This view serves to receive admission control counters
+    :param user: a model representing current administrator
+    :return: an AdmissionSchema instance
+    """
+    return schemas.AdmissionSchema(**admission.stats())
+
+
+@app.post(
+    '/admin/tables/import', response_model=schemas.ImportReportSchema,
+    summary='Import tables',
+    description='This route serves to create or update tables from a CSV '
+                '(with id and max_persons header) or NDJSON request body. '
+                'The body is streamed to the database so the file size '
+                'is not limited by the memory')
+async def import_tables(
+        request: Request,
+        file_format: schemas.FileFormat = schemas.FileFormat.csv,
+        session: AsyncSession = Depends(get_db),
+        user: User = Depends(user_service.get_admin_by_token)
+) -> schemas.ImportReportSchema:
+    """This view serves to import tables from the request body
+    :param request: an instance of Request providing the body stream
+    :param file_format: a format of the request body
+    :param session: an instance of AsyncSession providing by get_db function
+    :param user: a model representing current administrator
+    :return: an ImportReportSchema instance
+    """
+    report = await table_service.import_tables(
+        session, request.stream(), file_format)
+    return report
+
+
+@app.get(
+    '/admin/bookings/export', response_class=StreamingResponse,
+    summary='Export bookings',
+    description='This route streams all booked tables with names and phones '
+                'of their clients as CSV or NDJSON, optionally compressed by '
+                'gzip. Bookings can be filtered by booking time. The export '
+                'reads the replica if it is configured, otherwise it holds a '
+                'connection and a transaction of the primary database until '
+                'the download is over. The administrator is checked by the '
+                'same session, so the export holds one connection')
+async def export_bookings(
+        file_format: schemas.FileFormat = schemas.FileFormat.csv,
+        time_from: time | None = None, time_to: time | None = None,
+        compress: bool = False,
+        session: AsyncSession = Depends(get_replica_db),
+        token: str = Depends(oauth_schema)
+) -> StreamingResponse:
+    """This view serves to export bookings
+    :param file_format: a format of the exported data
+    :param time_from: the earliest booking time to export
+    :param time_to: the latest booking time to export
+    :param compress: a boolean indicating whether to compress the data
+    :param session: an instance of AsyncSession providing by get_replica_db
+    function
+    :param token: a string representing the token of the administrator
+    :return: a StreamingResponse with exported bookings
+    """
+    await user_service.get_admin_by_token(session, token)
+    filename = f'bookings-{date.today()}.{file_format.value}'
+    media_type = EXPORT_MEDIA_TYPES[file_format.value]
+    if compress:
+        filename, media_type = f'{filename}.gz', 'application/gzip'
+    chunks = table_service.export_bookings(
+        session, file_format, time_from, time_to, compress)
+    return StreamingResponse(
+        chunks, media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename={filename}'})
@@ -0,0 +1,207 @@
+"""This file contains the production entry point of the application. The
+master process binds the listening socket once and runs worker processes
+serving it with uvloop and httptools. SIGTERM and SIGINT stop the workers
+gracefully, SIGHUP restarts them one by one, a new worker is started before
+the old one stops accepting connections, so no request is dropped. The
+memory backend keeps its log and snapshot files in one process, so it is
+served by one worker which is stopped before its replacement starts"""
+import os
+import signal
+import socket
+import time as timer
+from argparse import ArgumentParser
+from asyncio import create_task, run, sleep
+from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
+from multiprocessing.synchronize import Event
+from typing import Any
+from uvicorn import Config, Server
+from constants import (
+    SERVER_HOST, SERVER_PORT, SERVER_WORKERS, SERVER_GRACEFUL_TIMEOUT,
+    SERVER_READY_TIMEOUT, DB_MAX_CONNECTIONS, STORAGE_BACKEND)
+# ------------------------------------------------------------------------
+
+spawn = get_context('spawn')
+
+
+def get_workers(
+        workers: int = SERVER_WORKERS, backend: str = STORAGE_BACKEND
+) -> int:
+    """This function returns the amount of worker processes
+    :param workers: the configured amount, 0 means the amount of CPU cores
+    available to the process
+    :param backend: the storage backend, the memory backend is served by
+    one worker because processes cannot share its files
+    :return: the amount of workers
+    """
+    if backend == 'memory':
+        if workers != 1:
+            print('The memory backend is served by one worker')
+        return 1
+    if workers > 0:
+        return workers
+    return len(os.sched_getaffinity(0)) if hasattr(
+        os, 'sched_getaffinity') else os.cpu_count() or 1
+
+
+def size_pools(workers: int, max_connections: int = DB_MAX_CONNECTIONS
+               ) -> None:
+    """This function divides the database connections between workers. Every
+    worker creates its own pools after it is spawned, they read the sizes
+    from the environment inherited from the master
+    :param workers: the amount of workers
+    :param max_connections: connections allowed to all workers together or
+    0 to keep DB_POOL_SIZE and DB_MAX_OVERFLOW of every worker
+    """
+    if not max_connections:
+        return
+    os.environ['DB_POOL_SIZE'] = str(max(max_connections // workers, 1))
+    os.environ['DB_MAX_OVERFLOW'] = '0'
+
+
+def run_worker(config: Config, sock: socket.socket, ready: Event) -> None:
+    """This function runs the server in a worker process and sets the event
+    when the application has started
+    :param config: the uvicorn Config
+    :param sock: the listening socket bound by the master
+    :param ready: an Event to set after the startup
+    """
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    config.configure_logging()
+    server = Server(config)
+
+    async def serve() -> None:
+        serving = create_task(server.serve(sockets=[sock]))
+        while not server.started and not serving.done():
+            await sleep(0.05)
+        if server.started:
+            ready.set()
+        await serving
+
+    config.setup_event_loop()
+    run(serve())
+
+
+class Master:
+    """The Master class keeps worker processes running, replaces them on
+    SIGHUP and stops them on SIGTERM or SIGINT"""
+    def __init__(
+            self, config: Config, workers: int, overlap: bool = True
+    ) -> None:
+        """Initialize the Master class
+        :param config: the uvicorn Config passed to workers
+        :param workers: the amount of workers
+        :param overlap: a boolean indicating whether a worker is replaced by
+        starting the new one before stopping the old one. Workers of the
+        memory backend must not overlap, otherwise the closing worker
+        writes its snapshot over the changes of the new one
+        """
+        self.config = config
+        self.workers = workers
+        self.overlap = overlap
+        self.sock = config.bind_socket()
+        self.processes: list[BaseProcess] = []
+        self.signals: list[int] = []
+
+    def handle_signal(self, sig: int, frame: Any) -> None:
+        """This method remembers the signal to handle it in the main loop
+        :param sig: the number of the signal
+        :param frame: the current stack frame
+        """
+        self.signals.append(sig)
+
+    def start_worker(self) -> BaseProcess | None:
+        """This method starts a worker and waits until it serves requests
+        :return: the worker process or None if it failed to start
+        """
+        ready = spawn.Event()
+        process = spawn.Process(
+            target=run_worker, args=(self.config, self.sock, ready))
+        process.start()
+        started = timer.monotonic()
+        while not ready.wait(0.1):
+            if (not process.is_alive()
+                    or timer.monotonic() - started > SERVER_READY_TIMEOUT):
+                print(f'Worker {process.pid} failed to start')
+                self.stop_worker(process)
+                return None
+        print(f'Worker {process.pid} started')
+        return process
+
+    @staticmethod
+    def stop_worker(process: BaseProcess) -> None:
+        """This method stops the worker gracefully: it stops accepting
+        connections, finishes requests in progress and closes database
+        pools. The worker is killed if it doesn't exit in time
+        :param process: the worker process
+        """
+        if process.is_alive():
+            os.kill(process.pid, signal.SIGTERM)
+        process.join(SERVER_GRACEFUL_TIMEOUT + 5)
+        if process.is_alive():
+            print(f'Worker {process.pid} is killed')
+            process.kill()
+            process.join()
+
+    def restart(self) -> None:
+        """This method replaces workers one by one, a worker is stopped only
+        after its replacement has started if workers can overlap, otherwise
+        before it"""
+        for i, process in enumerate(list(self.processes)):
+            if not self.overlap:
+                self.stop_worker(process)
+            new_process = self.start_worker()
+            if new_process is None:
+                print('Restart is aborted')
+                return
+            self.processes[i] = new_process
+            self.stop_worker(process)
+
+    def run(self) -> None:
+        """This method starts workers and supervises them until SIGTERM or
+        SIGINT is received"""
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self.handle_signal)
+        print(f'Listening on {self.config.host}:{self.config.port} '
+              f'with {self.workers} workers')
+        self.processes = [
+            process for _ in range(self.workers)
+            if (process := self.start_worker())]
+
+        while True:
+            if self.signals:
+                if self.signals.pop(0) != signal.SIGHUP:
+                    break
+                self.restart()
+            for i, process in enumerate(self.processes):
+                if not process.is_alive():
+                    print(f'Worker {process.pid} exited with code '
+                          f'{process.exitcode}')
+                    self.processes[i] = self.start_worker() or process
+            timer.sleep(0.5)
+
+        for process in self.processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        for process in self.processes:
+            self.stop_worker(process)
+        self.sock.close()
+
+
+parser = ArgumentParser(description='Run the application by several workers')
+parser.add_argument('--host', default=SERVER_HOST, help='a host to bind')
+parser.add_argument(
+    '--port', type=int, default=SERVER_PORT, help='a port to bind')
+parser.add_argument(
+    '--workers', type=int, default=SERVER_WORKERS,
+    help='an amount of worker processes, 0 means the amount of CPU cores')
+
+if __name__ == '__main__':
+    arguments = parser.parse_args()
+    workers = get_workers(arguments.workers)
+    size_pools(workers)
+    Master(Config(
+        'main:app', host=arguments.host, port=arguments.port,
+        loop='uvloop', http='httptools', proxy_headers=True,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT), workers,
+        overlap=STORAGE_BACKEND != 'memory').run()
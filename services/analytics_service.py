@@ -0,0 +1,121 @@
+"""This unit contains an AnalyticsService class providing a business logic to
+keep the hourly occupancy aggregates up to date. The record methods are
+called by the table data access objects before they commit a booking change,
+so the aggregates are changed in the same transaction"""
+from datetime import time
+from typing import Any, Iterable, Sequence
+from sqlalchemy import Row, RowMapping
+from sqlalchemy.ext.asyncio import AsyncSession
+from dao.analytics_dao import AnalyticsDao
+from dao.models import Table
+from tracing import trace_methods
+# ----------------------------------------------------------------------------
+
+
+@trace_methods('service')
+class AnalyticsService:
+    """The AnalyticsService class turns booking events into increments of the
+    hourly occupancy aggregates"""
+    def __init__(self, dao: AnalyticsDao = AnalyticsDao()) -> None:
+        """Initialize the AnalyticsService class
+        :param dao: An AnalyticsDao instance to store the aggregates
+        """
+        self.dao = dao
+
+    async def get_occupancy(
+            self, db: AsyncSession
+    ) -> Sequence[Row | RowMapping | Any]:
+        """This method returns the hourly occupancy aggregates
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :return: a list of Occupancy models
+        """
+        occupancy = await self.dao.get_all(db)
+
+        return occupancy
+
+    @staticmethod
+    def _add(
+            deltas: dict[int, dict[str, int]], booking_time: time | None,
+            **counters: int
+    ) -> None:
+        """This method adds counters to the deltas of the hour of the provided
+        booking time
+        :param deltas: a dictionary with deltas grouped by hour
+        :param booking_time: the booking time to get the hour from
+        :param counters: counter names with values to add
+        """
+        if booking_time is None:
+            return
+        hour_deltas = deltas.setdefault(booking_time.hour, {})
+        for counter, value in counters.items():
+            hour_deltas[counter] = hour_deltas.get(counter, 0) + value
+
+    async def _apply(
+            self, db: AsyncSession, deltas: dict[int, dict[str, int]]
+    ) -> None:
+        """This method stores the collected deltas in the current transaction
+        if there are any
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param deltas: a dictionary with deltas grouped by hour
+        """
+        if deltas:
+            await self.dao.apply(db, deltas)
+
+    async def record_booking(
+            self, db: AsyncSession, table: Table | Row
+    ) -> None:
+        """This method records a new booking
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param table: the booked Table model or row
+        """
+        deltas = {}
+        self._add(
+            deltas, table.booking_time, booked=1, covers=table.persons,
+            bookings=1)
+        await self._apply(db, deltas)
+
+    async def record_change(self, db: AsyncSession, table: Row) -> None:
+        """This method records changed booking details
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param table: the updated row with previous_time and previous_persons
+        """
+        deltas = {}
+        self._add(
+            deltas, table.previous_time, booked=-1,
+            covers=-table.previous_persons)
+        self._add(
+            deltas, table.booking_time, booked=1, covers=table.persons)
+        await self._apply(db, deltas)
+
+    async def record_cancel(self, db: AsyncSession, table: Row) -> None:
+        """This method records a cancelled booking
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param table: the cancelled row with previous_time and
+        previous_persons
+        """
+        deltas = {}
+        self._add(
+            deltas, table.previous_time, booked=-1,
+            covers=-table.previous_persons, cancellations=1)
+        await self._apply(db, deltas)
+
+    async def record_expired(
+            self, db: AsyncSession, expired: Iterable[tuple[time, int]]
+    ) -> None:
+        """This method records bookings released after their time passed
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param expired: pairs of booking time and persons of the released
+        bookings
+        """
+        deltas = {}
+        for booking_time, persons in expired:
+            self._add(
+                deltas, booking_time, booked=-1, covers=-persons,
+                expirations=1)
+        await self._apply(db, deltas)
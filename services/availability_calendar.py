@@ -0,0 +1,179 @@
+"""This file contains an AvailabilityCalendar class answering which booking
+slots are free. Every table has a bitmap in which a set bit means that the
+table can be booked in the slot, the bitmaps of all days are packed into one
+integer so a day range is checked by one operation"""
+from datetime import date, datetime, time, timedelta
+from typing import Any, Iterable
+from constants import (
+    CALENDAR_DAYS, CALENDAR_OPENS, CALENDAR_CLOSES, CALENDAR_SLOT_MINUTES,
+    BOOKING_HOURS)
+# --------------------------------------------------------------------------
+
+
+def get_minutes(moment: time) -> int:
+    """This function converts a time to minutes from midnight
+    :param moment: the time to convert
+    :return: the amount of minutes
+    """
+    return moment.hour * 60 + moment.minute + (moment.second > 0)
+
+
+class AvailabilityCalendar:
+    """The AvailabilityCalendar class keeps a bitmap of every table and for
+    every maximum of persons the amount of free tables in each slot. The
+    amounts are bit-sliced: the bit of a slot in the k-th counter is the
+    k-th bit of its amount, so adding or removing a table bitmap takes a few
+    operations on whole integers and a cancelled booking can be reverted. A
+    booking has no date, it is made for today and blocks the table until it
+    expires BOOKING_HOURS later, so the service keeps a calendar of one day
+    and only the slots of the first day are cleared by bookings. Changes made by the current process are applied to
+    the affected tables, other changes are found by versions of tables"""
+    def __init__(
+            self, days: int = CALENDAR_DAYS, opens: time = CALENDAR_OPENS,
+            closes: time = CALENDAR_CLOSES,
+            slot_minutes: int = CALENDAR_SLOT_MINUTES
+    ) -> None:
+        """Initialize the AvailabilityCalendar class
+        :param days: an amount of days in the calendar starting from today
+        :param opens: the time of the first slot
+        :param closes: the time of the last slot
+        :param slot_minutes: the length of a slot in minutes
+        """
+        self.days = days
+        self.opens = get_minutes(opens)
+        self.slot_minutes = slot_minutes
+        self.slots = (get_minutes(closes) - self.opens) // slot_minutes + 1
+        self.day_mask = (1 << self.slots) - 1
+        self.full_mask = (1 << self.days * self.slots) - 1
+        self.version = None
+        self.tables: dict[int, tuple[int, int, int]] = {}
+        self.counters: dict[int, list[int]] = {}
+        self.capacities: dict[int, int] = {}
+
+    def _get_slot(self, moment: time | datetime) -> int:
+        """This method finds the first slot starting at the moment or later
+        :param moment: the time to find the slot for
+        :return: an index of the slot from 0 to the amount of slots
+        """
+        minutes = get_minutes(moment) - self.opens
+        slot = -(-minutes // self.slot_minutes)
+        return min(max(slot, 0), self.slots)
+
+    def get_bitmap(self, table: Any) -> int:
+        """This method makes the bitmap of the table
+        :param table: an object with is_booked and booking_time attributes
+        :return: the bitmap in which bits of the day d occupy positions from
+        d * slots to (d + 1) * slots - 1
+        """
+        if not table.is_booked or table.booking_time is None:
+            return self.full_mask
+        released = datetime.combine(
+            date.min, table.booking_time) + timedelta(hours=BOOKING_HOURS)
+        if released.date() > date.min:
+            return self.full_mask & ~self.day_mask
+        return self.full_mask & ~((1 << self._get_slot(released)) - 1)
+
+    def _count(self, max_persons: int, bitmap: int, add: bool) -> None:
+        """This method adds the bitmap of a table to the counters of its
+        maximum of persons or removes it and updates the bitmap of slots in
+        which at least one of these tables is free
+        :param max_persons: the maximum of persons of the table
+        :param bitmap: the bitmap of the table
+        :param add: a boolean indicating whether to add or to remove
+        """
+        counters = self.counters.setdefault(max_persons, [])
+        carry = bitmap
+        for i, counter in enumerate(counters):
+            if not carry:
+                break
+            counters[i] = counter ^ carry
+            carry = (counter if add else ~counter) & carry
+        if add and carry:
+            counters.append(carry)
+        while counters and not counters[-1]:
+            counters.pop()
+
+        free = 0
+        for counter in counters:
+            free |= counter
+        if free:
+            self.capacities[max_persons] = free
+        else:
+            self.counters.pop(max_persons)
+            self.capacities.pop(max_persons, None)
+
+    def _put(self, table: Any) -> None:
+        """This method replaces the bitmap of the table
+        :param table: an object with id, max_persons, is_booked,
+        booking_time and version attributes
+        """
+        previous = self.tables.get(table.id)
+        if previous:
+            self._count(previous[0], previous[1], add=False)
+        bitmap = self.get_bitmap(table)
+        self.tables[table.id] = (table.max_persons, bitmap, table.version)
+        self._count(table.max_persons, bitmap, add=True)
+
+    def build(self, version: int, tables: Iterable[Any]) -> None:
+        """This method brings the calendar to the version of the tables.
+        Bitmaps are made only for new tables and tables whose version or
+        maximum of persons has changed, missing tables are removed
+        :param version: the availability version of the tables
+        :param tables: objects with id, max_persons, is_booked,
+        booking_time and version attributes
+        """
+        missing = set(self.tables)
+        for table in tables:
+            missing.discard(table.id)
+            current = self.tables.get(table.id)
+            if (not current or current[2] != table.version
+                    or current[0] != table.max_persons):
+                self._put(table)
+        for table_id in missing:
+            max_persons, bitmap, _ = self.tables.pop(table_id)
+            self._count(max_persons, bitmap, add=False)
+        self.version = version
+
+    def apply(self, version: int | None, *tables: Any) -> None:
+        """This method applies tables changed by the current process. The
+        calendar version is advanced only if the change directly follows it,
+        otherwise changes of other processes could be missed and they are
+        found by the next build
+        :param version: the availability version made by the change or None
+        if it is unknown
+        :param tables: objects with id, max_persons, is_booked,
+        booking_time and version attributes
+        """
+        if self.version is None:
+            return
+        for table in tables:
+            current = self.tables.get(table.id)
+            if not current or current[2] < table.version:
+                self._put(table)
+        if version is not None and version == self.version + 1:
+            self.version = version
+
+    def get_free(
+            self, persons: int, days: int, now: datetime
+    ) -> list[tuple[date, list[time]]]:
+        """This method finds slots in which at least one table for the
+        persons is free
+        :param persons: the amount of persons
+        :param days: an amount of days starting from today
+        :param now: the current time, earlier slots of today are not free
+        :return: a list of tuples containing a date and free slot times
+        """
+        free = 0
+        for max_persons, bitmap in self.capacities.items():
+            if max_persons >= persons:
+                free |= bitmap
+        free &= ~((1 << self._get_slot(now)) - 1)
+
+        calendar = []
+        for day in range(min(days, self.days)):
+            day_bitmap = free >> day * self.slots & self.day_mask
+            calendar.append((now.date() + timedelta(days=day), [
+                time(*divmod(self.opens + slot * self.slot_minutes, 60))
+                for slot in range(self.slots) if day_bitmap >> slot & 1]))
+
+        return calendar
@@ -1,6 +1,7 @@
 """This file contains schemas serves as serializers"""
 from datetime import time
-from datetime import datetime
+from datetime import date, datetime
+from enum import Enum
 from pydantic import BaseModel, PositiveInt, validator, Field, root_validator
 from pydantic import EmailStr
 from constants import TZ
@@ -30,6 +31,8 @@ class BaseTableSchema(BaseModel):
 
 class TableSchema(BaseTableSchema):
     """This schema used as serializer to get a list of tables"""
+    version: int = 0
+
     class Config:
         orm_mode = True
 
@@ -107,6 +110,76 @@ class UserSchema(BaseUserSchema):
     """This schema used as serializer to allow users to log in"""
 
 
+class OccupancySchema(BaseModel):
+    """This schema used as serializer to get hourly occupancy analytics.
+    Arrivals are not registered, so expirations include both visits and
+    no-shows and no no-show rate is counted"""
+    hour: int
+    booked: int = 0
+    covers: int = 0
+    bookings: int = 0
+    cancellations: int = 0
+    expirations: int = 0
+    cancellation_rate: float = 0.0
+
+    @root_validator(skip_on_failure=True)
+    def count_cancellation_rate(cls, values: dict) -> dict:
+        """This method counts a share of bookings cancelled by clients"""
+        bookings = values.get('bookings') or 0
+        cancellations = values.get('cancellations') or 0
+        values['cancellation_rate'] = (
+            round(cancellations / bookings, 4) if bookings else 0.0)
+
+        return values
+
+    class Config:
+        orm_mode = True
+
+
+class CalendarDaySchema(BaseModel):
+    """This schema used as serializer to get free booking slots of a day"""
+    date: date
+    slots: list[time] = []
+
+
+class AdmissionSchema(BaseModel):
+    """This schema used as serializer to get admission control counters"""
+    capacity: int
+    in_flight: int
+    queue_depth: int
+    max_queue_depth: int
+    admitted: dict[str, int]
+    shed: dict[str, int]
+
+
+class FileFormat(str, Enum):
+    """This enumeration contains formats of the imported and exported
+    files"""
+    csv = 'csv'
+    ndjson = 'ndjson'
+
+
+class TableImportSchema(BaseModel):
+    """This schema used as serializer to validate imported tables"""
+    id: PositiveInt
+    max_persons: PositiveInt
+
+
+class ImportErrorSchema(BaseModel):
+    """This schema used as serializer to describe a rejected imported row"""
+    line: int
+    error: str
+
+
+class ImportReportSchema(BaseModel):
+    """This schema used as serializer to get a result of the tables import"""
+    processed: int = 0
+    inserted: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: list[ImportErrorSchema] = []
+
+
 class Token(BaseModel):
     """This schema used as serializer to work with tokens"""
     email: EmailStr
@@ -1,45 +1,170 @@
 """This unit contains a TableService class providing a business logic to work
 with table spreadsheet"""
-from datetime import datetime, timedelta
-from typing import Any, Sequence
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timedelta, time
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Sequence
 from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy import Row, RowMapping
 from sqlalchemy.ext.asyncio import AsyncSession
-from constants import TZ, DEADLINE_HOURS
-from dao.models import Table
+from constants import (
+    TZ, DEADLINE_HOURS, IMPORT_PROGRESS_ROWS, IMPORT_MAX_ERRORS,
+    EXPORT_COLUMNS)
+from dao.models import Table, User
+from dao.shared_snapshot import SharedSnapshot
 from dao.table_dao import TableDao
+from services.analytics_service import AnalyticsService
+from services.availability_calendar import AvailabilityCalendar
 from services.schemas import (
-    TableSchema, TableBookSchema, TableBookChangeSchema)
+    TableSchema, TableBookSchema, TableBookChangeSchema, FileFormat,
+    TableImportSchema, ImportErrorSchema, ImportReportSchema,
+    CalendarDaySchema)
+from tracing import trace_methods
+from utils import iter_lines, make_etag
 # ----------------------------------------------------------------------------
 
 
+@trace_methods('service')
 class TableService:
     """The TableService class provides all necessary functions to work with
     table spreadsheet"""
-    def __init__(self, dao: TableDao = TableDao()) -> None:
+    def __init__(
+            self, dao: TableDao = TableDao(),
+            analytics: AnalyticsService = AnalyticsService(),
+            snapshot: SharedSnapshot | None = None
+    ) -> None:
         """Initialize the TableService class
         :param dao: A TableDao instance to receive a raw data from the database
+        :param analytics: An AnalyticsService instance to record booking
+        events
+        :param snapshot: A SharedSnapshot instance to read vacant tables from
+        or None to read them from the dao
         """
         self.dao = dao
+        self.analytics = analytics
+        self.snapshot = snapshot
         self.table_schema = TableSchema
+        self.calendar = AvailabilityCalendar()
 
-    async def get_all(
+    async def release_expired(self, db: AsyncSession) -> None:
+        """This method releases bookings whose time has passed and records
+        them by the analytics in the same transaction. It is called by a
+        timer every EXPIRY_INTERVAL seconds, so requests only read versions
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        """
+        released = await self.dao.update_availability(
+            db, self.analytics.record_expired)
+        if released:
+            self._apply_change(db, *released)
+
+    async def get_version(self, db: AsyncSession) -> int:
+        """This method returns the availability version which is changed by
+        every booking, change, cancellation, expiry and import of tables. The
+        version is taken from the shared snapshot if it is available,
+        otherwise it is received from the dao
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :return: the availability version
+        """
+        version = self.snapshot.get_version() if self.snapshot else None
+        if version is None:
+            version = await self.dao.get_version(db)
+
+        return version
+
+    async def refresh_snapshot(self, db: AsyncSession) -> None:
+        """This method rewrites the shared snapshot if the availability
+        version has changed. It is called periodically by the process which
+        is the writer of the snapshot
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        """
+        version = await self.dao.get_version(db)
+        if version == self.snapshot.version:
+            self.snapshot.touch()
+            return
+
+        tables = await self.dao.get_snapshot_rows(db)
+        self.snapshot.write(version, tables)
+
+    async def get_client_version(self, db: AsyncSession, user: User) -> int:
+        """This method returns the version of tables booked by the user
+        which is changed by every booking, change, cancellation, expiry and
+        import of these tables
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param user: a model representing the user
+        :return: the version of the user's tables
+        """
+        version = await self.dao.get_client_version(db, user)
+
+        return version
+
+    async def get_vacant(
             self, db: AsyncSession
-    ) -> Sequence[Row | RowMapping | Any] | None:
-        """This method returns a list of tables received from the dao or
-        raise 404-exception if no tables were received
+    ) -> tuple[int, Sequence[Row | RowMapping | Any]]:
+        """This method returns vacant tables with the availability version
+        they correspond to or raise 404-exception if no tables were
+        received. Tables and the version are read from the shared snapshot
+        by one pass if it is available, otherwise the version is received
+        from the dao before the tables, so it is never newer than them
         :param db: an instance of the AsyncSession provides a connection
         to the database
-        :return: a list of Table models
+        :return: a tuple with the version and a list of Table models or
+        SnapshotRecords
         """
-        tables = await self.dao.get_all(db)
-        if not tables:
+        vacant = self.snapshot.get_vacant() if self.snapshot else None
+        if vacant is None:
+            vacant = (
+                await self.dao.get_version(db), await self.dao.get_all(db))
+        if not vacant[1]:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail='Cannot find vacant tables')
 
+        return vacant
+
+    async def get_all(
+            self, db: AsyncSession
+    ) -> Sequence[Row | RowMapping | Any] | None:
+        """This method returns a list of vacant tables or raise
+        404-exception if no tables were received
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :return: a list of Table models or SnapshotRecords
+        """
+        _, tables = await self.get_vacant(db)
+
         return tables
 
+    async def get_calendar(
+            self, db: AsyncSession, persons: int
+    ) -> CalendarDaySchema:
+        """This method returns free booking slots of today for the given
+        amount of persons. Changes of the current process are applied
+        to the calendar when they are made, other changes are merged from the
+        shared snapshot or the dao when the availability version differs
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param persons: the amount of persons
+        :return: a CalendarDaySchema instance
+        """
+        version = await self.get_version(db)
+        if version != self.calendar.version:
+            snapshot = self.snapshot.get_all() if self.snapshot else None
+            if snapshot is None:
+                snapshot = (
+                    version, await self.dao.get_snapshot_rows(db))
+            self.calendar.build(*snapshot)
+        day, slots = self.calendar.get_free(
+            persons, 1, datetime.now(tz=TZ))[0]
+
+        return CalendarDaySchema(date=day, slots=slots)
+
     async def get_by_client(
             self, db: AsyncSession, email: str
     ) -> Sequence[Row | RowMapping | Any] | None:
@@ -83,80 +208,369 @@ class TableService:
         return table
 
     @staticmethod
-    def _check_client_and_time(
-            user_id: int, table: TableBookSchema
+    def _check_vacant(table: Any, persons: int) -> None:
+        """This method serves to check whether the table can be booked for
+        the given amount of persons
+        :param table: a Table model or a SnapshotRecord to check
+        :param persons: the amount of persons to book the table for
+        """
+        if table.is_booked:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='The table is booked'
+            )
+        elif persons > table.max_persons:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'The maximum number of persons for table: '
+                       f'{table.max_persons}'
+            )
+
+    @staticmethod
+    def _get_deadline() -> time:
+        """This method returns the earliest booking time which still can be
+        changed or cancelled
+        :return: the deadline time
+        """
+        return (datetime.now(tz=TZ) + timedelta(hours=DEADLINE_HOURS)).time()
+
+    async def _check_client_and_time(
+            self, db: AsyncSession, table_id: int, user_id: int,
+            deadline: time, version: int | None, persons: int | None = None
     ) -> None:
-        """This method serves to check whether the given user is a client of
-        the table and if time allows to update or cancel the current booking
+        """This method serves to find out why a conditional update of the
+        booking was failed and to raise the corresponding exception. It is
+        called only after the update so successful requests don't pay for it.
+        If no reason is found the table was changed by another request in
+        between and 409-exception is raised
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param table_id: the id of the table to check
         :param user_id: the id of the user to check
-        :param table: an instance of the TableBookSchema
+        :param deadline: the earliest booking time allowed to be updated
+        :param version: the expected version of the booking or None
+        :param persons: the new amount of persons or None if it is not
+        changed
         """
+        table = await self._check_and_get_table(db, table_id, book=False)
+
         if table.client_id != user_id:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail='You have not credentials to access this table'
             )
 
-        elif table.booking_time < (
-                datetime.now(tz=TZ) + timedelta(hours=DEADLINE_HOURS)).time():
+        elif not table.is_booked:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='The table is not booked'
+            )
+
+        elif (version is None or table.version == version) and (
+                table.booking_time < deadline):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='You cannot cancel or change booking less than an hour'
             )
 
+        elif (version is None or table.version == version) and (
+                persons is not None and persons > table.max_persons):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f'The maximum number of persons for table: '
+                       f'{table.max_persons}'
+            )
+
+        # the version differs or the table was changed by another request
+        # between the update and this read, in both cases the client has to
+        # retry with the current booking
+        if version is not None and table.version != version:
+            message = 'The booking was changed by another request'
+        else:
+            message = 'The booking could not be updated, please retry'
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                'message': message,
+                'table': jsonable_encoder(self.table_schema.from_orm(table))},
+            headers={'ETag': make_etag(table.version)}
+        )
+
+    async def _check_booking(
+            self, db: AsyncSession, table_id: int, persons: int
+    ) -> None:
+        """This method serves to find out why a conditional booking was
+        failed and to raise the corresponding exception. It is called only
+        after the booking so successful requests don't pay for it. If no
+        reason is found the table was changed by another request in between
+        and 409-exception is raised
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param table_id: the id of the table to check
+        :param persons: the amount of persons to book the table for
+        """
+        table = await self._check_and_get_table(db, table_id)
+        self._check_vacant(table, persons)
+
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={
+                'message': 'The table could not be booked, please retry',
+                'table': jsonable_encoder(self.table_schema.from_orm(table))},
+            headers={'ETag': make_etag(table.version)}
+        )
+
+    def _apply_change(self, db: AsyncSession, *tables: Any) -> None:
+        """This method applies tables changed by the current process to the
+        shared snapshot and to the calendar, so the change is visible before
+        the next refresh of the snapshot and the calendar is not rebuilt
+        :param db: an instance of the AsyncSession the change was made by
+        :param tables: the changed rows
+        """
+        version = self.dao.get_bumped_version(db)
+        if self.snapshot:
+            self.snapshot.apply(version, *tables)
+        self.calendar.apply(version, *tables)
+
     async def book_new(
             self, db: AsyncSession, table: TableBookSchema
-    ) -> Table | None:
-        """This method serves to book a new table
+    ) -> Row | None:
+        """This method serves to book a new table, the booking is recorded by
+        the analytics in the same transaction. The dao books the table only
+        if it is vacant and fits the persons, the reason of a failure is
+        found out afterwards. The shared snapshot is not used because it
+        can show a table cancelled by another process as booked, so only the
+        database decides
         :param db: an instance of the AsyncSession provides a connection
         to the database
         :param table: an instance of the TableBookSchema with booking details
-        :return: a Table model if booking was successful or None otherwise
+        :return: a row with the booked table if booking was successful or
+        None otherwise
         """
-        checking_table = await self._check_and_get_table(db, table.id)
-
-        if table.persons > checking_table.max_persons:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f'The maximum number of persons for table: '
-                       f'{checking_table.max_persons}'
-            )
-        table.max_persons = checking_table.max_persons
         table.is_booked = True
-        booked_table = await self.dao.book_one(db, table)
+        booked_table = await self.dao.book_one(
+            db, table, self.analytics.record_booking)
+        if not booked_table:
+            await self._check_booking(db, table.id, table.persons)
+            return None
+        self._apply_change(db, booked_table)
 
         return booked_table
 
     async def change_booking(
             self, db: AsyncSession, table: TableBookChangeSchema,
-            user_id: int
-    ) -> Table | None:
-        """This method serves to change the booking details for provided table
+            user_id: int, version: int | None = None
+    ) -> Row | None:
+        """This method serves to change the booking details for provided
+        table, the change is recorded by the analytics in the same transaction
         :param db: an instance of the AsyncSession provides a connection
         to the database
         :param table: an instance of the TableBookSchema with booking details
         to update
         :param user_id: the id of the table's client
-        :return: a Table model if updating was successful or None otherwise
+        :param version: the expected version of the booking or None to skip
+        the version check
+        :return: a row with the updated table if updating was successful or
+        None otherwise
         """
-        updating_table = await self._check_and_get_table(
-            db, table.id, book=False)
-        self._check_client_and_time(user_id, updating_table)
-        updated_table = await self.dao.update_booking(db, table)
+        deadline = self._get_deadline()
+        updated_row = await self.dao.update_booking(
+            db, table, user_id, deadline, version,
+            self.analytics.record_change)
+        if not updated_row:
+            await self._check_client_and_time(
+                db, table.id, user_id, deadline, version, table.persons)
+            return None
+        self._apply_change(db, updated_row)
 
-        return updated_table
+        return updated_row
 
     async def cancel_booking(
-            self, db: AsyncSession, table_id: int, user_id: int
-    ) -> Table | None:
-        """This method serves to cancel table's booking
+            self, db: AsyncSession, table_id: int, user_id: int,
+            version: int | None = None
+    ) -> Row | None:
+        """This method serves to cancel table's booking, the cancellation is
+        recorded by the analytics in the same transaction
         :param db: an instance of the AsyncSession provides a connection
         to the database
         :param table_id: the id of the table to cancel
         :param user_id: the id of the table's client
-        :return: a Table model if booking was successful or None otherwise
+        :param version: the expected version of the booking or None to skip
+        the version check
+        :return: a row with the cancelled table if cancelling was successful
+        or None otherwise
         """
-        table = await self._check_and_get_table(db, table_id, book=False)
-        self._check_client_and_time(user_id, table)
-        cancelled_table = await self.dao.cancel_booking(db, table_id)
-        return cancelled_table
+        deadline = self._get_deadline()
+        cancelled_row = await self.dao.cancel_booking(
+            db, table_id, user_id, deadline, version,
+            self.analytics.record_cancel)
+        if not cancelled_row:
+            await self._check_client_and_time(
+                db, table_id, user_id, deadline, version)
+            return None
+        self._apply_change(db, cancelled_row)
+
+        return cancelled_row
+
+    @staticmethod
+    async def _iter_records(
+            lines: AsyncIterable[str], file_format: FileFormat
+    ) -> AsyncIterator[tuple[int, str]]:
+        """This method joins imported lines into records. A quoted CSV field
+        can contain line breaks, so a CSV record ends only at a line break
+        outside quotes. Blank lines between records are skipped
+        :param lines: an asynchronous iterable of the imported lines
+        :param file_format: a format of the imported lines
+        :return: an asynchronous iterator of tuples containing the number of
+        the first line and the text of the record
+        """
+        line_number = 0
+        record_lines = []
+        quotes = 0
+        async for line in lines:
+            line_number += 1
+            if not record_lines and not line.strip():
+                continue
+            if file_format != FileFormat.csv:
+                yield line_number, line
+                continue
+
+            record_lines.append(line)
+            quotes += line.count('"')
+            if quotes % 2:
+                continue
+            yield line_number - len(record_lines) + 1, '\n'.join(record_lines)
+            record_lines = []
+            quotes = 0
+
+        if record_lines:
+            yield line_number - len(record_lines) + 1, '\n'.join(record_lines)
+
+    async def _parse_tables(
+            self, lines: AsyncIterable[str], file_format: FileFormat,
+            report: ImportReportSchema,
+            progress: Callable[[ImportReportSchema], None] | None = None
+    ) -> AsyncIterator[tuple[int, int, int]]:
+        """This method validates imported records one by one and yields
+        records ready to be copied. Invalid rows are counted and described in
+        the report instead of stopping the import
+        :param lines: an asynchronous iterable of the imported lines
+        :param file_format: a format of the imported lines
+        :param report: an ImportReportSchema to collect a result to
+        :param progress: a function to be called with the report every
+        IMPORT_PROGRESS_ROWS rows
+        :return: an asynchronous iterator of tuples containing line number,
+        id and max persons
+        """
+        header = None
+        async for line_number, record in self._iter_records(
+                lines, file_format):
+            if file_format == FileFormat.csv and header is None:
+                header = [
+                    name.strip() for name in next(csv.reader([record]))]
+                continue
+
+            report.processed += 1
+            if progress and not report.processed % IMPORT_PROGRESS_ROWS:
+                progress(report)
+            try:
+                if file_format == FileFormat.csv:
+                    row = dict(zip(
+                        header, next(csv.reader([record], strict=True))))
+                else:
+                    row = json.loads(record)
+                table = TableImportSchema(**row)
+            except Exception as e:
+                report.failed += 1
+                if len(report.errors) < IMPORT_MAX_ERRORS:
+                    report.errors.append(
+                        ImportErrorSchema(line=line_number, error=str(e)))
+                continue
+
+            yield line_number, table.id, table.max_persons
+
+    async def import_tables(
+            self, db: AsyncSession, chunks: AsyncIterable[bytes],
+            file_format: FileFormat = FileFormat.csv,
+            progress: Callable[[ImportReportSchema], None] | None = None
+    ) -> ImportReportSchema:
+        """This method serves to create or update tables from a stream of CSV
+        or NDJSON data. CSV data must start with a header containing id and
+        max_persons columns
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param chunks: an asynchronous iterable of byte chunks to import
+        :param file_format: a format of the imported data
+        :param progress: a function to be called with the report every
+        IMPORT_PROGRESS_ROWS rows
+        :return: an ImportReportSchema with a result of the import
+        """
+        report = ImportReportSchema()
+        records = self._parse_tables(
+            iter_lines(chunks), file_format, report, progress)
+        counts = await self.dao.import_tables(db, records)
+        if counts is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail='Failed to import tables')
+        report.inserted, report.updated = counts
+
+        return report
+
+    @staticmethod
+    def _encode_bookings(
+            bookings: Sequence[RowMapping], file_format: FileFormat
+    ) -> bytes:
+        """This method encodes a chunk of exported bookings
+        :param bookings: a list of rows to encode
+        :param file_format: a format of the exported data
+        :return: the encoded chunk
+        """
+        if file_format == FileFormat.ndjson:
+            return ''.join(
+                json.dumps(dict(booking), default=str) + '\n'
+                for booking in bookings).encode()
+
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(
+            [booking[column] for column in EXPORT_COLUMNS]
+            for booking in bookings)
+        return buffer.getvalue().encode()
+
+    async def export_bookings(
+            self, db: AsyncSession, file_format: FileFormat = FileFormat.csv,
+            time_from: time | None = None, time_to: time | None = None,
+            compress: bool = False
+    ) -> AsyncIterator[bytes]:
+        """This method serves to export booked tables with their clients
+        chunk by chunk so the memory usage doesn't depend on the amount of
+        bookings
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param file_format: a format of the exported data
+        :param time_from: the earliest booking time to export
+        :param time_to: the latest booking time to export
+        :param compress: a boolean indicating whether to compress the data
+        by gzip
+        :return: an asynchronous iterator of encoded chunks
+        """
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        if file_format == FileFormat.csv:
+            header = self._encode_bookings(
+                [dict(zip(EXPORT_COLUMNS, EXPORT_COLUMNS))], file_format)
+        else:
+            header = b''
+
+        async def encoded_chunks() -> AsyncIterator[bytes]:
+            yield header
+            async for bookings in self.dao.stream_bookings(
+                    db, time_from, time_to):
+                yield self._encode_bookings(bookings, file_format)
+
+        async for chunk in encoded_chunks():
+            if compressor:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        if compressor:
+            yield compressor.flush()
@@ -9,12 +9,14 @@ from dao.models import User
 from services import schemas
 from dao.user_dao import UserDao
 from services.schemas import Token
-from utils import create_token, decode_token, get_db
+from tracing import trace_methods, span
+from utils import create_token, decode_token, get_db, TokenCache
 # -------------------------------------------------------------------------
 
 oauth_schema: OAuth2PasswordBearer = OAuth2PasswordBearer(tokenUrl=TOKEN_URL)
 
 
+@trace_methods('service')
 class UserService:
     """The UserService class providing all the functionality needed to work
     with the user spreadsheet"""
@@ -25,6 +27,7 @@ class UserService:
         self.dao = dao
         self.register_schema = schemas.UserRegisterSchema
         self.user_schema = schemas.UserSchema
+        self.token_cache = TokenCache()
 
     async def register(
             self, db: AsyncSession, user_data: schemas.UserRegisterSchema
@@ -45,16 +48,17 @@ class UserService:
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='The email is already registered')
 
-        user_data.password = bcrypt.hashpw(
-            user_data.password.encode(), bcrypt.gensalt()).decode()
+        with span('bcrypt.hashpw'):
+            user_data.password = bcrypt.hashpw(
+                user_data.password.encode(), bcrypt.gensalt()).decode()
 
         new_user = await self.dao.add_new(db, user_data)
         if not new_user:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='Failed to create new user')
-        user.is_active = True
-        await self.dao.update(db, user)
+        new_user.is_active = True
+        await self.dao.update(db, new_user)
 
         return create_token(new_user.email)
 
@@ -76,8 +80,10 @@ class UserService:
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail='User not found')
 
-        elif not bcrypt.checkpw(
-                user_data.password.encode(), user.password.encode()):
+        with span('bcrypt.checkpw'):
+            is_correct = bcrypt.checkpw(
+                user_data.password.encode(), user.password.encode())
+        if not is_correct:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='The password is incorrect')
@@ -100,20 +106,24 @@ class UserService:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail='Failed to logout')
+        self.token_cache.invalidate(user.email)
 
-    async def get_by_token(
-            self, db: AsyncSession = Depends(get_db),
-            token: str = Depends(oauth_schema)
-    ) -> User:
-        """This method serves to get user by provided token
-        :param db: an instance of the AsyncSession provides a connection
-        to the database
+    def get_email(self, token: str) -> str:
+        """This method returns the email from the token. The token is
+        decoded and validated only if it is not in the token cache. The cache
+        doesn't replace the check of the user activity, so tokens of a user
+        logged out by another worker process are rejected as well
         :param token: a string representing the token
-        :return: a User model
+        :return: the email address of the user
         """
+        email = self.token_cache.get(token)
+        if email is not None:
+            return email
+
         user_data = decode_token(token)
         try:
-            token_schema = Token(**user_data)
+            with span('Token.validate'):
+                token_schema = Token(**user_data)
 
         except Exception as e:
             raise HTTPException(
@@ -121,7 +131,23 @@ class UserService:
                 detail=f'There was an error while retrieving user data: {e}'
             )
 
-        user = await self.dao.get_by_email(db, token_schema.email)
+        if 'exp' in user_data:
+            self.token_cache.add(token, token_schema.email, user_data['exp'])
+
+        return token_schema.email
+
+    async def get_by_token(
+            self, db: AsyncSession = Depends(get_db),
+            token: str = Depends(oauth_schema)
+    ) -> User:
+        """This method serves to get user by provided token
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param token: a string representing the token
+        :return: a User model
+        """
+        email = self.get_email(token)
+        user = await self.dao.get_by_email(db, email)
 
         if not user:
             raise HTTPException(
@@ -135,3 +161,24 @@ class UserService:
             )
 
         return user
+
+    async def get_admin_by_token(
+            self, db: AsyncSession = Depends(get_db),
+            token: str = Depends(oauth_schema)
+    ) -> User:
+        """This method serves to get user by provided token and check whether
+        the user is allowed to use administrative routes
+        :param db: an instance of the AsyncSession provides a connection
+        to the database
+        :param token: a string representing the token
+        :return: a User model
+        """
+        user = await self.get_by_token(db, token)
+
+        if not user.is_admin:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail='You have not credentials to access this route'
+            )
+
+        return user
@@ -0,0 +1,163 @@
+"""This file contains the lifespan of the application which recovers the
+memory storage or creates the database pools and reports the time spent on
+every startup phase. The import phase is counted from the start of the
+process estimated by the CPU time spent so far, mostly by imports, so it
+doesn't depend on the place where main.py imports the module. The module
+imports only the standard library at the top"""
+import time as timer
+from asyncio import gather, sleep, create_task, CancelledError
+from contextlib import asynccontextmanager, contextmanager, suppress
+from typing import Any, AsyncIterator, Iterator
+# --------------------------------------------------------------------------
+
+IMPORT_STARTED = timer.perf_counter() - timer.process_time()
+
+
+class StartupReport:
+    """The StartupReport class serves to collect durations of startup
+    phases"""
+    def __init__(self, started: float) -> None:
+        """Initialize the StartupReport class
+        :param started: the perf_counter value when the startup began
+        """
+        self.started = started
+        self.phases: dict[str, float] = {}
+
+    def record(self, name: str, started: float) -> None:
+        """This method records the duration of the phase finished just now
+        :param name: the name of the phase
+        :param started: the perf_counter value when the phase began
+        """
+        self.phases[name] = round((timer.perf_counter() - started) * 1000, 3)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """This method measures the phase running inside the with block
+        :param name: the name of the phase
+        """
+        started = timer.perf_counter()
+        yield
+        self.record(name, started)
+
+    def print(self, budget: int) -> None:
+        """This method prints the durations and warns if the total time
+        exceeds the budget
+        :param budget: the allowed startup time in milliseconds
+        """
+        total = round((timer.perf_counter() - self.started) * 1000, 3)
+        for name, duration in self.phases.items():
+            print(f'Startup phase {name}: {duration} ms')
+        print(f'Startup total: {total} ms')
+        if budget and total > budget:
+            print(f'Startup time exceeds the budget of {budget} ms')
+
+
+async def prewarm(engine: Any, connections: int) -> None:
+    """This function opens connections concurrently and returns them to the
+    pool, so the first requests don't wait for connecting and the dialect
+    initialization
+    :param engine: an instance of AsyncEngine to prewarm the pool of
+    :param connections: an amount of connections, connections over the pool
+    size are not kept by the pool and therefore are not opened
+    """
+    count = min(connections, engine.pool.size())
+    opened = await gather(*(engine.connect() for _ in range(count)))
+    await gather(*(connection.close() for connection in opened))
+
+
+async def refresh_snapshot(table_service: Any, interval: float) -> None:
+    """This function tries to become the writer of the shared snapshot and
+    refreshes it while the process is the writer. It runs in every process
+    so another process takes over when the writer exits
+    :param table_service: the TableService with the shared snapshot
+    :param interval: a delay between refreshes in seconds
+    """
+    from dao import get_session_maker
+
+    while True:
+        try:
+            if table_service.snapshot.acquire_writer():
+                async with get_session_maker()() as db:
+                    await table_service.refresh_snapshot(db)
+        except Exception as e:
+            print(f'Cannot refresh the shared snapshot, error: {e}')
+        await sleep(interval)
+
+
+async def release_expired(
+        table_service: Any, interval: float, storage: Any = None
+) -> None:
+    """This function releases expired bookings periodically. It runs in
+    every process, so requests answer from the availability version and
+    never update tables to release bookings. The memory backend doesn't use
+    sessions, so no database engine is created for it
+    :param table_service: the TableService to release bookings by
+    :param interval: a delay between releases in seconds
+    :param storage: the MemoryStorage of the memory backend or None
+    """
+    from dao import get_session_maker
+
+    while True:
+        try:
+            if storage:
+                await table_service.release_expired(None)
+            else:
+                async with get_session_maker()() as db:
+                    await table_service.release_expired(db)
+        except Exception as e:
+            print(f'Cannot release expired bookings, error: {e}')
+        await sleep(interval)
+
+
+@asynccontextmanager
+async def lifespan(app: Any) -> AsyncIterator[None]:
+    """This function prepares the storage before the application starts
+    serving requests and releases it when the application stops
+    :param app: the FastAPI application
+    """
+    from admission import admission, get_pool_capacity
+    from constants import (
+        DB_PREWARM_CONNECTIONS, STARTUP_BUDGET_MS, SHARED_SNAPSHOT_INTERVAL,
+        ADMISSION_CONTROL, EXPIRY_INTERVAL)
+    from container import storage, snapshot, table_service
+    from dao import get_engine, get_replica_engine
+    from tracing import exporter
+
+    report = StartupReport(IMPORT_STARTED)
+    report.record('import', IMPORT_STARTED)
+    if storage:
+        with report.phase('storage'):
+            storage.lock()
+            storage.recover()
+    else:
+        with report.phase('database'):
+            engines = {get_engine(), get_replica_engine()}
+            if DB_PREWARM_CONNECTIONS:
+                await gather(*(
+                    prewarm(engine, DB_PREWARM_CONNECTIONS)
+                    for engine in engines))
+            if ADMISSION_CONTROL and not admission.capacity:
+                admission.capacity = get_pool_capacity(get_engine())
+    tasks = [create_task(
+        release_expired(table_service, EXPIRY_INTERVAL, storage))]
+    if snapshot:
+        with report.phase('snapshot'):
+            snapshot.open()
+            tasks.append(create_task(
+                refresh_snapshot(table_service, SHARED_SNAPSHOT_INTERVAL)))
+    app.state.startup = report.phases
+    report.print(STARTUP_BUDGET_MS)
+
+    yield
+
+    exporter.flush()
+    for task in tasks:
+        task.cancel()
+        with suppress(CancelledError):
+            await task
+    if snapshot:
+        snapshot.close()
+    if storage:
+        storage.close()
+    else:
+        await gather(*(engine.dispose() for engine in engines))
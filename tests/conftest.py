@@ -0,0 +1,187 @@
+"""This file contains fixtures running every test with the SQL and the memory
+storage backends. The SQL tests use a separate database named after the
+configured one with the _test suffix, it is created if it doesn't exist and
+its spreadsheets are recreated for every test. The SQL tests are skipped if
+the database server is not available"""
+from contextlib import asynccontextmanager, nullcontext
+from datetime import time
+from typing import Any, AsyncContextManager, AsyncIterator, Callable
+import pytest
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from constants import DB_URI
+from dao import Base
+from dao.memory_dao import MemoryTableDao, MemoryUserDao, MemoryAnalyticsDao
+from dao.memory_storage import MemoryStorage
+from dao.analytics_dao import AnalyticsDao
+from dao.table_dao import TableDao
+from dao.user_dao import UserDao
+from services.analytics_service import AnalyticsService
+from services.schemas import (
+    FileFormat, TableBookSchema, UserRegisterSchema)
+from services.table_service import TableService
+# --------------------------------------------------------------------------
+
+TEST_DB_URI = make_url(DB_URI).set(
+    database=f'{make_url(DB_URI).database}_test')
+
+TABLES = b'id,max_persons\n1,2\n2,4\n3,6\n'
+
+database_available: bool | None = None
+
+
+class Backend:
+    """The Backend class keeps the services of one storage backend and opens
+    a new session for every imitated request like the application does"""
+    def __init__(
+            self, name: str, table_service: TableService, user_dao: UserDao,
+            session: Callable[[], AsyncContextManager[Any]],
+            storage: MemoryStorage | None = None
+    ) -> None:
+        """Initialize the Backend class
+        :param name: the name of the backend
+        :param table_service: a TableService working with the backend
+        :param user_dao: a UserDao working with the backend
+        :param session: a function returning an asynchronous context manager
+        with a session
+        :param storage: the MemoryStorage of the memory backend or None
+        """
+        self.name = name
+        self.table_service = table_service
+        self.analytics_service = table_service.analytics
+        self.user_dao = user_dao
+        self.session = session
+        self.storage = storage
+
+    async def add_user(self, email: str) -> Any:
+        """This method registers a user
+        :param email: the email address of the user
+        :return: the User model or the UserRecord
+        """
+        async with self.session() as db:
+            return await self.user_dao.add_new(db, UserRegisterSchema(
+                email=email, password='password', password_repeat='password',
+                name=email.split('@')[0], phone='+70000000000'))
+
+    async def get_user(self, email: str) -> Any:
+        """This method reads a user by a new session
+        :param email: the email address of the user
+        :return: the User model or the UserRecord
+        """
+        async with self.session() as db:
+            return await self.user_dao.get_by_email(db, email)
+
+    async def import_tables(self, data: bytes) -> Any:
+        """This method imports tables from CSV data
+        :param data: the CSV data with a header
+        :return: an ImportReportSchema
+        """
+        async with self.session() as db:
+            return await self.table_service.import_tables(
+                db, iter_chunks(data), FileFormat.csv)
+
+    async def book(
+            self, table_id: int, user: Any, booking_time: time = time(18),
+            persons: int = 2
+    ) -> Any:
+        """This method books the table for the user skipping the validation
+        of the booking time against the current time
+        :param table_id: the id of the table to book
+        :param user: the client of the booking
+        :param booking_time: the booking time
+        :param persons: the amount of persons
+        :return: the booked row
+        """
+        async with self.session() as db:
+            return await self.table_service.book_new(
+                db, TableBookSchema.construct(
+                    id=table_id, client_id=user.id,
+                    booking_time=booking_time, persons=persons,
+                    is_booked=False, max_persons=None))
+
+
+async def iter_chunks(data: bytes, size: int = 5) -> AsyncIterator[bytes]:
+    """This function splits the data into small chunks like a request body
+    :param data: the data to split
+    :param size: the size of a chunk
+    :return: an asynchronous iterator of chunks
+    """
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def create_test_database() -> bool:
+    """This function creates the test database if it doesn't exist
+    :return: a boolean indicating whether the database server is available
+    """
+    engine = create_async_engine(DB_URI, isolation_level='AUTOCOMMIT')
+    try:
+        async with engine.connect() as connection:
+            exists = await connection.scalar(text(
+                'SELECT 1 FROM pg_database WHERE datname = :name'),
+                {'name': TEST_DB_URI.database})
+            if not exists:
+                await connection.execute(text(
+                    f'CREATE DATABASE "{TEST_DB_URI.database}"'))
+        return True
+    except Exception as e:
+        print(f'The database server is not available: {e}')
+        return False
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    """This fixture runs asynchronous tests by asyncio"""
+    return 'asyncio'
+
+
+@pytest.fixture(autouse=True)
+def fixed_time(monkeypatch: pytest.MonkeyPatch) -> None:
+    """This fixture makes deadlines and expiry independent of the current
+    time: every booking can be changed and nothing expires unless a test
+    patches these methods again"""
+    monkeypatch.setattr(
+        TableService, '_get_deadline', staticmethod(lambda: time(0)))
+    monkeypatch.setattr(
+        TableDao, '_get_expiry_cutoff', staticmethod(lambda: time(0)))
+
+
+@pytest.fixture(params=['sql', 'memory'])
+async def backend(
+        request: pytest.FixtureRequest, tmp_path: Any
+) -> AsyncIterator[Backend]:
+    """This fixture returns a Backend with empty storage"""
+    if request.param == 'memory':
+        storage = MemoryStorage(str(tmp_path))
+        storage.recover()
+        yield Backend(
+            'memory', TableService(
+                MemoryTableDao(storage),
+                AnalyticsService(MemoryAnalyticsDao(storage))),
+            MemoryUserDao(storage), nullcontext, storage)
+        storage.close()
+        return
+
+    global database_available
+    if database_available is None:
+        database_available = await create_test_database()
+    if not database_available:
+        pytest.skip('The database server is not available')
+
+    engine = create_async_engine(TEST_DB_URI)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+
+    @asynccontextmanager
+    async def session() -> AsyncIterator[AsyncSession]:
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            yield db
+
+    yield Backend(
+        'sql', TableService(TableDao(), AnalyticsService(AnalyticsDao())),
+        UserDao(), session)
+    await engine.dispose()
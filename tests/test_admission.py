@@ -0,0 +1,87 @@
+"""This file contains tests of the admission control"""
+from asyncio import create_task, sleep
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+import admission as admission_module
+from admission import AdmissionController, AdmittedSession, get_priority
+from tests.conftest import TEST_DB_URI, create_test_database
+# --------------------------------------------------------------------------
+
+pytestmark = pytest.mark.anyio
+
+WRITE = get_priority('POST')
+READ = get_priority('GET')
+
+
+async def test_priority_ordering() -> None:
+    controller = AdmissionController(capacity=1, max_delay_ms=1000)
+    assert await controller.acquire(READ)
+    admitted = []
+
+    async def acquire(priority: int) -> None:
+        assert await controller.acquire(priority)
+        admitted.append(priority)
+
+    waiting = [create_task(acquire(READ)), create_task(acquire(WRITE))]
+    await sleep(0.01)
+    assert controller.queue_depth == 2
+
+    controller.release()
+    await sleep(0.01)
+    assert admitted == [WRITE]
+    controller.release()
+    await sleep(0.01)
+    assert admitted == [WRITE, READ]
+    for task in waiting:
+        await task
+    controller.release()
+    assert controller.in_flight == 0
+    assert controller.stats()['admitted'] == {'write': 1, 'read': 2}
+
+
+async def test_load_shedding() -> None:
+    controller = AdmissionController(capacity=1, max_delay_ms=20)
+    assert await controller.acquire(WRITE)
+    assert not await controller.acquire(READ)
+
+    waiting = create_task(controller.acquire(READ))
+    await sleep(0.05)
+    assert not await controller.acquire(WRITE)
+    assert not await waiting
+    assert controller.stats()['shed'] == {'write': 1, 'read': 2}
+    assert controller.in_flight == 1
+
+
+async def test_take_slot(monkeypatch: pytest.MonkeyPatch) -> None:
+    controller = AdmissionController(capacity=1, max_delay_ms=10)
+    monkeypatch.setattr(admission_module, 'admission', controller)
+    assert not await admission_module.take_slot(READ)
+
+    monkeypatch.setattr(admission_module, 'ADMISSION_CONTROL', True)
+    assert await admission_module.take_slot(READ)
+    with pytest.raises(HTTPException) as error:
+        await admission_module.take_slot(READ)
+    assert error.value.status_code == 503
+    assert error.value.headers['Retry-After'] == str(
+        admission_module.ADMISSION_RETRY_AFTER)
+
+
+async def test_admitted_session(monkeypatch: pytest.MonkeyPatch) -> None:
+    if not await create_test_database():
+        pytest.skip('The database server is not available')
+    controller = AdmissionController(capacity=1)
+    monkeypatch.setattr(admission_module, 'admission', controller)
+    monkeypatch.setattr(admission_module, 'ADMISSION_CONTROL', True)
+
+    engine = create_async_engine(TEST_DB_URI)
+    async with AsyncSession(
+            engine, sync_session_class=AdmittedSession,
+            info={'admission_priority': READ}) as db:
+        assert controller.in_flight == 0
+        assert await db.scalar(text('SELECT 1')) == 1
+        assert await db.scalar(text('SELECT 2')) == 2
+        assert controller.in_flight == 1
+        assert db.info['admitted']
+    await engine.dispose()
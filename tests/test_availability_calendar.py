@@ -0,0 +1,57 @@
+"""This file contains tests of the AvailabilityCalendar"""
+from datetime import datetime, time
+from services.availability_calendar import AvailabilityCalendar
+from tests.test_shared_snapshot import make_record
+# --------------------------------------------------------------------------
+
+NOW = datetime(2024, 1, 1, 11)
+
+
+def get_today(calendar: AvailabilityCalendar, persons: int) -> list[time]:
+    """This function returns free slots of the first day"""
+    return calendar.get_free(persons, 1, NOW)[0][1]
+
+
+def test_counts() -> None:
+    calendar = AvailabilityCalendar(2, time(12), time(14), 60)
+    calendar.build(1, [
+        make_record(1), make_record(2), make_record(3, max_persons=4)])
+    assert get_today(calendar, 2) == [time(12), time(13), time(14)]
+
+    booking = {'is_booked': True, 'persons': 2, 'booking_time': time(12)}
+    calendar.apply(2, make_record(1, 1, **booking))
+    calendar.apply(3, make_record(3, 1, max_persons=4, **booking))
+    assert calendar.version == 3
+    assert get_today(calendar, 2) == [time(12), time(13), time(14)]
+    assert get_today(calendar, 3) == [time(14)]
+
+    calendar.apply(4, make_record(2, 1, **booking))
+    assert get_today(calendar, 1) == [time(14)]
+    assert calendar.get_free(1, 2, NOW)[1][1] == [
+        time(12), time(13), time(14)]
+
+    calendar.apply(5, make_record(1, 2))
+    assert get_today(calendar, 1) == [time(12), time(13), time(14)]
+    assert get_today(calendar, 3) == [time(14)]
+    assert calendar.counters[2] == [0b011, calendar.full_mask & ~0b011]
+
+
+def test_versions() -> None:
+    calendar = AvailabilityCalendar(1, time(12), time(14), 60)
+    calendar.apply(1, make_record(1))
+    assert calendar.version is None and not calendar.tables
+
+    calendar.build(5, [make_record(1), make_record(2)])
+    booked = make_record(1, 1, is_booked=True, booking_time=time(12))
+    calendar.apply(7, booked)
+    assert calendar.version == 5
+    assert get_today(calendar, 1) == [time(12), time(13), time(14)]
+
+    calendar.apply(6, make_record(2, 0, max_persons=4))
+    assert calendar.version == 6
+    assert calendar.tables[2][0] == 2
+
+    calendar.build(8, [booked, make_record(
+        3, 1, is_booked=True, booking_time=time(13))])
+    assert calendar.version == 8 and set(calendar.tables) == {1, 3}
+    assert get_today(calendar, 1) == [time(14)]
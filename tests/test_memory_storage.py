@@ -0,0 +1,133 @@
+"""This file contains tests of the MemoryStorage and its write-ahead log"""
+import json
+import os
+from asyncio import Event, gather
+from datetime import time
+import pytest
+from dao import memory_storage
+from dao.memory_dao import MemoryTableDao
+from dao.memory_storage import MemoryStorage, StorageLockedError, TableRecord
+from dao.table_dao import TableDao
+# --------------------------------------------------------------------------
+
+pytestmark = pytest.mark.anyio
+
+
+def test_recover(tmp_path: str) -> None:
+    storage = MemoryStorage(str(tmp_path))
+    storage.recover()
+    storage.save('table', [TableRecord(id=1, max_persons=2)])
+    with storage.transaction():
+        storage.save('table', [TableRecord(id=2, max_persons=4)])
+        storage.save('table', [TableRecord(id=3, max_persons=6)])
+    with pytest.raises(RuntimeError):
+        with storage.transaction():
+            storage.save('table', [TableRecord(id=4, max_persons=8)])
+            raise RuntimeError
+    assert sorted(storage.tables) == [1, 2, 3]
+
+    recovered = MemoryStorage(str(tmp_path))
+    recovered.recover()
+    assert sorted(recovered.tables) == [1, 2, 3]
+    assert recovered.tables[3].max_persons == 6
+    assert recovered.vacant == {1, 2, 3}
+
+
+async def test_failed_release_keeps_expired(
+        tmp_path: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    storage = MemoryStorage(str(tmp_path))
+    storage.recover()
+    storage.save('table', [TableRecord(
+        id=1, max_persons=2, booking_time=time(13), persons=2,
+        is_booked=True, client_id=1)])
+    dao = MemoryTableDao(storage)
+    monkeypatch.setattr(
+        TableDao, '_get_expiry_cutoff', staticmethod(lambda: time(15)))
+
+    def fail(*args: object, **kwargs: object) -> None:
+        raise OSError('disk is full')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(storage, '_write', fail)
+        assert await dao.update_availability(None) == []
+    assert storage.tables[1].is_booked
+
+    released = await dao.update_availability(None)
+    assert [(table.id, table.is_booked) for table in released] == [
+        (1, False)]
+    assert not storage.tables[1].is_booked
+    assert await dao.update_availability(None) == []
+    assert storage.booking_times == []
+    storage.close()
+
+
+def test_lock(tmp_path: str) -> None:
+    storage = MemoryStorage(str(tmp_path))
+    storage.lock()
+    storage.recover()
+    storage.save('table', [TableRecord(id=1, max_persons=2)])
+
+    other = MemoryStorage(str(tmp_path))
+    with pytest.raises(StorageLockedError):
+        other.lock()
+    storage.close()
+
+    other.lock()
+    other.recover()
+    assert sorted(other.tables) == [1]
+    other.close()
+
+
+async def test_concurrent_transactions(tmp_path: str) -> None:
+    storage = MemoryStorage(str(tmp_path))
+    storage.recover()
+    first_started = Event()
+    second_saved = Event()
+
+    async def first() -> None:
+        with storage.transaction():
+            storage.save('table', [TableRecord(id=1, max_persons=2)])
+            first_started.set()
+            await second_saved.wait()
+            storage.save('table', [TableRecord(id=2, max_persons=4)])
+
+    async def second() -> None:
+        await first_started.wait()
+        with storage.transaction():
+            storage.save('table', [TableRecord(id=3, max_persons=6)])
+        second_saved.set()
+
+    await gather(first(), second())
+    assert sorted(storage.tables) == [1, 2, 3]
+    with open(storage.wal_path, encoding='utf-8') as f:
+        batches = [json.loads(line)['entries'] for line in f]
+    assert [[entry['data']['id'] for entry in entries]
+            for entries in batches] == [[3], [1, 2]]
+    storage.close()
+
+
+def test_background_snapshot(
+        tmp_path: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(memory_storage, 'MEMORY_SNAPSHOT_RECORDS', 2)
+    storage = MemoryStorage(str(tmp_path))
+    storage.recover()
+    storage.save('table', [TableRecord(id=1, max_persons=2)])
+    storage.save('table', [TableRecord(id=2, max_persons=4)])
+    storage.save('table', [TableRecord(id=3, max_persons=6)])
+    storage._wait_snapshot()
+    assert not os.path.exists(storage.old_wal_path)
+    assert storage.wal_records == 1
+
+    # a crash before the snapshot is written keeps the moved log
+    monkeypatch.setattr(
+        storage, '_write_snapshot', lambda records: None)
+    storage.save('table', [TableRecord(id=4, max_persons=8)])
+    storage._wait_snapshot()
+    storage.save('table', [TableRecord(id=5, max_persons=2)])
+    assert os.path.exists(storage.old_wal_path)
+
+    recovered = MemoryStorage(str(tmp_path))
+    recovered.recover()
+    assert sorted(recovered.tables) == [1, 2, 3, 4, 5]
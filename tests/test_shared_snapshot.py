@@ -0,0 +1,98 @@
+"""This file contains tests of the SharedSnapshot and of the TableService
+reading the snapshot"""
+from datetime import time
+from typing import Iterator
+import pytest
+from fastapi import HTTPException
+from dao.shared_snapshot import SharedSnapshot, SnapshotRecord
+from services.table_service import TableService
+from tests.conftest import Backend, TABLES
+# --------------------------------------------------------------------------
+
+
+@pytest.fixture
+def snapshot(tmp_path: str) -> Iterator[SharedSnapshot]:
+    """This fixture returns an opened snapshot of the writer process"""
+    snapshot = SharedSnapshot(f'{tmp_path}/snapshot', capacity=10)
+    snapshot.open()
+    assert snapshot.acquire_writer()
+    yield snapshot
+    snapshot.close()
+
+
+def make_record(table_id: int, version: int = 0, **values: object
+                ) -> SnapshotRecord:
+    """This function makes a vacant table with the provided changes"""
+    fields = {
+        'max_persons': 2, 'persons': 0, 'is_booked': False,
+        'booking_time': None} | values
+    return SnapshotRecord(id=table_id, version=version, **fields)
+
+
+def test_read(snapshot: SharedSnapshot) -> None:
+    assert snapshot.get_vacant() is None
+    snapshot.write(7, [
+        make_record(1), make_record(2, 3, is_booked=True, persons=2,
+                                    booking_time=time(18, 30)),
+        make_record(4, max_persons=2 ** 31 - 1)])
+
+    assert snapshot.get_version() == 7
+    version, vacant = snapshot.get_vacant()
+    assert version == 7
+    assert [(table.id, table.max_persons) for table in vacant] == [
+        (1, 2), (4, 2 ** 31 - 1)]
+    assert snapshot.get(2) == (7, make_record(
+        2, 3, is_booked=True, persons=2, booking_time=time(18, 30)))
+    assert snapshot.get(3) == (7, None)
+    assert not snapshot.write(8, [make_record(i) for i in range(11)])
+    assert snapshot.get_version() is None
+
+
+def test_apply(snapshot: SharedSnapshot) -> None:
+    snapshot.write(7, [make_record(1), make_record(2)])
+    snapshot.apply(8, make_record(1, 1, is_booked=True))
+    assert snapshot.get(1) == (8, make_record(1, 1, is_booked=True))
+
+    snapshot.apply(10, make_record(2, 1, is_booked=True))
+    assert snapshot.get(2) == (8, make_record(2, 1, is_booked=True))
+
+    snapshot.apply(9, make_record(2, 0))
+    assert snapshot.get(2) == (9, make_record(2, 1, is_booked=True))
+    snapshot.apply(None, make_record(3, 1))
+    assert [table.id for table in snapshot.get_all()[1]] == [1, 2]
+
+
+@pytest.mark.anyio
+async def test_service(backend: Backend, snapshot: SharedSnapshot) -> None:
+    if backend.name != 'sql':
+        pytest.skip('The shared snapshot is used only by the SQL backend')
+    table_service = TableService(
+        backend.table_service.dao, backend.analytics_service, snapshot)
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    async with backend.session() as db:
+        await table_service.refresh_snapshot(db)
+
+    backend.table_service = table_service
+    booked = await backend.book(1, user)
+    async with backend.session() as db:
+        version = await table_service.dao.get_version(db)
+        assert await table_service.get_vacant(db) == (version, [
+            make_record(2, max_persons=4), make_record(3, max_persons=6)])
+    assert snapshot.get(1)[1].is_booked
+
+    async with backend.session() as db:
+        await table_service.cancel_booking(
+            db, booked.id, user.id, booked.version)
+    assert snapshot.get(1) == (version + 1, make_record(
+        1, 2, persons=2, booking_time=time(18)))
+
+    snapshot.write(version, [
+        make_record(1), make_record(2, 1, is_booked=True),
+        make_record(3, 1, is_booked=True)])
+    # tables shown as booked by the snapshot are booked by the database
+    assert (await backend.book(2, user)).is_booked
+    assert (await backend.book(3, user)).is_booked
+    with pytest.raises(HTTPException) as error:
+        await backend.book(3, user)
+    assert error.value.status_code == 400
@@ -0,0 +1,327 @@
+"""This file contains tests of the TableService working with both storage
+backends"""
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, time
+from typing import Any
+import pytest
+from fastapi import HTTPException
+from constants import TZ
+from dao.table_dao import TableDao
+from services.schemas import (
+    FileFormat, TableBookSchema, TableBookChangeSchema)
+from services.table_service import TableService
+from tests.conftest import Backend, TABLES
+# --------------------------------------------------------------------------
+
+pytestmark = pytest.mark.anyio
+
+
+def change(table_id: int, **values: Any) -> TableBookChangeSchema:
+    """This function makes a change of the booking like the view does"""
+    table = TableBookChangeSchema(**values)
+    table.id = table_id
+    return table
+
+
+async def get_occupancy(backend: Backend) -> dict[int, dict[str, int]]:
+    """This function returns non-zero occupancy counters by hour"""
+    async with backend.session() as db:
+        occupancy = await backend.analytics_service.get_occupancy(db)
+    return {
+        row.hour: {
+            counter: getattr(row, counter) for counter in (
+                'booked', 'covers', 'bookings', 'cancellations',
+                'expirations') if getattr(row, counter)}
+        for row in occupancy}
+
+
+async def test_import_tables(backend: Backend) -> None:
+    report = await backend.import_tables(
+        b'id,max_persons,note\n1,2,"first\n\nline"\n2,x,\n\n3,6,\n1,3,last\n')
+    assert (report.processed, report.failed) == (4, 1)
+    assert (report.inserted, report.updated) == (2, 0)
+    assert report.errors[0].line == 5
+
+    report = await backend.import_tables(b'id,max_persons\n3,8\n4,"2\n')
+    assert (report.inserted, report.updated, report.failed) == (0, 1, 1)
+
+    async with backend.session() as db:
+        tables = await backend.table_service.get_all(db)
+    assert [(table.id, table.max_persons) for table in tables] == [
+        (1, 3), (3, 8)]
+
+
+async def test_book(backend: Backend) -> None:
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    async with backend.session() as db:
+        version = await backend.table_service.get_version(db)
+
+    booked = await backend.book(2, user, persons=3)
+    assert booked.is_booked and booked.client_id == user.id
+    assert (booked.persons, booked.max_persons) == (3, 4)
+    assert booked.version == 1
+
+    async with backend.session() as db:
+        assert await backend.table_service.get_version(db) > version
+        tables = await backend.table_service.get_all(db)
+        client_tables = await backend.table_service.get_by_client(
+            db, user.email)
+    assert [table.id for table in tables] == [1, 3]
+    assert [table.id for table in client_tables] == [2]
+
+    with pytest.raises(HTTPException) as error:
+        await backend.book(2, user)
+    assert error.value.status_code == 400
+    with pytest.raises(HTTPException) as error:
+        await backend.book(1, user, persons=3)
+    assert error.value.status_code == 400
+    with pytest.raises(HTTPException) as error:
+        await backend.book(10, user)
+    assert error.value.status_code == 400
+
+
+async def test_book_race(backend: Backend) -> None:
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    other = await backend.add_user('other@example.com')
+
+    # both requests passed their checks, only the first update books
+    for client, expected in ((user, True), (other, False)):
+        async with backend.session() as db:
+            booked = await backend.table_service.dao.book_one(
+                db, TableBookSchema.construct(
+                    id=2, client_id=client.id, booking_time=time(18),
+                    persons=2, is_booked=True, max_persons=None),
+                backend.analytics_service.record_booking)
+        assert bool(booked) == expected
+
+    with pytest.raises(HTTPException) as error:
+        await backend.book(2, other)
+    assert error.value.status_code == 400
+    async with backend.session() as db:
+        table = await backend.table_service.dao.get_by_id(db, 2)
+    assert (table.client_id, table.version) == (user.id, 1)
+    assert await get_occupancy(backend) == {
+        18: {'booked': 1, 'covers': 2, 'bookings': 1}}
+
+
+async def test_client_version(backend: Backend) -> None:
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    other = await backend.add_user('other@example.com')
+
+    async def get_client_version(email: str) -> int:
+        async with backend.session() as db:
+            return await backend.table_service.get_client_version(
+                db, await backend.get_user(email))
+
+    version = await get_client_version(user.email)
+    other_version = await get_client_version(other.email)
+    booked = await backend.book(1, user)
+    assert await get_client_version(user.email) != version
+    assert await get_client_version(other.email) == other_version
+
+    version = await get_client_version(user.email)
+    async with backend.session() as db:
+        await backend.table_service.cancel_booking(
+            db, booked.id, user.id, booked.version)
+    assert await get_client_version(user.email) != version
+
+
+async def test_change_booking(backend: Backend) -> None:
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    other = await backend.add_user('other@example.com')
+    booked = await backend.book(3, user)
+
+    async with backend.session() as db:
+        changed = await backend.table_service.change_booking(
+            db, change(3, persons=5), user.id, booked.version)
+    assert (changed.persons, changed.booking_time) == (5, time(18))
+    assert changed.version == booked.version + 1
+
+    async with backend.session() as db:
+        with pytest.raises(HTTPException) as error:
+            await backend.table_service.change_booking(
+                db, change(3, persons=4), user.id, booked.version)
+    assert error.value.status_code == 409
+    assert error.value.headers['ETag'] == f'"{changed.version}"'
+    assert error.value.detail['table']['persons'] == 5
+
+    async with backend.session() as db:
+        with pytest.raises(HTTPException) as error:
+            await backend.table_service.change_booking(
+                db, change(3, persons=4), other.id)
+    assert error.value.status_code == 403
+
+    async with backend.session() as db:
+        changed = await backend.table_service.change_booking(
+            db, change(3, booking_time=time(20)), user.id)
+    assert (changed.persons, changed.booking_time) == (5, time(20))
+
+
+async def test_change_persons(backend: Backend) -> None:
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    booked = await backend.book(2, user)
+
+    async with backend.session() as db:
+        with pytest.raises(HTTPException) as error:
+            await backend.table_service.change_booking(
+                db, change(2, persons=5), user.id, booked.version)
+    assert error.value.status_code == 400
+    async with backend.session() as db:
+        table = await backend.table_service.dao.get_by_id(db, 2)
+    assert (table.persons, table.version) == (2, booked.version)
+
+    async with backend.session() as db:
+        changed = await backend.table_service.change_booking(
+            db, change(2, persons=4), user.id, booked.version)
+    assert changed.persons == 4
+
+
+async def test_deadline(
+        backend: Backend, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    booked = await backend.book(1, user)
+    monkeypatch.setattr(
+        TableService, '_get_deadline', staticmethod(lambda: time(19)))
+
+    async with backend.session() as db:
+        with pytest.raises(HTTPException) as error:
+            await backend.table_service.cancel_booking(
+                db, booked.id, user.id, booked.version)
+    assert error.value.status_code == 400
+
+
+async def test_cancel_booking(backend: Backend) -> None:
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    booked = await backend.book(1, user)
+
+    async with backend.session() as db:
+        with pytest.raises(HTTPException) as error:
+            await backend.table_service.cancel_booking(
+                db, booked.id, user.id, booked.version + 1)
+    assert error.value.status_code == 409
+
+    async with backend.session() as db:
+        cancelled = await backend.table_service.cancel_booking(
+            db, booked.id, user.id, booked.version)
+    assert not cancelled.is_booked
+    assert cancelled.version == booked.version + 1
+
+    async with backend.session() as db:
+        with pytest.raises(HTTPException) as error:
+            await backend.table_service.cancel_booking(
+                db, booked.id, user.id)
+        client_tables = await backend.table_service.get_by_client(
+            db, user.email)
+    assert error.value.status_code == 400
+    assert client_tables == []
+
+
+async def test_expiry(
+        backend: Backend, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    await backend.book(1, user, time(13), 2)
+    await backend.book(2, user, time(18), 3)
+    async with backend.session() as db:
+        version = await backend.table_service.get_version(db)
+        client_version = await backend.table_service.get_client_version(
+            db, await backend.get_user(user.email))
+
+    monkeypatch.setattr(
+        TableDao, '_get_expiry_cutoff', staticmethod(lambda: time(15)))
+    async with backend.session() as db:
+        assert await backend.table_service.get_version(db) == version
+        await backend.table_service.release_expired(db)
+    async with backend.session() as db:
+        assert await backend.table_service.get_version(db) > version
+        assert await backend.table_service.get_client_version(
+            db, await backend.get_user(user.email)) != client_version
+        expired = await backend.table_service.dao.get_by_id(db, 1)
+        client_tables = await backend.table_service.get_by_client(
+            db, user.email)
+    assert not expired.is_booked
+    assert [table.id for table in client_tables] == [2]
+
+    occupancy = await get_occupancy(backend)
+    assert occupancy[13] == {'bookings': 1, 'expirations': 1}
+    assert occupancy[18] == {'booked': 1, 'covers': 3, 'bookings': 1}
+
+
+async def test_analytics(backend: Backend) -> None:
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    booked = await backend.book(3, user, time(18), 3)
+    assert await get_occupancy(backend) == {
+        18: {'booked': 1, 'covers': 3, 'bookings': 1}}
+
+    async with backend.session() as db:
+        changed = await backend.table_service.change_booking(
+            db, change(3, booking_time=time(19), persons=4), user.id)
+    assert await get_occupancy(backend) == {
+        18: {'bookings': 1},
+        19: {'booked': 1, 'covers': 4}}
+
+    async with backend.session() as db:
+        await backend.table_service.cancel_booking(
+            db, booked.id, user.id, changed.version)
+    assert await get_occupancy(backend) == {
+        18: {'bookings': 1},
+        19: {'cancellations': 1}}
+
+
+@pytest.mark.parametrize('compress', [False, True])
+async def test_export(backend: Backend, compress: bool) -> None:
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    other = await backend.add_user('other@example.com')
+    await backend.book(3, user, time(20), 4)
+    await backend.book(1, other, time(14), 2)
+
+    async def export(file_format: FileFormat, **filters: time) -> str:
+        async with backend.session() as db:
+            data = b''.join([
+                chunk async for chunk in
+                backend.table_service.export_bookings(
+                    db, file_format, compress=compress, **filters)])
+        return (gzip.decompress(data) if compress else data).decode()
+
+    rows = list(csv.DictReader(io.StringIO(await export(FileFormat.csv))))
+    assert [(row['id'], row['client_email'], row['persons']) for row in rows
+            ] == [('1', other.email, '2'), ('3', user.email, '4')]
+
+    lines = (await export(
+        FileFormat.ndjson, time_from=time(15))).splitlines()
+    assert [json.loads(line)['id'] for line in lines] == [3]
+
+
+async def test_calendar(backend: Backend) -> None:
+    await backend.import_tables(TABLES)
+    user = await backend.add_user('client@example.com')
+    calendar = backend.table_service.calendar
+    async with backend.session() as db:
+        free_day = await backend.table_service.get_calendar(db, 1)
+    assert free_day.date == datetime.now(tz=TZ).date()
+    assert calendar.tables[1][1] == calendar.full_mask
+
+    booked = await backend.book(1, user)
+    async with backend.session() as db:
+        assert calendar.version == await backend.table_service.get_version(db)
+    assert calendar.tables[1][1] != calendar.full_mask
+
+    async with backend.session() as db:
+        await backend.table_service.cancel_booking(
+            db, booked.id, user.id, booked.version)
+        assert calendar.version == await backend.table_service.get_version(db)
+    assert calendar.tables[1][1] == calendar.full_mask
@@ -0,0 +1,85 @@
+"""This file contains tests of the tracing middleware and the exporter"""
+import json
+import os
+from typing import Any
+import pytest
+import tracing
+from tracing import TraceExporter, TracingMiddleware, span, traced
+# --------------------------------------------------------------------------
+
+pytestmark = pytest.mark.anyio
+
+
+async def trace_request(
+        monkeypatch: pytest.MonkeyPatch, exporter: TraceExporter
+) -> None:
+    """This function sends a sampled request through the middleware to an
+    application calling a traced coroutine with a nested span"""
+    monkeypatch.setattr(tracing, 'TRACE_SAMPLE_RATE', 1.0)
+    monkeypatch.setattr(tracing, 'exporter', exporter)
+
+    @traced('TableService.get_all', 'service')
+    async def get_all() -> None:
+        with span('SELECT', 'sql', **{'db.statement': 'SELECT 1'}):
+            pass
+
+    async def app(scope: dict, receive: Any, send: Any) -> None:
+        await get_all()
+        await send({'type': 'http.response.start', 'status': 200})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def send(message: dict) -> None:
+        pass
+
+    await TracingMiddleware(app)(
+        {'type': 'http', 'method': 'GET', 'path': '/table/vacant'},
+        None, send)
+
+
+async def test_chrome_export(
+        monkeypatch: pytest.MonkeyPatch, tmp_path: Any
+) -> None:
+    exporter = TraceExporter(str(tmp_path / 'traces.json'), 'chrome')
+    await trace_request(monkeypatch, exporter)
+    await trace_request(monkeypatch, exporter)
+    exporter.flush()
+
+    assert exporter.path == str(tmp_path / f'traces.{os.getpid()}.json')
+    with open(exporter.path, encoding='utf-8') as f:
+        text = f.read()
+    assert text.startswith('[\n')
+    events = json.loads(text.rstrip(',\n') + ']')
+    assert [e['name'] for e in events] == [
+        'SELECT', 'TableService.get_all', 'GET /table/vacant'] * 2
+    sql, service, root = events[:3]
+    assert {e['ph'] for e in events} == {'X'}
+    assert sql['cat'] == 'sql' and service['cat'] == 'service'
+    assert root['args']['http.status_code'] == 200
+    assert root['ts'] <= service['ts'] <= sql['ts']
+    assert sql['ts'] + sql['dur'] <= root['ts'] + root['dur']
+    assert len({e['tid'] for e in events[:3]}) == 1
+
+
+async def test_otlp_export(
+        monkeypatch: pytest.MonkeyPatch, tmp_path: Any
+) -> None:
+    exporter = TraceExporter(str(tmp_path / 'traces.json'), 'otlp')
+    await trace_request(monkeypatch, exporter)
+    exporter.flush()
+
+    with open(exporter.path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 1
+    resource_spans = json.loads(lines[0])['resourceSpans']
+    spans = {
+        s['name']: s for s in resource_spans[0]['scopeSpans'][0]['spans']}
+    sql = spans['SELECT']
+    service = spans['TableService.get_all']
+    root = spans['GET /table/vacant']
+    assert root['parentSpanId'] == '' and root['kind'] == 2
+    assert service['parentSpanId'] == root['spanId']
+    assert sql['parentSpanId'] == service['spanId'] and sql['kind'] == 3
+    assert {s['traceId'] for s in spans.values()} == {root['traceId']}
+    assert {s['status']['code'] for s in spans.values()} == {1}
+    assert {'key': 'db.statement', 'value': {'stringValue': 'SELECT 1'}} in (
+        sql['attributes'])
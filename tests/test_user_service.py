@@ -0,0 +1,85 @@
+"""This file contains tests of the UserService working with both storage
+backends"""
+import pytest
+from fastapi import HTTPException
+import services.user_service as user_service_module
+import utils
+from services.schemas import UserRegisterSchema
+from services.user_service import UserService
+from tests.conftest import Backend
+from utils import TokenCache
+# --------------------------------------------------------------------------
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_register(backend: Backend) -> None:
+    user_service = UserService(backend.user_dao)
+    user_data = UserRegisterSchema(
+        email='client@example.com', password='password',
+        password_repeat='password')
+
+    async with backend.session() as db:
+        token = await user_service.register(db, user_data.copy())
+    assert token['access_token']
+    user = await backend.get_user('client@example.com')
+    assert user.is_active
+    assert user.password != 'password'
+
+    async with backend.session() as db:
+        with pytest.raises(HTTPException) as error:
+            await user_service.register(db, user_data.copy())
+    assert error.value.status_code == 400
+
+
+async def test_cached_token(
+        backend: Backend, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    user_service = UserService(backend.user_dao)
+    async with backend.session() as db:
+        token = (await user_service.register(db, UserRegisterSchema(
+            email='client@example.com', password='password',
+            password_repeat='password')))['access_token']
+        assert (await user_service.get_by_token(db, token)).is_active
+
+    def fail(access_token: str) -> None:
+        raise AssertionError('The cached token is decoded')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(user_service_module, 'decode_token', fail)
+        assert user_service.get_email(token) == 'client@example.com'
+
+    async with backend.session() as db:
+        user = await user_service.get_by_token(db, token)
+        await user_service.logout(db, user)
+    assert user_service.token_cache.get(token) is None
+    async with backend.session() as db:
+        with pytest.raises(HTTPException) as error:
+            await user_service.get_by_token(db, token)
+    assert error.value.status_code == 401
+
+
+def test_token_cache_expiry(monkeypatch: pytest.MonkeyPatch) -> None:
+    token_cache = TokenCache(size=2)
+    monkeypatch.setattr(utils, 'time', lambda: 99.0)
+    token_cache.add('token', 'client@example.com', 100.0)
+    assert token_cache.get('token') == 'client@example.com'
+
+    monkeypatch.setattr(utils, 'time', lambda: 100.0)
+    assert token_cache.get('token') is None
+    assert not token_cache.emails and not token_cache.keys_by_email
+
+
+def test_token_cache_eviction(monkeypatch: pytest.MonkeyPatch) -> None:
+    token_cache = TokenCache(size=2)
+    monkeypatch.setattr(utils, 'time', lambda: 0.0)
+    token_cache.add('first', 'first@example.com', 100.0)
+    token_cache.add('second', 'second@example.com', 100.0)
+    assert token_cache.get('first') == 'first@example.com'
+
+    token_cache.add('third', 'third@example.com', 100.0)
+    assert token_cache.get('second') is None
+    assert token_cache.get('first') == 'first@example.com'
+    assert token_cache.get('third') == 'third@example.com'
+    assert set(token_cache.keys_by_email) == {
+        'first@example.com', 'third@example.com'}
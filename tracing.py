@@ -0,0 +1,377 @@
+"""This file contains an in-process tracing facility. A request is sampled
+when it starts with the TRACE_SAMPLE_RATE probability, spans of views,
+services, data access objects and SQL statements of sampled requests are
+collected in memory and written to TRACE_FILE in the Chrome trace or
+OTLP-JSON format. Nothing is wrapped if TRACE_SAMPLE_RATE is 0"""
+import json
+import os
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+from time import time_ns
+from typing import Any, Callable, Iterator
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from constants import (
+    TRACE_SAMPLE_RATE, TRACE_FILE, TRACE_FORMAT, TRACE_BUFFER_TRACES,
+    TRACE_STATEMENT_CHARS, API_TITLE)
+# --------------------------------------------------------------------------
+
+
+class Trace:
+    """The Trace class keeps finished spans of the one sampled request"""
+    __slots__ = ('trace_id', 'spans')
+
+    def __init__(self) -> None:
+        """Initialize the Trace class"""
+        self.trace_id = random.getrandbits(128)
+        self.spans: list[Span] = []
+
+
+class Span:
+    """The Span class represents a timed operation of the sampled request"""
+    __slots__ = (
+        'name', 'kind', 'trace', 'span_id', 'parent_id', 'start', 'end',
+        'attributes', 'error')
+
+    def __init__(
+            self, name: str, kind: str, trace: Trace,
+            parent: 'Span | None' = None, **attributes: Any
+    ) -> None:
+        """Initialize the Span class
+        :param name: the name of the operation
+        :param kind: a kind of the operation ('http', 'service', 'dao',
+        'sql' or 'internal')
+        :param trace: the Trace the span belongs to
+        :param parent: the parent Span or None for the root span
+        :param attributes: attributes of the operation
+        """
+        self.name = name
+        self.kind = kind
+        self.trace = trace
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent.span_id if parent else None
+        self.start = time_ns()
+        self.end = 0
+        self.attributes = attributes
+        self.error = None
+
+    def finish(self, error: BaseException | None = None) -> None:
+        """This method stops the span and adds it to the trace
+        :param error: an exception raised by the operation or None
+        """
+        self.end = time_ns()
+        if error is not None:
+            self.error = repr(error)
+        self.trace.spans.append(self)
+
+    def child(self, name: str, kind: str, **attributes: Any) -> 'Span':
+        """This method starts a nested span
+        :param name: the name of the operation
+        :param kind: a kind of the operation
+        :param attributes: attributes of the operation
+        :return: a new Span
+        """
+        return Span(name, kind, self.trace, self, **attributes)
+
+
+current_span: ContextVar[Span | None] = ContextVar(
+    'current_span', default=None)
+
+
+@contextmanager
+def span(name: str, kind: str = 'internal', **attributes: Any
+         ) -> Iterator[Span | None]:
+    """This function measures the operation running inside the with block
+    as a nested span if the current request is sampled
+    :param name: the name of the operation
+    :param kind: a kind of the operation
+    :param attributes: attributes of the operation
+    :return: the new Span or None if the request is not sampled
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    new_span = parent.child(name, kind, **attributes)
+    token = current_span.set(new_span)
+    try:
+        yield new_span
+    except BaseException as e:
+        new_span.finish(e)
+        raise
+    else:
+        new_span.finish()
+    finally:
+        current_span.reset(token)
+
+
+def traced(name: str | None = None, kind: str = 'internal') -> Callable:
+    """This function returns a decorator measuring every call of a function
+    or a coroutine function as a span
+    :param name: the name of spans, the qualified name of the function is
+    used by default
+    :param kind: a kind of spans
+    :return: the decorator
+    """
+    def decorator(func: Callable) -> Callable:
+        if not TRACE_SAMPLE_RATE:
+            return func
+        span_name = name or func.__qualname__
+
+        if iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                if current_span.get() is None:
+                    return await func(*args, **kwargs)
+                with span(span_name, kind):
+                    return await func(*args, **kwargs)
+        else:
+            @wraps(func)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                if current_span.get() is None:
+                    return func(*args, **kwargs)
+                with span(span_name, kind):
+                    return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def trace_methods(kind: str) -> Callable[[type], type]:
+    """This function returns a class decorator measuring calls of all
+    coroutine methods defined in the class. Asynchronous generators are not
+    wrapped because they can be iterated by another task
+    :param kind: a kind of spans
+    :return: the class decorator
+    """
+    def decorator(cls: type) -> type:
+        for attribute, value in list(vars(cls).items()):
+            if not attribute.startswith('__') and iscoroutinefunction(value):
+                setattr(cls, attribute, traced(
+                    f'{cls.__name__}.{attribute}', kind)(value))
+        return cls
+
+    return decorator
+
+
+class TraceExporter:
+    """The TraceExporter class buffers finished traces and appends them to
+    the file of the current process, the process id is added to the name of
+    the file so worker processes never write the same file. The Chrome
+    trace format is a JSON array which is allowed to be
+    left without the closing bracket, so the file can be opened by
+    chrome://tracing or Perfetto at any moment. The OTLP-JSON format has one
+    ExportTraceServiceRequest per line as written by the file exporter of
+    the OpenTelemetry Collector"""
+    def __init__(
+            self, filename: str = TRACE_FILE, file_format: str = TRACE_FORMAT,
+            buffer_traces: int = TRACE_BUFFER_TRACES
+    ) -> None:
+        """Initialize the TraceExporter class
+        :param filename: the name of the file to append traces to, the
+        process id is inserted before the extension
+        :param file_format: 'chrome' or 'otlp'
+        :param buffer_traces: an amount of traces to keep before writing
+        """
+        self.filename = filename
+        self.file_format = file_format
+        self.buffer_traces = buffer_traces
+        self.traces: list[Trace] = []
+
+    @property
+    def path(self) -> str:
+        """This property returns the name of the file of the current process.
+        It is made on every call, so a forked process gets its own file
+        :return: the file name with the process id
+        """
+        stem, extension = os.path.splitext(self.filename)
+        return f'{stem}.{os.getpid()}{extension}'
+
+    def add(self, trace: Trace) -> None:
+        """This method buffers the finished trace and writes the buffer when
+        it is full
+        :param trace: the finished Trace
+        """
+        self.traces.append(trace)
+        if len(self.traces) >= self.buffer_traces:
+            self.flush()
+
+    @staticmethod
+    def _to_chrome(trace: Trace) -> list[dict[str, Any]]:
+        """This method converts the trace to complete events of the Chrome
+        trace format, every trace is shown as a separate thread
+        :param trace: the Trace to convert
+        :return: a list of events
+        """
+        return [{
+            'name': s.name, 'cat': s.kind, 'ph': 'X',
+            'ts': s.start / 1000, 'dur': (s.end - s.start) / 1000,
+            'pid': os.getpid(), 'tid': trace.trace_id & 0xffffffff,
+            'args': s.attributes | ({'error': s.error} if s.error else {})
+        } for s in trace.spans]
+
+    @staticmethod
+    def _to_otlp(traces: list[Trace]) -> dict[str, Any]:
+        """This method converts the traces to an OTLP-JSON
+        ExportTraceServiceRequest
+        :param traces: a list of Traces to convert
+        :return: a dictionary with resource spans
+        """
+        spans = [{
+            'traceId': f'{trace.trace_id:032x}',
+            'spanId': f'{s.span_id:016x}',
+            'parentSpanId': f'{s.parent_id:016x}' if s.parent_id else '',
+            'name': s.name,
+            'kind': 2 if s.kind == 'http' else 3 if s.kind == 'sql' else 1,
+            'startTimeUnixNano': str(s.start),
+            'endTimeUnixNano': str(s.end),
+            'attributes': [
+                {'key': key, 'value': {'stringValue': str(value)}}
+                for key, value in s.attributes.items()],
+            'status': {'code': 2, 'message': s.error} if s.error
+            else {'code': 1}
+        } for trace in traces for s in trace.spans]
+        return {'resourceSpans': [{
+            'resource': {'attributes': [{
+                'key': 'service.name', 'value': {'stringValue': API_TITLE}}]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': spans}]
+        }]}
+
+    def flush(self) -> None:
+        """This method appends buffered traces to the file"""
+        if not self.traces:
+            return
+        traces, self.traces = self.traces, []
+        try:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                if self.file_format == 'otlp':
+                    f.write(json.dumps(self._to_otlp(traces)) + '\n')
+                    return
+                if not f.tell():
+                    f.write('[\n')
+                f.write(''.join(
+                    json.dumps(e) + ',\n'
+                    for trace in traces for e in self._to_chrome(trace)))
+        except Exception as e:
+            print(f'Cannot write traces, error: {e}')
+
+
+exporter = TraceExporter()
+
+
+class TracingMiddleware:
+    """The TracingMiddleware class starts a trace for sampled HTTP requests.
+    The root span is named after the view which handled the request and
+    lasts until the response is sent completely"""
+    def __init__(self, app: Any) -> None:
+        """Initialize the TracingMiddleware class
+        :param app: the ASGI application to wrap
+        """
+        self.app = app
+
+    async def __call__(self, scope: dict, receive: Callable,
+                       send: Callable) -> None:
+        """This method handles the ASGI call
+        :param scope: the ASGI connection scope
+        :param receive: the ASGI receive channel
+        :param send: the ASGI send channel
+        """
+        if (scope['type'] != 'http'
+                or random.random() >= TRACE_SAMPLE_RATE):
+            await self.app(scope, receive, send)
+            return
+
+        root = Span(
+            f'{scope["method"]} {scope["path"]}', 'http', Trace(),
+            **{'http.method': scope['method'],
+               'http.target': scope['path']})
+
+        async def send_wrapper(message: dict) -> None:
+            if message['type'] == 'http.response.start':
+                root.attributes['http.status_code'] = message['status']
+            await send(message)
+
+        token = current_span.set(root)
+        error = None
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            current_span.reset(token)
+            route = scope.get('route')
+            if route is not None:
+                root.name = route.name
+                root.attributes['http.route'] = route.path
+            root.finish(error)
+            exporter.add(root.trace)
+
+
+def _before_cursor_execute(
+        conn: Any, cursor: Any, statement: str, parameters: Any,
+        context: Any, executemany: bool) -> None:
+    """This function starts a span of the SQL statement"""
+    parent = current_span.get()
+    if parent is not None:
+        context._trace_span = parent.child(
+            statement.split(None, 1)[0].upper(), 'sql', **{
+                'db.system': 'postgresql',
+                'db.statement': statement[:TRACE_STATEMENT_CHARS]})
+
+
+def _after_cursor_execute(
+        conn: Any, cursor: Any, statement: str, parameters: Any,
+        context: Any, executemany: bool) -> None:
+    """This function finishes the span of the SQL statement"""
+    statement_span = getattr(context, '_trace_span', None)
+    if statement_span is not None:
+        statement_span.finish()
+        context._trace_span = None
+
+
+def _handle_error(exception_context: Any) -> None:
+    """This function finishes the span of the failed SQL statement"""
+    context = exception_context.execution_context
+    statement_span = getattr(context, '_trace_span', None)
+    if statement_span is not None:
+        statement_span.finish(exception_context.original_exception)
+        context._trace_span = None
+
+
+def _before_commit(session: Session) -> None:
+    """This function starts a span of the commit including the flush"""
+    parent = current_span.get()
+    if parent is not None:
+        session.info['trace_span'] = parent.child('COMMIT', 'sql')
+
+
+def _after_commit(session: Session) -> None:
+    """This function finishes the span of the commit"""
+    commit_span = session.info.pop('trace_span', None)
+    if commit_span is not None:
+        commit_span.finish()
+
+
+def _after_soft_rollback(session: Session, previous_transaction: Any) -> None:
+    """This function finishes the span of the failed commit"""
+    commit_span = session.info.pop('trace_span', None)
+    if commit_span is not None:
+        commit_span.finish(RuntimeError('The transaction is rolled back'))
+
+
+def instrument_sqlalchemy() -> None:
+    """This function registers listeners creating spans of SQL statements
+    and commits of all engines and sessions"""
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _handle_error)
+    event.listen(Session, 'before_commit', _before_commit)
+    event.listen(Session, 'after_commit', _after_commit)
+    event.listen(Session, 'after_soft_rollback', _after_soft_rollback)
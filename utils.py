@@ -1,23 +1,88 @@
 """This file contains utility functions"""
+import hashlib
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from calendar import timegm
+from time import time
+from typing import AsyncIterable, AsyncIterator
 import jwt
-from fastapi import HTTPException, status
+from fastapi import HTTPException, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
+from admission import AdmittedSession, admission, get_priority, take_slot
 from constants import (
-    JWT_SECRET, JWT_ALGO, JWT_EXP_HOURS, API_DESCRIPTION, README_FILE)
-from dao import SessionLocal
+    JWT_SECRET, JWT_ALGO, JWT_EXP_HOURS, API_DESCRIPTION, README_FILE,
+    TOKEN_CACHE_SIZE, STORAGE_BACKEND)
+from dao import get_engine, get_session_maker
+from tracing import traced
 # --------------------------------------------------------------------------
 
 
-async def get_db() -> AsyncSession:
-    """This function returns a database session
-    :return: AsyncSession instance
+async def get_db(request: Request) -> AsyncIterator[AsyncSession]:
+    """This function provides a database session which is closed and
+    returns its connection to the pool after the request. The session holds
+    a slot of the admission control while it is open. The memory backend
+    doesn't use sessions, so None is provided and no engine is created
+    :param request: the request to take the priority of the slot from
+    :return: AsyncSession instance or None for the memory backend
     """
-    async with SessionLocal() as db:
-        return db
+    if STORAGE_BACKEND == 'memory':
+        yield None
+        return
+    admitted = await take_slot(get_priority(request.method))
+    try:
+        async with get_session_maker()() as db:
+            yield db
+    finally:
+        if admitted:
+            admission.release()
+
+
+async def get_replica_db(request: Request) -> AsyncIterator[AsyncSession]:
+    """This function provides a database session connected to the read
+    replica or to the primary database if the replica is not configured.
+    The session holds its own slot of the admission control while it is
+    open. None is provided for the memory backend
+    :param request: the request to take the priority of the slot from
+    :return: AsyncSession instance or None for the memory backend
+    """
+    if STORAGE_BACKEND == 'memory':
+        yield None
+        return
+    admitted = await take_slot(get_priority(request.method))
+    try:
+        async with get_session_maker(replica=True)() as db:
+            yield db
+    finally:
+        if admitted:
+            admission.release()
+
+
+async def get_lazy_db(request: Request) -> AsyncIterator[AsyncSession]:
+    """This function provides a database session for routes which are
+    usually served from the shared snapshot or a cache. The slot of the
+    admission control is taken only when the session procures a connection.
+    Routes whose dao methods catch exceptions must use get_db, otherwise the
+    503-exception of a shed request would be caught. None is provided for
+    the memory backend
+    :param request: the request to take the priority of the slot from
+    :return: AsyncSession instance or None for the memory backend
+    """
+    if STORAGE_BACKEND == 'memory':
+        yield None
+        return
+    db = AsyncSession(
+        get_engine(), sync_session_class=AdmittedSession,
+        expire_on_commit=False,
+        info={'admission_priority': get_priority(request.method)})
+    try:
+        async with db:
+            yield db
+    finally:
+        if db.info.get('admitted'):
+            admission.release()
 
 
+@traced('jwt.encode')
 def create_token(email: str) -> dict[str, str]:
     """This function creates a new token
     :param email: an email address to create a token for
@@ -32,6 +97,7 @@ def create_token(email: str) -> dict[str, str]:
     return {'access_token': access_token}
 
 
+@traced('jwt.decode')
 def decode_token(access_token: str) -> dict[str, str]:
     """This function serves to decode a provided token
     :param access_token: a string representing the access token
@@ -48,6 +114,76 @@ def decode_token(access_token: str) -> dict[str, str]:
             detail=f'Cannot confirm credentials, error: {e}')
 
 
+class TokenCache:
+    """The TokenCache class keeps emails of verified tokens until the tokens
+    expire, so a token used by many requests is decoded and validated only
+    once. Keys are hashes of tokens, the least recently used token is
+    removed when the cache is full"""
+    def __init__(self, size: int = TOKEN_CACHE_SIZE) -> None:
+        """Initialize the TokenCache class
+        :param size: the maximum amount of tokens, 0 disables the cache
+        """
+        self.size = size
+        self.emails: OrderedDict[bytes, tuple[str, float]] = OrderedDict()
+        self.keys_by_email: dict[str, set[bytes]] = {}
+
+    @staticmethod
+    def _get_key(access_token: str) -> bytes:
+        """This method hashes the token
+        :param access_token: a string representing the access token
+        :return: the digest of the token
+        """
+        return hashlib.blake2b(access_token.encode(), digest_size=16).digest()
+
+    def _remove(self, key: bytes) -> None:
+        """This method removes the token from the cache
+        :param key: the digest of the token
+        """
+        email, _ = self.emails.pop(key)
+        keys = self.keys_by_email[email]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_email[email]
+
+    def get(self, access_token: str) -> str | None:
+        """This method returns the email of the verified token
+        :param access_token: a string representing the access token
+        :return: the email or None if the token is not cached or expired
+        """
+        key = self._get_key(access_token)
+        cached = self.emails.get(key)
+        if cached is None:
+            return None
+        if cached[1] <= time():
+            self._remove(key)
+            return None
+        self.emails.move_to_end(key)
+        return cached[0]
+
+    def add(self, access_token: str, email: str, expires: float) -> None:
+        """This method stores the email of the verified token
+        :param access_token: a string representing the access token
+        :param email: the email address from the token
+        :param expires: the expiration time of the token as a timestamp
+        """
+        if not self.size:
+            return
+        key = self._get_key(access_token)
+        if key in self.emails:
+            self._remove(key)
+        self.emails[key] = (email, expires)
+        self.keys_by_email.setdefault(email, set()).add(key)
+        while len(self.emails) > self.size:
+            self._remove(next(iter(self.emails)))
+
+    def invalidate(self, email: str) -> None:
+        """This method removes all tokens of the user
+        :param email: the email address of the user
+        """
+        for key in self.keys_by_email.pop(email, ()):
+            del self.emails[key]
+
+
 def read_from_file(filename: str) -> str:
     """This function serves to load data from file by provided filename
     :param filename: the name of the file to read
@@ -72,3 +208,64 @@ def get_description() -> str:
         description = API_DESCRIPTION
 
     return description
+
+
+async def iter_lines(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """This function serves to split a stream of byte chunks into lines
+    keeping only the current incomplete line in memory
+    :param chunks: an asynchronous iterable of byte chunks
+    :return: an asynchronous iterator of decoded lines without line breaks
+    """
+    tail = b''
+    async for chunk in chunks:
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line.rstrip(b'\r').decode('utf-8-sig', errors='replace')
+    if tail.strip():
+        yield tail.rstrip(b'\r').decode('utf-8-sig', errors='replace')
+
+
+def make_etag(version: int) -> str:
+    """This function serves to create an ETag header value from a version
+    :param version: the version to create the ETag for
+    :return: a string containing the quoted version
+    """
+    return f'"{version}"'
+
+
+def parse_etag(etag: str | None) -> int | None:
+    """This function serves to get a version from an If-Match or
+    If-None-Match header value
+    :param etag: the header value, '*' and None mean any version
+    :return: the version or None if any version is acceptable
+    """
+    if not etag or etag.strip() == '*':
+        return None
+    try:
+        return int(etag.strip().removeprefix('W/').strip('"'))
+
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'Invalid ETag: {etag}')
+
+
+def is_not_modified(if_none_match: str | None, etag: str) -> bool:
+    """This function serves to check whether the client already has the
+    representation with the ETag. Weak and strong ETags are compared in the
+    same way as it is required for If-None-Match
+    :param if_none_match: the If-None-Match header value
+    :param etag: the current ETag
+    :return: True if the client's representation is up to date or False
+    otherwise
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    current = etag.removeprefix('W/')
+
+    return any(
+        tag.strip().removeprefix('W/') == current
+        for tag in if_none_match.split(','))